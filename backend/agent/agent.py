@@ -1,13 +1,28 @@
 import os
+import re
+import asyncio
 import logging
-from typing import Optional
+from typing import Awaitable, Callable, Dict, List, Optional
 from agents import Agent, Runner, trace, WebSearchTool, ModelSettings, function_tool
-from .models.search_models import WebSearchResult
-from .models.scorer_models import ScorerResult
+from .models.search_models import WebSearchResult, IngredientSchema
+from .models.scorer_models import ScorerResult, IngredientScoreSchema
 from .models.reccomender_models import ReccomenderResult
+from .prefetch import SpeculativeResultStore
+from .single_flight import SingleFlight
 from .tools.db_tools import mcp_params
 from agents.mcp import MCPServerStdio
+from .mcp_pool import MCPServerPool
 from .system_prompts import instructions
+from .scoring import compute_overall_score
+from .ingredient_kb import IngredientKnowledgeBase
+from .personalization import PersonalizationOverlay
+from .reccomendation_index import ReccomendationIndex
+from utils.cache import PersistentCache, normalize_key
+from utils.product_catalog import product_catalog
+from utils.product_names import ProductNameIndex, canonicalize_product_name
+from utils.metrics import record_usage, track_stage
+from utils.resilience import CircuitBreaker, CircuitOpenError, ResilientUpstream, deadline_scope, stage_timeout
+from config import settings
 from dotenv import load_dotenv
 
 # Configure logging
@@ -46,9 +61,221 @@ reccomender_agent = Agent(
     output_type=ReccomenderResult
 )
 
+# Bounds concurrent OpenAI agent runs, created per event loop on first use
+_openai_semaphore: Optional[asyncio.Semaphore] = None
+_openai_semaphore_loop: Optional[asyncio.AbstractEventLoop] = None
+
+def _get_openai_semaphore() -> asyncio.Semaphore:
+    global _openai_semaphore, _openai_semaphore_loop
+    loop = asyncio.get_running_loop()
+    if _openai_semaphore is None or _openai_semaphore_loop is not loop:
+        _openai_semaphore = asyncio.Semaphore(settings.openai_max_concurrency)
+        _openai_semaphore_loop = loop
+    return _openai_semaphore
+
+# Shared by every agent: fails fast while OpenAI is down
+openai_breaker = CircuitBreaker(
+    "openai",
+    failure_threshold=settings.circuit_failure_threshold,
+    reset_seconds=settings.circuit_reset_seconds,
+)
+
+# Per-agent deadlines and hedging, created on first use
+agent_upstreams: Dict[str, ResilientUpstream] = {}
+_hedge_agents: Dict[str, Agent] = {}
+
+def _upstream_for(agent: Agent, hedge: bool) -> ResilientUpstream:
+    name = f"agent.{agent.name}"
+    upstream = agent_upstreams.get(name)
+    if upstream is None:
+        upstream = agent_upstreams[name] = ResilientUpstream(
+            name,
+            openai_breaker,
+            timeout=settings.openai_timeout_seconds,
+            hedge=settings.hedge_enabled and hedge,
+            min_hedge_delay=settings.hedge_min_delay_seconds,
+            min_samples=settings.hedge_min_samples,
+            slots=_get_openai_semaphore,
+        )
+    return upstream
+
+def _hedge_agent(agent: Agent) -> Agent:
+    """The agent to send hedged duplicates to, on OPENAI_HEDGE_MODEL if set"""
+    if not settings.openai_hedge_model:
+        return agent
+    hedge_agent = _hedge_agents.get(agent.name)
+    if hedge_agent is None:
+        hedge_agent = _hedge_agents[agent.name] = agent.clone(model=settings.openai_hedge_model)
+    return hedge_agent
+
+async def _run_agent(agent: Agent, input_data: str, hedge: bool = True):
+    """
+    Runs an agent through Runner.run while holding the OpenAI concurrency slot,
+    recording its latency, token usage and estimated cost.
+
+    Each attempt is bounded by OPENAI_TIMEOUT_SECONDS and the request deadline,
+    counted from when it gets its slot.
+    Runs slower than the agent's recent p95 are hedged with a duplicate unless
+    hedge is False (agents with side effects).
+    """
+    async def attempt(hedged: bool):
+        run_agent = _hedge_agent(agent) if hedged else agent
+        with track_stage(f"agent.{agent.name}"):
+            result = await Runner.run(run_agent, input_data)
+
+        usage = getattr(getattr(result, "context_wrapper", None), "usage", None)
+        if usage is not None:
+            record_usage(str(run_agent.model), usage.input_tokens, usage.output_tokens)
+        return result
+
+    return await _upstream_for(agent, hedge).call(attempt)
+
+# Warm MCP servers for the user preferences agent, started with the API server
+preferences_mcp_pool = MCPServerPool(
+    mcp_params,
+    size=settings.mcp_pool_size,
+    checkout_timeout=settings.mcp_checkout_timeout_seconds,
+    health_check_interval=settings.mcp_health_check_interval_seconds,
+)
+
+# Product-level caches keyed on the canonical product name (see product_key)
+# and kept past their TTL as a fallback while OpenAI is unavailable
+web_search_cache = PersistentCache(
+    "web_search",
+    max_entries=settings.analysis_cache_max_entries,
+    ttl_seconds=settings.analysis_cache_ttl_seconds,
+    stale_seconds=settings.stale_cache_seconds,
+)
+scorer_cache = PersistentCache(
+    "scorer",
+    max_entries=settings.analysis_cache_max_entries,
+    ttl_seconds=settings.analysis_cache_ttl_seconds,
+    stale_seconds=settings.stale_cache_seconds,
+)
+
+# Alternatives from reccomender runs made before the score was known (prefetch,
+# cache warmer), filtered by the real score when served
+reccomender_cache = PersistentCache(
+    "reccomender",
+    max_entries=settings.analysis_cache_max_entries,
+    ttl_seconds=settings.reccomendation_cache_ttl_seconds,
+)
+
+# Product names as first extracted for each scorer cache key, shown in reccomendations
+product_display_names = PersistentCache(
+    "product_display_names",
+    max_entries=settings.analysis_cache_max_entries,
+    ttl_seconds=settings.analysis_cache_ttl_seconds,
+)
+
+# Generic per-ingredient scores keyed on the normalized ingredient name
+ingredient_score_cache = PersistentCache(
+    "ingredient_scores",
+    max_entries=settings.ingredient_cache_max_entries,
+    ttl_seconds=settings.ingredient_cache_ttl_seconds,
+)
+
+# Deterministic scores for well-known ingredients, consulted before the scorer agent
+ingredient_kb: Optional[IngredientKnowledgeBase] = (
+    IngredientKnowledgeBase.load(settings.ingredient_kb_file) if settings.ingredient_kb_enabled else None
+)
+
+# Applies allergies, avoid lists and diet goals to generic scores locally
+personalization = PersonalizationOverlay(ingredient_kb)
+
+# Resolves free-form product names to the canonical name already cached under,
+# seeded with the products the web search cache already knows
+product_names = ProductNameIndex(
+    threshold=settings.product_match_threshold,
+    scan_budget=settings.product_match_scan_budget,
+)
+for _cached_name, _ in web_search_cache.items():
+    product_names.add(canonicalize_product_name(_cached_name))
+
+def product_key(product_name: str, add: bool = True) -> str:
+    """
+    Cache key for a product: "Coca-Cola Classic 12 fl oz" and "coca cola"
+    share one key, so size and wording variants reuse the same analysis.
+    """
+    return product_names.resolve(product_name, add=add)
+
+# Scored products by category and overall score, answering most reccomendation
+# requests without the reccomender agent. Seeded from the scorer cache.
+reccomendation_index = ReccomendationIndex(
+    min_results=settings.reccomendation_index_min_results,
+    min_gain=settings.reccomendation_index_min_gain,
+)
+if settings.reccomendation_index_enabled:
+    _display_names = dict(product_display_names.items())
+    for _cached_key, _cached_result in scorer_cache.items():
+        reccomendation_index.add(
+            _cached_key,
+            _display_names.get(_cached_key) or _cached_key.title(),
+            ScorerResult.model_validate(_cached_result),
+        )
+
+def _index_scored_product(cache_key: str, product_name: str, result: ScorerResult) -> None:
+    if settings.reccomendation_index_enabled:
+        reccomendation_index.add(cache_key, product_name, result)
+
+def reccomendations_covered_locally(product_name: str) -> bool:
+    """
+    True when the product's category holds enough analyzed products that
+    reccomendations are expected to come from the local index.
+    """
+    if not settings.reccomendation_index_enabled:
+        return False
+    category = reccomendation_index.category_of(product_key(product_name, add=False), product_name)
+    return reccomendation_index.category_size(category) >= settings.reccomendation_index_dense_size
+
+# Reccomender runs started speculatively while the product is still being scored
+reccomendation_prefetch = SpeculativeResultStore(
+    ttl_seconds=settings.reccomendation_prefetch_ttl_seconds,
+)
+
+# Coalesces identical concurrent web search and scorer runs, each shared run on its own request deadline
+single_flight = SingleFlight(deadline_seconds=settings.request_deadline_seconds)
+
+def invalidate_product(product_name: str) -> bool:
+    """
+    Drops cached web search, scorer and reccomender results for a product.
+
+    Args:
+        product_name (str): The product name as returned by extraction.
+
+    Returns:
+        bool: True if any cached entry was removed.
+    """
+    cache_key = product_key(product_name, add=False)
+    removed_search = web_search_cache.invalidate(cache_key)
+    removed_score = scorer_cache.invalidate(cache_key)
+    removed_reccomendations = reccomender_cache.invalidate(cache_key)
+    product_display_names.invalidate(cache_key)
+    reccomendation_index.remove(cache_key)
+    return removed_search or removed_score or removed_reccomendations
+
+def cache_stats() -> dict:
+    """
+    Returns hit/miss counters for the product-level caches.
+    """
+    return {
+        "web_search": web_search_cache.stats(),
+        "catalog": product_catalog.stats() if settings.catalog_enabled else None,
+        "product_names": product_names.stats(),
+        "scorer": scorer_cache.stats(),
+        "reccomender": reccomender_cache.stats(),
+        "reccomendation_index": reccomendation_index.stats(),
+        "ingredient_scores": ingredient_score_cache.stats(),
+        "ingredient_kb": ingredient_kb.stats() if ingredient_kb else None,
+        "personalization": personalization.stats(),
+        "reccomendation_prefetch": reccomendation_prefetch.stats(),
+        "single_flight": single_flight.stats(),
+    }
+
 async def run_web_search_agent(product_name: str) -> WebSearchResult:
     """
     Runs the web search agent to find product ingredient information.
+    Products found in the offline catalog are answered without the agent.
 
     Args:
         product_name (str): The name of the product to search for.
@@ -56,68 +283,334 @@ async def run_web_search_agent(product_name: str) -> WebSearchResult:
     Returns:
         WebSearchResult: The result containing a list of ingredients found in the product.
     """
-    logger.info(f"Running web search agent for product: {product_name}")
-    
-    result = await Runner.run(web_search_agent, product_name)
-    
-    logger.info("Web search agent completed successfully")
-    
-    return result.final_output
+    cache_key = product_key(product_name)
+    cached = web_search_cache.get(cache_key)
+    if cached is not None:
+        logger.info(f"Web search cache hit for product: {product_name}")
+        return WebSearchResult.model_validate(cached)
+
+    async def search() -> WebSearchResult:
+        if settings.catalog_enabled:
+            product = await asyncio.to_thread(product_catalog.lookup, product_name)
+            if product is not None:
+                logger.info(f"Catalog hit for product: {product_name} (barcode {product['barcode']})")
+                output = WebSearchResult(List_of_ingredients=product["ingredients"])
+                web_search_cache.set(cache_key, output.model_dump())
+                return output
+
+        logger.info(f"Running web search agent for product: {product_name}")
+        
+        result = await _run_agent(web_search_agent, product_name)
+        
+        logger.info("Web search agent completed successfully")
 
-async def run_scorer_agent(ingredients: str, user_preferences: Optional[dict] = None) -> ScorerResult:
+        web_search_cache.set(cache_key, result.final_output.model_dump())
+        return result.final_output
+
+    try:
+        output, coalesced = await single_flight.do(f"web_search:{cache_key}", search)
+    except (CircuitOpenError, TimeoutError) as exc:
+        stale = web_search_cache.get_stale(cache_key)
+        if stale is None:
+            raise
+        logger.warning(f"Serving stale web search result for {product_name}: {exc}")
+        return WebSearchResult.model_validate(stale)
+    if coalesced:
+        logger.info(f"Joined in-flight web search for product: {product_name}")
+    return output
+
+# Receives ingredient scores as soon as they are known (cache hits first)
+IngredientScoresCallback = Callable[[List[IngredientScoreSchema]], Awaitable[None]]
+
+async def run_scorer_agent(
+    ingredients: str,
+    user_preferences: Optional[dict] = None,
+    product_name: Optional[str] = None,
+    on_ingredient_scores: Optional[IngredientScoresCallback] = None,
+) -> ScorerResult:
     """
     Runs the scorer agent to evaluate the relevance and quality of ingredient information.
 
     Args:
         ingredients (str): JSON string containing a list of ingredients with their descriptions.
         user_preferences (dict, optional): User preferences including allergies, dietGoals, and avoidIngredients.
+        product_name (str, optional): Product name used to cache generic (preference-free) results.
+        on_ingredient_scores (callable, optional): Awaited with partial ingredient scores as they become available.
 
     Returns:
-        ScorerResult: The result containing the relevance scores for each ingredient.
+        ScorerResult: The result containing the relevance scores for each ingredient,
+            a PersonalizedScorerResult with flags when user_preferences are given.
     """
-    logger.info("Running scorer agent to evaluate product safety")
-    
-    # Build input with user preferences if provided
-    input_data = ingredients
+    # Scores are always generic and shareable; preferences are applied locally afterwards
     if user_preferences:
-        preferences_text = "USER PREFERENCES:\n"
-        if user_preferences.get("allergies"):
-            preferences_text += f"- Allergies: {', '.join(user_preferences['allergies'])}\n"
-        if user_preferences.get("dietGoals"):
-            preferences_text += f"- Diet Goals: {', '.join(user_preferences['dietGoals'])}\n"
-        if user_preferences.get("avoidIngredients"):
-            preferences_text += f"- Ingredients to Avoid: {', '.join(user_preferences['avoidIngredients'])}\n"
-        
-        input_data = f"{preferences_text}\n{ingredients}"
-        logger.info(f"Scorer agent input includes user preferences: {user_preferences}")
+        descriptions = _ingredient_descriptions(ingredients)
+        generic_callback = None
+        if on_ingredient_scores:
+            async def generic_callback(scores: List[IngredientScoreSchema]) -> None:
+                personalized, _ = personalization.apply_to_scores(scores, user_preferences, descriptions)
+                await on_ingredient_scores(personalized)
 
-    result = await Runner.run(scorer_agent, input_data)
-    
-    logger.info("Scorer agent completed successfully")
-    
-    return result.final_output
+        result = await run_scorer_agent(ingredients, product_name=product_name, on_ingredient_scores=generic_callback)
+        return personalization.apply(result, user_preferences, descriptions)
+
+    cache_key = product_key(product_name) if product_name else None
+    if cache_key:
+        cached = scorer_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"Scorer cache hit for product: {product_name}")
+            result = ScorerResult.model_validate(cached)
+            if cache_key not in reccomendation_index:
+                # Scored by another process, e.g. the cache warmer
+                _index_scored_product(cache_key, product_name, result)
+            if on_ingredient_scores:
+                await on_ingredient_scores(result.ingredient_scores)
+            return result
+
+    async def score() -> ScorerResult:
+        result = await _run_generic_scorer(ingredients, on_ingredient_scores)
+        if cache_key:
+            scorer_cache.set(cache_key, result.model_dump())
+            product_display_names.set(cache_key, product_name)
+            _index_scored_product(cache_key, product_name, result)
+        return result
+
+    if not product_name:
+        return await score()
+
+    flight_key = f"scorer:{cache_key}"
+    try:
+        result, coalesced = await single_flight.do(flight_key, score)
+    except (CircuitOpenError, TimeoutError) as exc:
+        stale = scorer_cache.get_stale(cache_key)
+        if stale is None:
+            raise
+        logger.warning(f"Serving stale scores for {product_name}: {exc}")
+        result = ScorerResult.model_validate(stale)
+        if on_ingredient_scores:
+            await on_ingredient_scores(result.ingredient_scores)
+        return result
+    if coalesced:
+        # Partial scores went to the caller that started the run
+        logger.info(f"Joined in-flight scorer run for product: {product_name}")
+        if on_ingredient_scores:
+            await on_ingredient_scores(result.ingredient_scores)
+    return result
+
+def _ingredient_descriptions(ingredients: str) -> Dict[str, str]:
+    """Ingredient descriptions by normalized name, empty when the input is not a WebSearchResult"""
+    try:
+        product = WebSearchResult.model_validate_json(ingredients)
+    except ValueError:
+        return {}
+    return {normalize_key(ingredient.name): ingredient.description for ingredient in product.List_of_ingredients}
+
+async def _run_generic_scorer(
+    ingredients: str,
+    on_ingredient_scores: Optional[IngredientScoresCallback] = None,
+) -> ScorerResult:
+    """
+    Scores ingredients without user preferences, sending only the ingredients
+    missing from both the per-ingredient cache and the ingredient knowledge
+    base to the scorer agent.
+    """
+    try:
+        product = WebSearchResult.model_validate_json(ingredients)
+    except ValueError:
+        logger.warning("Scorer input is not a WebSearchResult, scoring without ingredient cache")
+        result = await _run_agent(scorer_agent, ingredients)
+        if on_ingredient_scores:
+            await on_ingredient_scores(result.final_output.ingredient_scores)
+        return result.final_output
+
+    keys = [normalize_key(ingredient.name) for ingredient in product.List_of_ingredients]
+    cached = ingredient_score_cache.get_many(keys)
+    scores: Dict[str, IngredientScoreSchema] = {
+        key: IngredientScoreSchema.model_validate(value) for key, value in cached.items()
+    }
+
+    missing: List[IngredientSchema] = []
+    seen = set(scores)
+    for key, ingredient in zip(keys, product.List_of_ingredients):
+        if key not in seen:
+            seen.add(key)
+            missing.append(ingredient)
+
+    known = 0
+    if ingredient_kb is not None:
+        unknown: List[IngredientSchema] = []
+        for ingredient in missing:
+            score = ingredient_kb.prescore(ingredient.name)
+            if score is None:
+                unknown.append(ingredient)
+            else:
+                scores[normalize_key(ingredient.name)] = score
+        known = len(missing) - len(unknown)
+        missing = unknown
+
+    logger.info(
+        f"Ingredient scores: {len(product.List_of_ingredients) - len(missing) - known} cached, "
+        f"{known} from knowledge base, {len(missing)} to score"
+    )
+
+    def ordered_scores(keys_subset) -> List[IngredientScoreSchema]:
+        return [
+            scores[key].model_copy(update={"ingredient_name": ingredient.name})
+            for key, ingredient in zip(keys, product.List_of_ingredients)
+            if key in scores and key in keys_subset
+        ]
+
+    if on_ingredient_scores and scores:
+        await on_ingredient_scores(ordered_scores(set(scores)))
+
+    if missing:
+        logger.info("Running scorer agent to evaluate product safety")
+        result = await _run_agent(
+            scorer_agent,
+            WebSearchResult(List_of_ingredients=missing).model_dump_json(),
+        )
+        logger.info("Scorer agent completed successfully")
+
+        new_scores = _match_scores(missing, result.final_output.ingredient_scores)
+        scores.update(new_scores)
+        ingredient_score_cache.set_many(
+            {key: score.model_dump() for key, score in new_scores.items()}
+        )
+        if on_ingredient_scores and new_scores:
+            await on_ingredient_scores(ordered_scores(set(new_scores)))
+
+    merged = ordered_scores(set(scores))
+    return ScorerResult(
+        ingredient_scores=merged,
+        overall_score=compute_overall_score(merged),
+    )
+
+def _match_scores(
+    requested: List[IngredientSchema], returned: List[IngredientScoreSchema]
+) -> Dict[str, IngredientScoreSchema]:
+    """
+    Pairs scorer output with the requested ingredients by name, falling back to
+    position when the agent renamed an ingredient.
+    """
+    by_name = {normalize_key(score.ingredient_name): score for score in returned}
+    matched = {}
+    for index, ingredient in enumerate(requested):
+        key = normalize_key(ingredient.name)
+        score = by_name.get(key)
+        if score is None and len(returned) == len(requested):
+            score = returned[index]
+        if score is not None:
+            matched[key] = score
+    return matched
 
-async def run_reccomender_agent(product_name: str, overall_score: float) -> ReccomenderResult:
+async def run_reccomender_agent(product_name: str, overall_score: Optional[float]) -> ReccomenderResult:
     """
     Runs the reccomender agent to suggest healthier alternatives to the product.
 
     Args:
         product_name (str): The name of the product.
-        overall_score (float): The overall safety score of the product.
+        overall_score (float, optional): The overall safety score of the product, None if not yet known.
 
     Returns:
         ReccomenderResult: The result containing recommended healthier alternatives.
     """
     logger.info(f"Running reccomender agent for product: {product_name} with overall score: {overall_score}")
 
-    input_data = f"product_name: {product_name}\noverall_score: {overall_score}"
+    score_text = overall_score if overall_score is not None else "unknown"
+    input_data = f"product_name: {product_name}\noverall_score: {score_text}"
 
-    result = await Runner.run(reccomender_agent, input_data)
+    result = await _run_agent(reccomender_agent, input_data)
     
     logger.info("Reccomender agent completed successfully")
     
     return result.final_output
 
+def prefetch_reccomendations(product_name: str) -> Optional[asyncio.Task]:
+    """
+    Starts the reccomender agent in the background as soon as the product name
+    is known, so alternatives are ready when the client asks for them. The
+    result is also cached for later requests.
+
+    Args:
+        product_name (str): The name of the product.
+
+    Returns:
+        asyncio.Task: The prefetch run, or None if alternatives are already cached
+            or expected from the local reccomendation index.
+    """
+    cache_key = product_key(product_name)
+    if reccomendations_covered_locally(product_name) or reccomender_cache.get(cache_key) is not None:
+        return None
+
+    async def prefetch() -> ReccomenderResult:
+        # Outlives the request that started it, so it gets a deadline of its own
+        with deadline_scope(settings.request_deadline_seconds, inherit=False):
+            result = await run_reccomender_agent(product_name, None)
+        reccomender_cache.set(cache_key, result.model_dump())
+        return result
+
+    return reccomendation_prefetch.start(cache_key, prefetch)
+
+_NUMBER_RE = re.compile(r"\d+(?:\.\d+)?")
+
+def _health_score_value(health_score: str) -> Optional[float]:
+    """Parse a reccomender health score ("8", "8.5/10", "85/100") onto the 0-10 scale"""
+    match = _NUMBER_RE.search(health_score or "")
+    if not match:
+        return None
+    value = float(match.group())
+    return value / 10 if value > 10 else value
+
+async def get_reccomendations(product_name: str, overall_score: float) -> ReccomenderResult:
+    """
+    Returns healthier alternatives: analyzed products of the same category
+    with a higher score from the local index, else a prefetched or cached
+    reccomender result.
+
+    The prefetched run did not know the score, so its alternatives are kept
+    only if they score higher than overall_score. If none qualify the agent is
+    run again with the real score.
+
+    Args:
+        product_name (str): The name of the product.
+        overall_score (float): The overall safety score of the product.
+
+    Returns:
+        ReccomenderResult: The result containing recommended healthier alternatives.
+    """
+    cache_key = product_key(product_name, add=False)
+    if settings.reccomendation_index_enabled:
+        local = reccomendation_index.better_than(
+            cache_key, product_name, overall_score, k=settings.reccomendation_index_top_k
+        )
+        if local:
+            logger.info(f"Using {len(local)} indexed alternatives for product: {product_name}")
+            return ReccomenderResult(recommendations=local)
+
+    speculative = None
+    task = reccomendation_prefetch.get(cache_key)
+    if task is not None:
+        try:
+            # Shield so a cancelled request doesn't cancel the shared prefetch
+            speculative = await asyncio.wait_for(asyncio.shield(task), stage_timeout())
+        except Exception as exc:
+            logger.warning(f"Prefetched reccomendations failed for {product_name}: {exc}")
+    if speculative is None:
+        cached = reccomender_cache.get(cache_key)
+        if cached is not None:
+            speculative = ReccomenderResult.model_validate(cached)
+
+    if speculative is not None:
+        better = [
+            rec for rec in speculative.recommendations
+            if (value := _health_score_value(rec.health_score)) is None or value > overall_score
+        ]
+        if better:
+            logger.info(f"Using prefetched reccomendations for product: {product_name}")
+            return ReccomenderResult(recommendations=better)
+        logger.info(f"No prefetched alternative beats score {overall_score} for {product_name}")
+
+    return await run_reccomender_agent(product_name, overall_score)
+
 async def run_user_preferences_agent(preference_input: str) -> str:
     """
     Runs the user preferences agent to store or update user dietary preferences.
@@ -128,15 +621,24 @@ async def run_user_preferences_agent(preference_input: str) -> str:
         str: Confirmation message after storing/updating preferences.
     """
     logger.info("Running user preferences agent to update dietary preferences")
-    async with MCPServerStdio(params=mcp_params) as mcp_server:
-        agent = Agent(
-            name="UserPreferencesAgent",
-            instructions=instructions["USER_PREFERENCES_AGENT_INSTRUCTIONS"],
-            model="gpt-4.1-mini",
-            mcp_servers=[mcp_server]
-        )
-        result = await Runner.run(agent, preference_input)
+    if preferences_mcp_pool.available:
+        async with preferences_mcp_pool.checkout() as mcp_server:
+            await _run_user_preferences(mcp_server, preference_input)
+    else:
+        # No warm pool (e.g. outside the API server), spawn a one-off server
+        async with MCPServerStdio(params=mcp_params) as mcp_server:
+            await _run_user_preferences(mcp_server, preference_input)
     
     logger.info("User preferences agent completed successfully")
     
-    return "User preferences updated successfully."
\ No newline at end of file
+    return "User preferences updated successfully."
+
+async def _run_user_preferences(mcp_server: MCPServerStdio, preference_input: str):
+    agent = Agent(
+        name="UserPreferencesAgent",
+        instructions=instructions["USER_PREFERENCES_AGENT_INSTRUCTIONS"],
+        model="gpt-4.1-mini",
+        mcp_servers=[mcp_server]
+    )
+    # Writes preferences through MCP, so never duplicated by a hedge
+    return await _run_agent(agent, preference_input, hedge=False)
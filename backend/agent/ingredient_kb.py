@@ -0,0 +1,165 @@
+"""
+Bundled ingredient knowledge base and rule-based pre-scorer
+
+Common ingredients (canonical name, synonyms, E-number, category and default
+safety level) ship in data/ingredient_kb.tsv and are loaded into an in-memory
+index. Ingredients found there are scored deterministically; only unknown
+ones need the scorer agent.
+"""
+import logging
+import os
+import re
+import threading
+from typing import Dict, Iterable, List, NamedTuple, Optional
+from .models.scorer_models import IngredientScoreSchema
+from utils.cache import normalize_key
+
+logger = logging.getLogger(__name__)
+
+BUNDLED_KB_FILE = os.path.join(os.path.dirname(__file__), "data", "ingredient_kb.tsv")
+
+SAFETY_LEVELS = ("HIGH", "MEDIUM", "LOW")
+
+# Matches "e322", "e 150d", "ins 471" in a normalized ingredient name
+_E_NUMBER = re.compile(r"\b(?:e|ins)\s?(\d{3,4}[a-z]?)\b")
+_PARENTHETICAL = re.compile(r"\(([^()]*)\)")
+# Qualifiers that don't change how an ingredient is scored
+_QUALIFIERS = ("organic ", "certified organic ")
+
+
+class KnownIngredient(NamedTuple):
+    name: str
+    e_number: Optional[str]
+    category: str
+    safety_score: str
+    synonyms: List[str]
+    reasoning: str
+
+
+def _e_number_key(value: str) -> str:
+    return "e" + value.lower().lstrip("e").strip()
+
+
+class IngredientKnowledgeBase:
+    """
+    In-memory index from normalized names, synonyms and E-numbers to
+    KnownIngredient entries.
+    """
+
+    def __init__(self, entries: Iterable[KnownIngredient] = ()):
+        self._index: Dict[str, KnownIngredient] = {}
+        self.entries: List[KnownIngredient] = []
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        for entry in entries:
+            self.add(entry)
+
+    @classmethod
+    def load(cls, path: str = BUNDLED_KB_FILE) -> "IngredientKnowledgeBase":
+        """
+        Load a tab-separated knowledge base file. Each non-comment line holds
+        name, e_number, category, safety, |-separated synonyms and reasoning.
+        """
+        entries = []
+        with open(path, "r", encoding="utf-8") as f:
+            for line_no, line in enumerate(f, start=1):
+                line = line.rstrip("\n")
+                if not line.strip() or line.startswith("#"):
+                    continue
+                fields = line.split("\t")
+                if len(fields) != 6:
+                    raise ValueError(f"{path}:{line_no}: expected 6 tab-separated fields, got {len(fields)}")
+                name, e_number, category, safety, synonyms, reasoning = fields
+                safety = safety.strip().upper()
+                if safety not in SAFETY_LEVELS:
+                    raise ValueError(f"{path}:{line_no}: unknown safety level {safety!r}")
+                entries.append(KnownIngredient(
+                    name=name.strip(),
+                    e_number=_e_number_key(e_number) if e_number.strip() else None,
+                    category=category.strip(),
+                    safety_score=safety,
+                    synonyms=[s.strip() for s in synonyms.split("|") if s.strip()],
+                    reasoning=reasoning.strip(),
+                ))
+        kb = cls(entries)
+        logger.info(f"Loaded {len(kb.entries)} ingredients ({len(kb._index)} index keys) from {path}")
+        return kb
+
+    def add(self, entry: KnownIngredient) -> None:
+        """Index an entry under its name, synonyms and E-number; first entry wins on clashes"""
+        self.entries.append(entry)
+        keys = [normalize_key(entry.name), *(normalize_key(s) for s in entry.synonyms)]
+        if entry.e_number:
+            keys.append(entry.e_number)
+        for key in keys:
+            if key and key not in self._index:
+                self._index[key] = entry
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _candidates(self, name: str) -> Iterable[str]:
+        key = normalize_key(name)
+        yield key
+        for qualifier in _QUALIFIERS:
+            if key.startswith(qualifier):
+                yield key[len(qualifier):]
+
+        # "Soy Lecithin (Emulsifier)" -> "soy lecithin", "Emulsifier (Soy Lecithin)" -> "soy lecithin"
+        inner = _PARENTHETICAL.findall(name)
+        if inner:
+            yield normalize_key(_PARENTHETICAL.sub(" ", name))
+            for part in inner:
+                if "," not in part:
+                    yield normalize_key(part)
+
+        e_numbers = set(_E_NUMBER.findall(key))
+        if len(e_numbers) == 1:
+            yield _e_number_key(e_numbers.pop())
+
+    def lookup(self, name: str, record: bool = True) -> Optional[KnownIngredient]:
+        """
+        Find the entry for an ingredient name as written on a label, or None.
+        Pass record=False to leave the hit/miss counters untouched.
+        """
+        for candidate in self._candidates(name):
+            entry = self._index.get(candidate)
+            if entry is not None:
+                if record:
+                    with self._lock:
+                        self.hits += 1
+                return entry
+        if record:
+            with self._lock:
+                self.misses += 1
+        return None
+
+    def in_category(self, category: str) -> List[KnownIngredient]:
+        """Entries whose category matches, e.g. "dairy" or "colorant" """
+        key = normalize_key(category)
+        return [entry for entry in self.entries if normalize_key(entry.category) == key]
+
+    def prescore(self, name: str) -> Optional[IngredientScoreSchema]:
+        """Deterministic score for a known ingredient, or None if it needs the scorer agent"""
+        entry = self.lookup(name)
+        if entry is None:
+            return None
+        return IngredientScoreSchema(
+            ingredient_name=name,
+            safety_score=entry.safety_score,
+            reasoning=entry.reasoning,
+        )
+
+    def stats(self) -> Dict[str, object]:
+        """Entry count and lookup counters"""
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {
+            'entries': len(self.entries),
+            'indexKeys': len(self._index),
+            'hits': hits,
+            'misses': misses,
+            'hitRate': round(hits / total, 3) if total else 0.0,
+        }
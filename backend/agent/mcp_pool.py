@@ -0,0 +1,178 @@
+"""
+Pool of long-lived MCP stdio servers shared across requests
+"""
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional
+from agents.mcp import MCPServerStdio
+
+logger = logging.getLogger(__name__)
+
+
+class MCPServerPool:
+    """
+    Keeps `size` MCP server processes warm and hands them out one request at a
+    time. A single supervisor task owns every server's lifecycle (the stdio
+    transport must be opened and closed on the same task); it health-checks
+    idle servers periodically and replaces ones that crash.
+    """
+
+    def __init__(
+        self,
+        params: Dict[str, Any],
+        size: int = 2,
+        checkout_timeout: float = 10.0,
+        health_check_interval: float = 30.0,
+        health_check_timeout: float = 5.0,
+    ):
+        self.params = params
+        self.size = size
+        self.checkout_timeout = checkout_timeout
+        self.health_check_interval = health_check_interval
+        self.health_check_timeout = health_check_timeout
+
+        self._available: Optional[asyncio.Queue] = None
+        self._suspect: Optional[asyncio.Queue] = None
+        self._servers: List[MCPServerStdio] = []
+        self._supervisor: Optional[asyncio.Task] = None
+        self._ready: Optional[asyncio.Event] = None
+
+        self.checkouts = 0
+        self.checkout_timeouts = 0
+        self.restarts = 0
+        self.spawn_failures = 0
+
+    @property
+    def started(self) -> bool:
+        return self._supervisor is not None and not self._supervisor.done()
+
+    @property
+    def available(self) -> bool:
+        """True when the pool is running with at least one live server"""
+        return self.started and bool(self._servers)
+
+    async def start(self) -> None:
+        """Spawn the servers and start the supervisor"""
+        if self.started:
+            return
+        self._available = asyncio.Queue()
+        self._suspect = asyncio.Queue()
+        self._ready = asyncio.Event()
+        self._supervisor = asyncio.create_task(self._supervise(), name="mcp-pool-supervisor")
+        await self._ready.wait()
+        logger.info(f"MCP server pool started with {len(self._servers)}/{self.size} servers")
+
+    async def stop(self) -> None:
+        """Stop the supervisor, which shuts every server down"""
+        if self._supervisor is None:
+            return
+        self._supervisor.cancel()
+        try:
+            await self._supervisor
+        except asyncio.CancelledError:
+            pass
+        self._supervisor = None
+        logger.info("MCP server pool stopped")
+
+    @asynccontextmanager
+    async def checkout(self) -> AsyncIterator[MCPServerStdio]:
+        """Borrow a connected server, waiting at most checkout_timeout seconds"""
+        if not self.started:
+            raise RuntimeError("MCP server pool is not running")
+        try:
+            server = await asyncio.wait_for(self._available.get(), timeout=self.checkout_timeout)
+        except asyncio.TimeoutError:
+            self.checkout_timeouts += 1
+            raise
+        self.checkouts += 1
+        failed = False
+        try:
+            yield server
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            # Let the supervisor decide whether a server that saw an error is still usable
+            (self._suspect if failed else self._available).put_nowait(server)
+
+    async def _spawn(self) -> bool:
+        server = MCPServerStdio(params=self.params, cache_tools_list=True)
+        try:
+            await server.connect()
+        except Exception as exc:
+            self.spawn_failures += 1
+            logger.error(f"Failed to start MCP server: {type(exc).__name__}: {exc}")
+            await self._close(server)
+            return False
+        self._servers.append(server)
+        self._available.put_nowait(server)
+        return True
+
+    async def _close(self, server: MCPServerStdio) -> None:
+        if server in self._servers:
+            self._servers.remove(server)
+        try:
+            await server.cleanup()
+        except Exception as exc:
+            logger.warning(f"Error while shutting down MCP server: {exc}")
+
+    async def _healthy(self, server: MCPServerStdio) -> bool:
+        try:
+            server.invalidate_tools_cache()
+            await asyncio.wait_for(server.list_tools(), timeout=self.health_check_timeout)
+            return True
+        except Exception as exc:
+            logger.warning(f"MCP server failed health check: {type(exc).__name__}: {exc}")
+            return False
+
+    async def _check(self, server: MCPServerStdio) -> None:
+        if await self._healthy(server):
+            self._available.put_nowait(server)
+            return
+        await self._close(server)
+        self.restarts += 1
+        await self._spawn()
+
+    async def _supervise(self) -> None:
+        try:
+            for _ in range(self.size):
+                await self._spawn()
+            self._ready.set()
+
+            while True:
+                try:
+                    server = await asyncio.wait_for(
+                        self._suspect.get(), timeout=self.health_check_interval
+                    )
+                    await self._check(server)
+                    continue
+                except asyncio.TimeoutError:
+                    pass
+
+                # Periodic pass: check idle servers and refill missing slots
+                idle = []
+                while not self._available.empty():
+                    idle.append(self._available.get_nowait())
+                for server in idle:
+                    await self._check(server)
+                for _ in range(self.size - len(self._servers)):
+                    await self._spawn()
+        finally:
+            self._ready.set()
+            while not self._available.empty():
+                self._available.get_nowait()
+            for server in list(self._servers):
+                await self._close(server)
+
+    def stats(self) -> Dict[str, Any]:
+        """Pool size, idle servers and checkout/restart counters"""
+        return {
+            'size': self.size,
+            'running': len(self._servers),
+            'idle': self._available.qsize() if self._available else 0,
+            'checkouts': self.checkouts,
+            'checkoutTimeouts': self.checkout_timeouts,
+            'restarts': self.restarts,
+            'spawnFailures': self.spawn_failures,
+        }
@@ -17,3 +17,18 @@ class ScorerResult(BaseModel):
     ingredient_scores: List[IngredientScoreSchema]
     overall_score: float # score between 0 an 10, higher is better
 
+
+class IngredientFlag(BaseModel):
+    """
+    A user preference matched by an ingredient.
+    """
+    ingredient_name: str
+    kind: str # "allergy", "avoid" or "diet"
+    matched: str # the user's allergy, avoid-list entry or diet goal
+
+class PersonalizedScorerResult(ScorerResult):
+    """
+    Generic scores with the user's preferences applied locally.
+    """
+    flags: List[IngredientFlag]
+    generic_overall_score: float
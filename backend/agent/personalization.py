@@ -0,0 +1,403 @@
+"""
+Local personalization overlay for generic ingredient scores
+
+Generic scores are user-independent and cached; a user's allergies, avoid
+list and diet goals are applied afterwards by matching ingredient names and
+descriptions against a precompiled Aho-Corasick automaton of the user's terms
+and their synonyms (e.g. "milk" also matches casein and whey).
+"""
+import re
+import threading
+from collections import OrderedDict, deque
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from .ingredient_kb import IngredientKnowledgeBase
+from .models.scorer_models import (
+    IngredientFlag,
+    IngredientScoreSchema,
+    PersonalizedScorerResult,
+    ScorerResult,
+)
+from .scoring import compute_personalized_score, safety_points
+from utils.cache import normalize_key
+
+# Allergen groups: names a user might type, and label terms that contain the allergen
+ALLERGEN_GROUPS: Dict[str, Dict[str, List[str]]] = {
+    "milk": {
+        "aliases": ["milk", "dairy", "lactose", "cow milk", "cows milk", "casein", "whey"],
+        "terms": ["milk", "casein", "caseinate", "whey", "lactose", "butter", "buttermilk", "cream",
+                  "cheese", "ghee", "yogurt", "yoghurt", "curds", "lactalbumin", "lactoglobulin",
+                  "milk solids", "milk fat", "milkfat"],
+    },
+    "egg": {
+        "aliases": ["egg", "eggs"],
+        "terms": ["egg", "eggs", "albumen", "albumin", "ovalbumin", "lysozyme", "mayonnaise", "meringue"],
+    },
+    "peanut": {
+        "aliases": ["peanut", "peanuts", "groundnut", "groundnuts"],
+        "terms": ["peanut", "peanuts", "groundnut", "groundnuts", "arachis oil"],
+    },
+    "tree nut": {
+        "aliases": ["tree nut", "tree nuts", "nut", "nuts"],
+        "terms": ["almond", "almonds", "hazelnut", "hazelnuts", "filberts", "cashew", "cashews",
+                  "walnut", "walnuts", "pecan", "pecans", "pistachio", "pistachios", "macadamia",
+                  "brazil nut", "brazil nuts", "praline", "marzipan", "nut", "nuts"],
+    },
+    "soy": {
+        "aliases": ["soy", "soya", "soybean", "soybeans"],
+        "terms": ["soy", "soya", "soybean", "soybeans", "edamame", "tofu", "tempeh", "miso"],
+    },
+    "gluten": {
+        "aliases": ["gluten", "wheat", "celiac", "coeliac"],
+        "terms": ["wheat", "gluten", "barley", "rye", "spelt", "malt", "semolina", "durum",
+                  "farina", "bulgur", "couscous", "triticale", "seitan"],
+    },
+    "fish": {
+        "aliases": ["fish"],
+        "terms": ["fish", "anchovy", "anchovies", "cod", "salmon", "tuna", "pollock", "tilapia",
+                  "fish sauce", "fish oil"],
+    },
+    "shellfish": {
+        "aliases": ["shellfish", "crustacean", "crustaceans", "seafood"],
+        "terms": ["shellfish", "shrimp", "prawn", "prawns", "crab", "lobster", "crayfish",
+                  "clam", "clams", "mussel", "mussels", "oyster", "oysters", "scallop", "scallops"],
+    },
+    "sesame": {
+        "aliases": ["sesame", "sesame seed", "sesame seeds"],
+        "terms": ["sesame", "tahini", "benne"],
+    },
+    "sulfite": {
+        "aliases": ["sulfite", "sulfites", "sulphite", "sulphites"],
+        "terms": ["sulfite", "sulfites", "sulphite", "sulphites", "sulfur dioxide",
+                  "sulphur dioxide", "metabisulfite", "bisulfite"],
+    },
+}
+
+# Diet goals: allergen groups and extra label terms that violate the goal
+DIET_GOALS: Dict[str, Dict[str, List[str]]] = {
+    "vegan": {
+        "groups": ["milk", "egg", "fish", "shellfish"],
+        "terms": ["gelatin", "gelatine", "honey", "beef", "pork", "chicken", "lard", "tallow",
+                  "carmine", "cochineal", "shellac", "beeswax", "isinglass"],
+    },
+    "vegetarian": {
+        "groups": ["fish", "shellfish"],
+        "terms": ["gelatin", "gelatine", "beef", "pork", "chicken", "lard", "tallow",
+                  "carmine", "cochineal", "isinglass", "rennet"],
+    },
+    "gluten free": {"groups": ["gluten"], "terms": []},
+    "dairy free": {"groups": ["milk"], "terms": []},
+    "nut free": {"groups": ["peanut", "tree nut"], "terms": []},
+    "low sugar": {
+        "groups": [],
+        "terms": ["sugar", "cane sugar", "corn syrup", "high fructose corn syrup", "glucose syrup",
+                  "dextrose", "fructose", "sucrose", "invert sugar"],
+    },
+}
+DIET_GOAL_ALIASES = {
+    "plant based": "vegan",
+    "glutenfree": "gluten free",
+    "no gluten": "gluten free",
+    "celiac": "gluten free",
+    "lactose free": "dairy free",
+    "no dairy": "dairy free",
+    "sugar free": "low sugar",
+    "no sugar": "low sugar",
+    "no added sugar": "low sugar",
+}
+
+# Label phrases that contain an allergen term without the allergen, rewritten before matching
+NON_ALLERGEN_PHRASES = {
+    "cocoa butter": "cocoa",
+    "cacao butter": "cacao",
+    "shea butter": "shea",
+    "peanut butter": "peanut",
+    "nut butter": "nut",
+    "almond butter": "almond",
+    "apple butter": "apple",
+    "cream of tartar": "tartar",
+    "coconut milk": "coconut",
+    "coconut cream": "coconut",
+    "almond milk": "almond",
+    "oat milk": "oat",
+    "rice milk": "rice",
+    "soy milk": "soy",
+    "milk thistle": "thistle",
+    "cream soda": "soda",
+}
+_NON_ALLERGEN = re.compile(r"\b(" + "|".join(map(re.escape, NON_ALLERGEN_PHRASES)) + r")\b")
+
+
+# Negated mentions in descriptions ("dairy free", "free from nuts", "contains no egg"), dropped before matching
+_NEGATED = re.compile(r"\b(?:\w+ free|free (?:of|from) \w+|(?:no|non|without) \w+)\b")
+
+
+def _matchable(name: str) -> str:
+    return _NON_ALLERGEN.sub(lambda m: NON_ALLERGEN_PHRASES[m.group(1)], normalize_key(name))
+
+
+def _matchable_description(description: str) -> str:
+    return _NEGATED.sub(" ", _matchable(description))
+
+
+# Rule precedence, matching SCORER_AGENT_INSTRUCTIONS: allergies > avoid list > diet goals
+_KIND_ORDER = ("allergy", "avoid", "diet")
+_KIND_LEVEL = {"allergy": "LOW", "avoid": "LOW", "diet": "MEDIUM"}
+
+Label = Tuple[str, str]
+
+
+class AhoCorasick:
+    """
+    Multi-pattern matcher over normalized text. Patterns only match whole
+    words: text and patterns are padded with spaces before matching.
+    """
+
+    def __init__(self, patterns: Dict[str, Iterable[Label]]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[Set[Label]] = [set()]
+        for pattern, labels in patterns.items():
+            self._insert(f" {pattern} ", labels)
+        self._build()
+
+    def _insert(self, pattern: str, labels: Iterable[Label]) -> None:
+        state = 0
+        for char in pattern:
+            nxt = self._goto[state].get(char)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(set())
+                self._goto[state][char] = nxt
+            state = nxt
+        self._out[state].update(labels)
+
+    def _build(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                candidate = self._goto[fail].get(char, 0)
+                self._fail[nxt] = candidate if candidate != nxt else 0
+                self._out[nxt] |= self._out[self._fail[nxt]]
+
+    def find(self, text: str) -> Set[Label]:
+        """Labels of every pattern occurring in the normalized text"""
+        found: Set[Label] = set()
+        state = 0
+        goto, fail, out = self._goto, self._fail, self._out
+        for char in f" {text} ":
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if out[state]:
+                found |= out[state]
+        return found
+
+
+def _allergen_group(term: str) -> Optional[str]:
+    for group, spec in ALLERGEN_GROUPS.items():
+        if term in spec["aliases"]:
+            return group
+    return None
+
+
+def _kb_terms(kb: Optional[IngredientKnowledgeBase], term: str) -> List[str]:
+    """Names, synonyms and E-numbers the knowledge base knows for a term or category"""
+    if kb is None:
+        return []
+    entries = kb.in_category(term)
+    entry = kb.lookup(term, record=False)
+    if entry is not None:
+        entries.append(entry)
+    terms = []
+    for entry in entries:
+        terms.append(entry.name)
+        terms.extend(entry.synonyms)
+        if entry.e_number:
+            terms.append(entry.e_number)
+    return terms
+
+
+class PreferenceMatcher:
+    """
+    Compiled allergies, avoid list and diet goals for one preference set.
+    Matches an ingredient's label name, its description (which carries
+    sub-ingredients such as "Contains milk.") and, when known, its canonical
+    knowledge base name and E-number.
+    """
+
+    def __init__(self, user_preferences: Dict, kb: Optional[IngredientKnowledgeBase] = None):
+        self.kb = kb
+        patterns: Dict[str, Set[Label]] = {}
+
+        def add(terms: Iterable[str], label: Label) -> None:
+            for term in terms:
+                key = normalize_key(term)
+                if key:
+                    patterns.setdefault(key, set()).add(label)
+
+        for allergy in user_preferences.get("allergies") or []:
+            term = normalize_key(allergy)
+            group = _allergen_group(term)
+            label = ("allergy", allergy)
+            add([term], label)
+            if group:
+                add(ALLERGEN_GROUPS[group]["terms"], label)
+            add(_kb_terms(kb, term), label)
+
+        for avoid in user_preferences.get("avoidIngredients") or []:
+            term = normalize_key(avoid)
+            label = ("avoid", avoid)
+            add([term], label)
+            add(_kb_terms(kb, term), label)
+
+        for goal in user_preferences.get("dietGoals") or []:
+            term = normalize_key(goal)
+            spec = DIET_GOALS.get(DIET_GOAL_ALIASES.get(term, term))
+            if spec is None:
+                continue  # Not checkable locally, e.g. "organic" or "high protein"
+            label = ("diet", goal)
+            for group in spec["groups"]:
+                add(ALLERGEN_GROUPS[group]["terms"], label)
+            add(spec["terms"], label)
+
+        self.pattern_count = len(patterns)
+        self._automaton = AhoCorasick(patterns) if patterns else None
+
+    def match(self, ingredient_name: str, description: Optional[str] = None) -> Set[Label]:
+        """(kind, user term) pairs matched by one ingredient"""
+        if self._automaton is None:
+            return set()
+        found = self._automaton.find(_matchable(ingredient_name))
+        if description:
+            found |= self._automaton.find(_matchable_description(description))
+        entry = self.kb.lookup(ingredient_name, record=False) if self.kb else None
+        if entry is not None:
+            found |= self._automaton.find(_matchable(entry.name))
+            if entry.e_number:
+                found |= self._automaton.find(entry.e_number)
+        return found
+
+
+def _flag_reason(kind: str, term: str) -> str:
+    if kind == "allergy":
+        return f"Warning: contains {term}, which is listed in your allergies."
+    if kind == "avoid":
+        return f"Contains {term}, which is on your list of ingredients to avoid."
+    return f"Not compatible with your {term} diet goal."
+
+
+def _personalize_score(
+    score: IngredientScoreSchema, matches: Set[Label]
+) -> Tuple[IngredientScoreSchema, List[IngredientFlag]]:
+    if not matches:
+        return score, []
+    ordered = sorted(matches, key=lambda label: (_KIND_ORDER.index(label[0]), label[1]))
+    flags = [
+        IngredientFlag(ingredient_name=score.ingredient_name, kind=kind, matched=term)
+        for kind, term in ordered
+    ]
+    level = _KIND_LEVEL[ordered[0][0]]
+    if safety_points(level) > safety_points(score.safety_score):
+        level = score.safety_score
+    reasons = " ".join(_flag_reason(kind, term) for kind, term in ordered)
+    return score.model_copy(update={
+        "safety_score": level,
+        "reasoning": f"{reasons} {score.reasoning}".strip(),
+    }), flags
+
+
+class PersonalizationOverlay:
+    """
+    Applies user preferences to generic scorer results. Compiled matchers are
+    kept in a small LRU keyed by the normalized preference set.
+    """
+
+    def __init__(self, kb: Optional[IngredientKnowledgeBase] = None, max_matchers: int = 256):
+        self.kb = kb
+        self.max_matchers = max_matchers
+        self._matchers: "OrderedDict[Tuple, PreferenceMatcher]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.compiled = 0
+        self.applied = 0
+
+    @staticmethod
+    def _key(user_preferences: Dict) -> Tuple:
+        return tuple(
+            tuple(sorted(normalize_key(value) for value in (user_preferences.get(field) or [])))
+            for field in ("allergies", "dietGoals", "avoidIngredients")
+        )
+
+    def matcher(self, user_preferences: Dict) -> PreferenceMatcher:
+        """Compiled matcher for a preference set, built on first use"""
+        key = self._key(user_preferences)
+        with self._lock:
+            matcher = self._matchers.get(key)
+            if matcher is not None:
+                self._matchers.move_to_end(key)
+                return matcher
+        matcher = PreferenceMatcher(user_preferences, self.kb)
+        with self._lock:
+            self.compiled += 1
+            self._matchers[key] = matcher
+            while len(self._matchers) > self.max_matchers:
+                self._matchers.popitem(last=False)
+        return matcher
+
+    def apply_to_scores(
+        self,
+        scores: List[IngredientScoreSchema],
+        user_preferences: Dict,
+        descriptions: Optional[Dict[str, str]] = None,
+    ) -> Tuple[List[IngredientScoreSchema], List[IngredientFlag]]:
+        """
+        Personalized copies of per-ingredient scores plus the flags raised.
+        descriptions maps normalized ingredient names to their descriptions.
+        """
+        matcher = self.matcher(user_preferences)
+        descriptions = descriptions or {}
+        personalized, flags = [], []
+        for score in scores:
+            description = descriptions.get(normalize_key(score.ingredient_name))
+            adjusted, raised = _personalize_score(score, matcher.match(score.ingredient_name, description))
+            personalized.append(adjusted)
+            flags.extend(raised)
+        return personalized, flags
+
+    def apply(
+        self,
+        result: ScorerResult,
+        user_preferences: Dict,
+        descriptions: Optional[Dict[str, str]] = None,
+    ) -> PersonalizedScorerResult:
+        """Personalize a generic scorer result, recomputing overall_score with penalties"""
+        scores, flags = self.apply_to_scores(result.ingredient_scores, user_preferences, descriptions)
+        kinds = {kind: {flag.ingredient_name for flag in flags if flag.kind == kind} for kind in _KIND_ORDER}
+        with self._lock:
+            self.applied += 1
+        return PersonalizedScorerResult(
+            ingredient_scores=scores,
+            overall_score=compute_personalized_score(
+                scores,
+                allergy_matches=len(kinds["allergy"]),
+                avoid_matches=len(kinds["avoid"]),
+                diet_violations=len(kinds["diet"]),
+            ),
+            flags=flags,
+            generic_overall_score=result.overall_score,
+        )
+
+    def stats(self) -> Dict[str, int]:
+        """Compiled matcher count and overlay counters"""
+        with self._lock:
+            return {
+                'matchers': len(self._matchers),
+                'compiled': self.compiled,
+                'applied': self.applied,
+            }
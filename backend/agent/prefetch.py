@@ -0,0 +1,86 @@
+"""
+Short-lived store of speculatively started agent calls
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class SpeculativeResultStore:
+    """
+    Keyed store of asyncio tasks started ahead of demand. Entries expire after
+    ttl_seconds and the oldest are dropped beyond max_entries. Tasks keep
+    running when dropped; only the store's reference goes away.
+    """
+
+    def __init__(self, ttl_seconds: float = 300.0, max_entries: int = 1000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._tasks: "OrderedDict[str, Tuple[asyncio.Task, float]]" = OrderedDict()
+        self.started = 0
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+
+    def _purge(self, now: float) -> None:
+        expired = [key for key, (_, created) in self._tasks.items() if now - created > self.ttl_seconds]
+        for key in expired:
+            del self._tasks[key]
+        while len(self._tasks) > self.max_entries:
+            self._tasks.popitem(last=False)
+
+    @staticmethod
+    def _failed(task: asyncio.Task) -> bool:
+        """Whether a finished task was cancelled or raised, so it must not be reused"""
+        return task.done() and (task.cancelled() or task.exception() is not None)
+
+    def _on_done(self, task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            self.failures += 1
+            logger.warning(f"Speculative task failed: {task.exception()}")
+
+    def start(self, key: str, factory: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        """Start factory() under key unless a live entry already exists"""
+        now = time.monotonic()
+        self._purge(now)
+        entry = self._tasks.get(key)
+        if entry is not None and not self._failed(entry[0]):
+            return entry[0]
+        task = asyncio.create_task(factory())
+        task.add_done_callback(self._on_done)
+        self._tasks[key] = (task, now)
+        self.started += 1
+        return task
+
+    def get(self, key: str) -> Optional[asyncio.Task]:
+        """Return the task stored under key, or None if absent, expired or cancelled"""
+        self._purge(time.monotonic())
+        entry = self._tasks.get(key)
+        if entry is not None and entry[0].cancelled():
+            # Awaiting it would raise CancelledError in the caller
+            del self._tasks[key]
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[0]
+
+    def discard(self, key: str) -> None:
+        self._tasks.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        """Counts of started, used and failed speculative tasks"""
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._tasks),
+            'started': self.started,
+            'hits': self.hits,
+            'misses': self.misses,
+            'failures': self.failures,
+            'hitRate': round(self.hits / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,267 @@
+"""
+Local index of analyzed products for reccomending healthier alternatives
+
+Every scored product is filed under a category, taken from its name ("...
+Granola Bar" is a snack bar), or failing that from the indexed product whose
+ingredients it shares most. Each category keeps its products sorted by
+overall_score, so "same category, higher score" is a bisect and a slice.
+Categories with too few better products are left to the reccomender agent.
+"""
+import bisect
+import logging
+import threading
+from typing import Dict, FrozenSet, List, NamedTuple, Optional, Set, Tuple
+from .models.reccomender_models import Reccomendations
+from .models.scorer_models import ScorerResult
+from utils.cache import normalize_key
+
+logger = logging.getLogger(__name__)
+
+# Category -> name keywords, matched as whole words (plural "s"/"es" allowed).
+# Words that also name a flavor or an ingredient of other products ("honey",
+# "rice", "cheese", "butter", "ham", "bar", "roll") are only used in phrases.
+CATEGORY_KEYWORDS: Dict[str, Tuple[str, ...]] = {
+    "cereal": ("cereal", "granola", "muesli", "flakes", "oatmeal", "porridge", "corn flakes", "bran"),
+    "snack bar": ("protein bar", "granola bar", "cereal bar", "energy bar", "snack bar", "nut bar", "fruit bar",
+                  "breakfast bar"),
+    "cookies": ("cookie", "biscuit", "cracker", "wafer", "oat cookie"),
+    "chips": ("chip", "crisp", "puff", "pretzel", "popcorn", "tortilla chip"),
+    "confectionery": ("chocolate", "candy", "gummy", "gummies", "toffee", "caramel", "lollipop", "marshmallow",
+                      "chocolate bar", "candy bar", "peanut butter cup"),
+    "spread": ("peanut butter", "almond butter", "nut butter", "jam", "jelly", "marmalade", "hazelnut spread",
+               "spread"),
+    "soup": ("soup", "broth", "bouillon", "ramen", "noodle soup"),
+    "sauce": ("sauce", "ketchup", "mayonnaise", "mayo", "mustard", "dressing", "salsa", "pesto", "gravy"),
+    "dairy": ("milk", "yogurt", "yoghurt", "cream", "kefir", "cream cheese", "cheddar", "mozzarella", "parmesan",
+              "salted butter", "unsalted butter"),
+    "plant milk": ("oat milk", "almond milk", "soy milk", "coconut milk", "rice milk"),
+    "soft drink": ("soda", "cola", "lemonade", "soft drink", "energy drink", "tonic"),
+    "juice": ("juice", "smoothie", "nectar"),
+    "tea and coffee": ("tea", "iced tea", "coffee", "latte", "matcha"),
+    "bread": ("bread", "bagel", "bun", "tortilla", "wrap", "pita", "baguette", "bread roll", "dinner roll"),
+    "pasta and grains": ("pasta", "spaghetti", "macaroni", "noodle", "quinoa", "couscous", "brown rice",
+                         "white rice", "basmati rice", "jasmine rice"),
+    "frozen meals": ("pizza", "frozen meal", "lasagna", "burrito", "nugget", "fish finger", "dumpling",
+                     "hot pocket"),
+    "ice cream": ("ice cream", "gelato", "sorbet", "frozen yogurt"),
+    "meat": ("sausage", "bacon", "salami", "jerky", "hot dog"),
+}
+
+# Flavors naming another category's keyword ("Chocolate Chip" granola bar, "Sour Cream" chips)
+FLAVOR_PHRASES = ("chocolate chip", "cookies and cream", "cookies n cream", "cookie dough", "sour cream")
+
+SAFETY_LOW = "LOW"
+
+_FLAVOR = ""
+
+_KEYWORD_CATEGORIES: Dict[str, str] = {
+    **{keyword: category for category, keywords in CATEGORY_KEYWORDS.items() for keyword in keywords},
+    **{phrase: _FLAVOR for phrase in FLAVOR_PHRASES},
+}
+_MAX_KEYWORD_WORDS = max(len(keyword.split()) for keyword in _KEYWORD_CATEGORIES)
+
+
+def _keyword_category(phrase: str) -> Optional[str]:
+    category = _KEYWORD_CATEGORIES.get(phrase)
+    if category is None and phrase.endswith("s"):
+        category = _KEYWORD_CATEGORIES.get(phrase[:-1])
+        if category is None and phrase.endswith("es"):
+            category = _KEYWORD_CATEGORIES.get(phrase[:-2])
+    return category
+
+
+def category_from_name(product_name: str) -> Optional[str]:
+    """
+    Category named by the product's last category keyword, so "Chocolate
+    Granola Bar" is a snack bar and "Peanut Butter Cookies" are cookies.
+    Longer keywords win over the words they end with ("oat milk" over "milk"),
+    and words of a flavor phrase ("Chocolate Chip") are not keywords.
+    """
+    words = normalize_key(product_name).split()
+    best_end, best_length, best = -1, 0, None
+    start = 0
+    while start < len(words):
+        next_start = start + 1
+        for length in range(min(_MAX_KEYWORD_WORDS, len(words) - start), 0, -1):
+            category = _keyword_category(" ".join(words[start:start + length]))
+            if category is None:
+                continue
+            end = start + length
+            if category == _FLAVOR:
+                next_start = end
+            elif end > best_end or (end == best_end and length > best_length):
+                best_end, best_length, best = end, length, category
+            break
+        start = next_start
+    return best
+
+
+class IndexedProduct(NamedTuple):
+    key: str
+    name: str
+    category: Optional[str]
+    overall_score: float
+    ingredients: FrozenSet[str]
+    low_ingredients: FrozenSet[str]
+
+
+def _jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class ReccomendationIndex:
+    """
+    In-process index of analyzed products by category and ingredients.
+
+    add() files (or refiles) a product as soon as it is scored. better_than()
+    returns up to k products of the same category scoring at least min_gain
+    higher, best first, ties broken by ingredient overlap, or an empty list
+    when fewer than min_results qualify.
+    """
+
+    def __init__(self, min_results: int = 3, min_gain: float = 0.5, category_similarity: float = 0.5):
+        self.min_results = min_results
+        self.min_gain = min_gain
+        self.category_similarity = category_similarity
+        self._lock = threading.Lock()
+        self._products: Dict[str, IndexedProduct] = {}
+        # category -> (overall_score, key) ascending
+        self._by_category: Dict[str, List[Tuple[float, str]]] = {}
+        self._by_ingredient: Dict[str, Set[str]] = {}
+        self.queries = 0
+        self.local_hits = 0
+        self.sparse = 0
+
+    def _nearest_category(self, ingredients: FrozenSet[str], exclude: str) -> Optional[str]:
+        """Category of the categorized product sharing the most ingredients, if similar enough"""
+        overlap: Dict[str, int] = {}
+        for ingredient in ingredients:
+            for key in self._by_ingredient.get(ingredient, ()):
+                if key != exclude:
+                    overlap[key] = overlap.get(key, 0) + 1
+        best, best_similarity = None, self.category_similarity
+        for key, shared in overlap.items():
+            product = self._products[key]
+            if product.category is None:
+                continue
+            similarity = shared / len(ingredients | product.ingredients)
+            if similarity >= best_similarity:
+                best, best_similarity = product.category, similarity
+        return best
+
+    def _remove_locked(self, key: str) -> None:
+        product = self._products.pop(key, None)
+        if product is None:
+            return
+        if product.category is not None:
+            entries = self._by_category[product.category]
+            index = bisect.bisect_left(entries, (product.overall_score, key))
+            if index < len(entries) and entries[index] == (product.overall_score, key):
+                del entries[index]
+        for ingredient in product.ingredients:
+            keys = self._by_ingredient.get(ingredient)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_ingredient[ingredient]
+
+    def add(self, key: str, product_name: str, result: ScorerResult) -> IndexedProduct:
+        """Index a scored product, replacing its previous entry"""
+        ingredients = frozenset(normalize_key(score.ingredient_name) for score in result.ingredient_scores)
+        low = frozenset(
+            normalize_key(score.ingredient_name) for score in result.ingredient_scores
+            if score.safety_score.strip().upper() == SAFETY_LOW
+        )
+        with self._lock:
+            self._remove_locked(key)
+            category = category_from_name(product_name) or self._nearest_category(ingredients, key)
+            product = IndexedProduct(key, product_name, category, float(result.overall_score), ingredients, low)
+            self._products[key] = product
+            if category is not None:
+                bisect.insort(self._by_category.setdefault(category, []), (product.overall_score, key))
+            for ingredient in ingredients:
+                self._by_ingredient.setdefault(ingredient, set()).add(key)
+        return product
+
+    def remove(self, key: str) -> None:
+        with self._lock:
+            self._remove_locked(key)
+
+    def category_of(self, key: str, product_name: str) -> Optional[str]:
+        with self._lock:
+            product = self._products.get(key)
+        if product is not None and product.category is not None:
+            return product.category
+        return category_from_name(product_name)
+
+    def category_size(self, category: Optional[str]) -> int:
+        if category is None:
+            return 0
+        with self._lock:
+            return len(self._by_category.get(category, ()))
+
+    def better_than(self, key: str, product_name: str, overall_score: float, k: int = 5) -> List[Reccomendations]:
+        """Up to k same-category products scoring at least min_gain higher, [] if the category is too sparse"""
+        self.queries += 1
+        with self._lock:
+            query = self._products.get(key)
+            category = query.category if query is not None and query.category else category_from_name(product_name)
+            entries = self._by_category.get(category, []) if category else []
+            start = bisect.bisect_left(entries, (overall_score + self.min_gain, ""))
+            available = len(entries) - start
+            if query is not None and query.category == category and query.overall_score >= overall_score + self.min_gain:
+                available -= 1
+            if available < self.min_results:
+                self.sparse += 1
+                return []
+
+            # Walk down from the best score; products with equal scores are
+            # ordered by how many ingredients they share with the queried one
+            ingredients = query.ingredients if query is not None else frozenset()
+            picked: List[IndexedProduct] = []
+            index = len(entries) - 1
+            while index >= start and len(picked) < k:
+                score = entries[index][0]
+                tied = []
+                while index >= start and entries[index][0] == score:
+                    if entries[index][1] != key:
+                        tied.append(self._products[entries[index][1]])
+                    index -= 1
+                tied.sort(key=lambda product: _jaccard(ingredients, product.ingredients), reverse=True)
+                picked.extend(tied)
+        self.local_hits += 1
+        return [self._reccomendation(product, query, category) for product in picked[:k]]
+
+    @staticmethod
+    def _reccomendation(
+        product: IndexedProduct, query: Optional[IndexedProduct], category: str
+    ) -> Reccomendations:
+        reason = f"Another {category} product with a higher overall score ({product.overall_score:g}/10)"
+        if query is not None:
+            avoided = sorted(query.low_ingredients - product.ingredients)[:3]
+            if avoided:
+                reason += f", without {', '.join(avoided)}"
+        return Reccomendations(product_name=product.name, health_score=f"{product.overall_score:g}", reason=reason + ".")
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._products
+
+    def __len__(self) -> int:
+        return len(self._products)
+
+    def stats(self) -> Dict[str, object]:
+        """Indexed products, categories and how often queries were answered locally"""
+        with self._lock:
+            categories = {category: len(entries) for category, entries in self._by_category.items() if entries}
+            uncategorized = sum(1 for product in self._products.values() if product.category is None)
+        return {
+            'products': len(self._products),
+            'categories': categories,
+            'uncategorized': uncategorized,
+            'queries': self.queries,
+            'localHits': self.local_hits,
+            'sparse': self.sparse,
+            'localHitRate': round(self.local_hits / self.queries, 4) if self.queries else 0.0,
+        }
@@ -0,0 +1,48 @@
+"""
+Deterministic helpers for combining per-ingredient safety scores
+"""
+from typing import List
+from .models.scorer_models import IngredientScoreSchema
+
+# Points per safety level, matching SCORER_AGENT_INSTRUCTIONS
+SAFETY_POINTS = {
+    "HIGH": 9.0,
+    "MEDIUM": 5.0,
+    "LOW": 1.0,
+}
+
+
+def safety_points(safety_score: str) -> float:
+    """Map a safety level to its points, treating unknown levels as MEDIUM"""
+    return SAFETY_POINTS.get(safety_score.strip().upper(), SAFETY_POINTS["MEDIUM"])
+
+
+def compute_overall_score(ingredient_scores: List[IngredientScoreSchema]) -> float:
+    """Raw average of ingredient points on the 0-10 scale"""
+    if not ingredient_scores:
+        return 0.0
+    total = sum(safety_points(score.safety_score) for score in ingredient_scores)
+    return round(total / len(ingredient_scores), 1)
+
+
+# Overall score penalties for preference matches, matching SCORER_AGENT_INSTRUCTIONS
+ALLERGY_PENALTY = 4.0
+AVOID_PENALTY = 1.5
+AVOID_PENALTY_MAX = 6.0
+DIET_PENALTY = 1.0
+DIET_PENALTY_MAX = 3.0
+
+
+def compute_personalized_score(
+    ingredient_scores: List[IngredientScoreSchema],
+    allergy_matches: int,
+    avoid_matches: int,
+    diet_violations: int,
+) -> float:
+    """Raw average minus allergy, avoid-list and diet penalties, clamped to 0-10"""
+    score = compute_overall_score(ingredient_scores)
+    if allergy_matches:
+        score -= ALLERGY_PENALTY
+    score -= min(AVOID_PENALTY * avoid_matches, AVOID_PENALTY_MAX)
+    score -= min(DIET_PENALTY * diet_violations, DIET_PENALTY_MAX)
+    return round(min(max(score, 0.0), 10.0), 1)
@@ -0,0 +1,65 @@
+"""
+Single-flight coalescing of identical in-flight agent calls
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from utils.resilience import DeadlineExceeded, deadline_scope, stage_timeout
+
+
+class SingleFlight:
+    """
+    Concurrent callers asking for the same key share one task. Each caller
+    awaits the task through asyncio.shield, so cancelling a waiter (e.g. a
+    disconnected client) never cancels the shared work.
+
+    The shared task runs under its own deadline of deadline_seconds rather
+    than the deadline of the request that started it, and each caller stops
+    waiting when its own deadline passes. A leader with little time left
+    then fails alone instead of taking its followers down with it.
+    """
+
+    def __init__(self, deadline_seconds: Optional[float] = None):
+        self.deadline_seconds = deadline_seconds
+        self._in_flight: Dict[str, asyncio.Task] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Run factory() for key, or join the run already in flight.
+
+        Returns:
+            (result, coalesced) where coalesced is True if this call joined
+            another caller's run.
+
+        Raises:
+            DeadlineExceeded: if this caller's deadline passed first.
+        """
+        task = self._in_flight.get(key)
+        coalesced = task is not None
+        if coalesced:
+            self.coalesced += 1
+        else:
+            self.leaders += 1
+            task = asyncio.create_task(self._run(factory))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        try:
+            result = await asyncio.wait_for(asyncio.shield(task), stage_timeout())
+        except asyncio.TimeoutError:
+            if task.done():
+                raise  # The shared run itself timed out
+            raise DeadlineExceeded(f"Request deadline exceeded waiting for {key}") from None
+        return result, coalesced
+
+    async def _run(self, factory: Callable[[], Awaitable[Any]]) -> Any:
+        with deadline_scope(self.deadline_seconds, inherit=False):
+            return await factory()
+
+    def stats(self) -> Dict[str, Any]:
+        """Number of shared runs, coalesced callers and runs in flight"""
+        return {
+            'inFlight': len(self._in_flight),
+            'leaders': self.leaders,
+            'coalesced': self.coalesced,
+        }
@@ -0,0 +1,254 @@
+"""
+Product analysis pipeline shared by the analyze endpoints
+"""
+import asyncio
+import hashlib
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Sequence
+from fastapi import status
+from utils import gemini_client
+from utils import async_database
+from utils.image_preprocess import sniff_mime_type
+from utils.job_queue import JobFailed
+from utils.resilience import CircuitOpenError, deadline_scope
+from agent import agent
+from agent.models.scorer_models import IngredientScoreSchema, ScorerResult
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# Receives (event name, JSON-serializable payload) as each stage completes
+EventCallback = Callable[[str, Any], Awaitable[None]]
+
+# Reads one uploaded image of a batch, raising AnalysisError if it is unusable
+ImageReader = Callable[[], Awaitable[bytes]]
+
+
+class AnalysisError(Exception):
+    """A pipeline stage failed; carries the HTTP status and client-facing detail"""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+async def load_user_preferences(user_id: Optional[str]) -> Optional[Dict]:
+    """Fetch a user's allergies, diet goals and avoid list, or None"""
+    if not user_id:
+        return None
+    try:
+        user = await async_database.get_user(user_id)
+    except Exception as exc:
+        # Continue without preferences if fetch fails
+        logger.warning(f"Failed to fetch user preferences: {exc}")
+        return None
+    if not user:
+        return None
+    user_preferences = {
+        "allergies": user.get("allergies", []),
+        "dietGoals": user.get("dietGoals", []),
+        "avoidIngredients": user.get("avoidIngredients", []),
+    }
+    logger.info(f"User preferences loaded for user {user_id}: {user_preferences}")
+    return user_preferences
+
+
+def _log_failure(stage: str, exc: Exception) -> None:
+    logger.error(f"{stage}: {type(exc).__name__} at line {exc.__traceback__.tb_lineno} of {__file__}: {exc}")
+
+
+def _upstream_error(stage: str, exc: Exception, detail: str) -> AnalysisError:
+    """504 for timeouts, 503 while the upstream's circuit is open, otherwise 502 with detail"""
+    _log_failure(stage, exc)
+    if isinstance(exc, TimeoutError):
+        return AnalysisError(status.HTTP_504_GATEWAY_TIMEOUT, "Analysis timed out, please try again.")
+    if isinstance(exc, CircuitOpenError):
+        return AnalysisError(
+            status.HTTP_503_SERVICE_UNAVAILABLE, "Analysis is temporarily unavailable, please try again shortly."
+        )
+    return AnalysisError(status.HTTP_502_BAD_GATEWAY, detail)
+
+
+async def extract_product(image_bytes: bytes) -> str:
+    """
+    Extract the product name from an image.
+
+    Raises:
+        AnalysisError: if the image is empty or not an image, extraction fails or no
+            product is recognized.
+    """
+    if not image_bytes:
+        logger.error("No image bytes provided")
+        raise AnalysisError(status.HTTP_400_BAD_REQUEST, "Image bytes payload is required.")
+    if sniff_mime_type(image_bytes) is None:
+        logger.error("Upload is not a recognized image format")
+        raise AnalysisError(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, "Unsupported image format.")
+
+    try:
+        product_name = await gemini_client.extract_product_name(image_bytes)
+    except Exception as exc:
+        raise _upstream_error(
+            "Failed to extract product name", exc, "Failed to extract product information from image."
+        ) from exc
+
+    if not product_name:
+        logger.warning("No recognizable product found in the provided image.")
+        raise AnalysisError(
+            status.HTTP_422_UNPROCESSABLE_ENTITY, "No recognizable product found in the provided image."
+        )
+    return product_name
+
+
+async def search_and_score(
+    product_name: str,
+    user_preferences: Optional[Dict] = None,
+    on_event: Optional[EventCallback] = None,
+) -> ScorerResult:
+    """
+    Look up a product's ingredients and score them.
+
+    Raises:
+        AnalysisError: if the web search or scorer agent fails.
+    """
+    async def emit(event: str, payload: Any) -> None:
+        if on_event is not None:
+            await on_event(event, payload)
+
+    try:
+        web_search_result = await agent.run_web_search_agent(product_name)
+    except Exception as exc:
+        raise _upstream_error("Web search agent failed", exc, "Failed to retrieve external product data.") from exc
+    await emit("ingredients", web_search_result.model_dump())
+
+    async def on_ingredient_scores(scores: List[IngredientScoreSchema]) -> None:
+        await emit("ingredient_scores", {"ingredient_scores": [score.model_dump() for score in scores]})
+
+    try:
+        scoring_result: ScorerResult = await agent.run_scorer_agent(
+            web_search_result.model_dump_json(),
+            user_preferences=user_preferences,
+            product_name=product_name,
+            on_ingredient_scores=on_ingredient_scores if on_event else None,
+        )
+    except Exception as exc:
+        raise _upstream_error("Scorer agent failed", exc, "Failed to retrieve scoring data.") from exc
+    await emit("scores", scoring_result.model_dump())
+    return scoring_result
+
+
+async def analyze_image(
+    image_bytes: bytes,
+    user_preferences: Optional[Dict] = None,
+    on_event: Optional[EventCallback] = None,
+) -> Dict[str, Any]:
+    """
+    Run extraction, web search and scoring for one product image.
+
+    Args:
+        image_bytes: Raw image upload.
+        user_preferences: Optional allergies/dietGoals/avoidIngredients.
+        on_event: Optional callback receiving "product_name", "ingredients",
+            "ingredient_scores" and "scores" events as soon as each is known.
+
+    Returns:
+        dict with "product_name" and "scoring_result" (ScorerResult).
+
+    Raises:
+        AnalysisError: if a stage fails or no product is recognized.
+    """
+    product_name = await extract_product(image_bytes)
+    if on_event is not None:
+        await on_event("product_name", {"product_name": product_name})
+
+    if settings.reccomendation_prefetch_enabled:
+        agent.prefetch_reccomendations(product_name)
+
+    scoring_result = await search_and_score(product_name, user_preferences, on_event)
+
+    return {
+        "product_name": product_name,
+        "scoring_result": scoring_result,
+    }
+
+
+async def run_analysis_job(params: Dict[str, Any], image_bytes: Optional[bytes]) -> Dict[str, Any]:
+    """
+    Job queue handler: analyze one queued image for params["user_id"].
+
+    Raises:
+        JobFailed: retryable for upstream failures (5xx), final for bad images.
+    """
+    try:
+        with deadline_scope(settings.request_deadline_seconds):
+            user_preferences = await load_user_preferences(params.get("user_id"))
+            result = await analyze_image(image_bytes or b"", user_preferences)
+    except AnalysisError as exc:
+        raise JobFailed(exc.status_code, exc.detail, retryable=exc.status_code >= 500) from exc
+    return {
+        "product_name": result["product_name"],
+        "scoring_data": result["scoring_result"].model_dump(),
+    }
+
+
+async def analyze_batch(
+    images: Sequence[ImageReader],
+    user_preferences: Optional[Dict] = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Analyze several images concurrently, yielding one result per image as it
+    finishes. Identical images share one extraction and images of the same
+    product share one search and scoring run. Upstream concurrency is bounded
+    by the Gemini and OpenAI semaphores, and each image gets its own
+    REQUEST_DEADLINE_SECONDS budget.
+
+    Images are read only when their extraction starts, and at most
+    BATCH_READ_CONCURRENCY are held in memory at once. A reader raising
+    AnalysisError (e.g. 413 for an oversized image) fails only its own image.
+
+    Yields:
+        {"index", "status": "success", "product_name", "scoring_data"} or
+        {"index", "status": "error", "status_code", "detail"}.
+    """
+    extractions: Dict[str, asyncio.Task] = {}
+    scorings: Dict[str, asyncio.Task] = {}
+
+    def extraction_for(image_bytes: bytes) -> asyncio.Task:
+        key = hashlib.sha256(image_bytes).hexdigest()
+        if key not in extractions:
+            extractions[key] = asyncio.create_task(extract_product(image_bytes))
+        return extractions[key]
+
+    read_slots = asyncio.Semaphore(max(1, settings.batch_read_concurrency))
+
+    def scoring_for(product_name: str) -> asyncio.Task:
+        key = agent.product_key(product_name)
+        if key not in scorings:
+            if settings.reccomendation_prefetch_enabled:
+                agent.prefetch_reccomendations(product_name)
+            scorings[key] = asyncio.create_task(search_and_score(product_name, user_preferences))
+        return scorings[key]
+
+    async def run_item(index: int, read: ImageReader) -> Dict[str, Any]:
+        try:
+            with deadline_scope(settings.request_deadline_seconds):
+                # The image bytes are released once its extraction finishes
+                async with read_slots:
+                    product_name = await asyncio.shield(extraction_for(await read()))
+                scoring_result = await asyncio.shield(scoring_for(product_name))
+        except AnalysisError as exc:
+            return {"index": index, "status": "error", "status_code": exc.status_code, "detail": exc.detail}
+        return {
+            "index": index,
+            "status": "success",
+            "product_name": product_name,
+            "scoring_data": scoring_result.model_dump(),
+        }
+
+    items = [asyncio.create_task(run_item(index, read)) for index, read in enumerate(images)]
+    try:
+        for finished in asyncio.as_completed(items):
+            yield await finished
+    finally:
+        for task in [*items, *extractions.values(), *scorings.values()]:
+            task.cancel()
@@ -0,0 +1 @@
+# Benchmarks for HealthScan AI Backend
@@ -0,0 +1,81 @@
+"""
+Throughput of concurrent product-name extractions against a simulated Gemini.
+
+Compares the previous blocking call pattern with the pooled async client.
+No API key is needed: the Gemini client is replaced by a stand-in with a
+fixed response latency.
+
+Usage:
+    python -m benchmarks.bench_gemini_concurrency [--requests 32] [--latency 0.5]
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+import types as pytypes
+
+# Keep benchmark entries out of the real image cache
+os.environ.setdefault("CACHE_DB_FILE", os.path.join(tempfile.mkdtemp(), "cache.db"))
+
+from benchmarks.load_test import _make_images  # noqa: E402
+from utils import gemini_client  # noqa: E402
+
+IMAGE_SIZE = (320, 240)
+
+
+class _SimulatedModels:
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def generate_content(self, model, contents):
+        time.sleep(self.latency)
+        return pytypes.SimpleNamespace(text="Simulated Product")
+
+
+class _SimulatedAsyncModels(_SimulatedModels):
+    async def generate_content(self, model, contents):
+        await asyncio.sleep(self.latency)
+        return pytypes.SimpleNamespace(text="Simulated Product")
+
+
+class SimulatedClient:
+    def __init__(self, latency: float):
+        self.models = _SimulatedModels(latency)
+        self.aio = pytypes.SimpleNamespace(models=_SimulatedAsyncModels(latency))
+
+
+async def _blocking_extract(client: SimulatedClient, img_bytes: bytes) -> str:
+    """The pre-pooling pattern: a sync SDK call inside an async function"""
+    response = client.models.generate_content(model=gemini_client.MODEL_NAME, contents=[img_bytes])
+    return response.text.strip()
+
+
+async def _run(extract, requests: int) -> float:
+    # Fresh noise JPEGs per run, so the pooled run decodes and prepares every image instead of hitting the cache
+    images = _make_images(requests, time.time_ns(), IMAGE_SIZE)
+    start = time.perf_counter()
+    await asyncio.gather(*(extract(img) for img in images))
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=32)
+    parser.add_argument("--latency", type=float, default=0.5)
+    args = parser.parse_args()
+
+    client = SimulatedClient(args.latency)
+    gemini_client._client = client
+
+    blocking = asyncio.run(_run(lambda img: _blocking_extract(client, img), args.requests))
+    pooled = asyncio.run(_run(gemini_client.extract_product_name, args.requests))
+
+    print(f"{args.requests} concurrent extractions, {args.latency:.2f}s simulated latency, "
+          f"max concurrency {gemini_client.settings.gemini_max_concurrency}")
+    for label, elapsed in (("blocking", blocking), ("async pooled", pooled)):
+        print(f"  {label:<14} {elapsed:7.2f}s  {args.requests / elapsed:8.1f} req/s")
+
+
+if __name__ == "__main__":
+    main()
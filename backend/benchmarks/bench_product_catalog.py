@@ -0,0 +1,83 @@
+"""
+Import throughput and lookup latency of the offline product catalog.
+
+Writes a synthetic OpenFoodFacts-style JSONL dump to a temporary directory,
+imports it while tracking peak resident memory, then times random name and
+barcode lookups.
+
+Usage:
+    python -m benchmarks.bench_product_catalog [--products 100000] [--lookups 10000] [--batch-size 5000]
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import tempfile
+import time
+
+from utils.product_catalog import ProductCatalog
+
+_BRANDS = ["Acme", "Nature's Best", "Golden Farm", "Blue Valley", "Sunrise", "Old Mill", "Green Leaf"]
+_KINDS = ["Granola Bar", "Tomato Soup", "Peanut Butter", "Oat Cookies", "Corn Flakes", "Hazelnut Spread"]
+_INGREDIENTS = ["sugar", "wheat flour", "palm oil", "salt", "cocoa", "milk powder", "soy lecithin",
+                "natural flavors", "rolled oats", "honey", "citric acid", "tomato paste", "peanuts"]
+
+
+def _write_dump(path: str, products: int, rng: random.Random) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(products):
+            ingredients = rng.sample(_INGREDIENTS, rng.randint(3, 9))
+            ingredients[0] = f"{ingredients[0]} ({', '.join(rng.sample(_INGREDIENTS, 2))})"
+            record = {
+                "code": f"{3000000000000 + i}",
+                "product_name": f"{_KINDS[i % len(_KINDS)]} {i}",
+                "brands": rng.choice(_BRANDS),
+                "ingredients_text": ", ".join(ingredients),
+            }
+            f.write(json.dumps(record) + "\n")
+
+
+def _percentile(samples, pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--products", type=int, default=100000)
+    parser.add_argument("--lookups", type=int, default=10000)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp()
+    dump = os.path.join(workdir, "products.jsonl")
+    _write_dump(dump, args.products, rng)
+    catalog = ProductCatalog(os.path.join(workdir, "catalog.db"))
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    summary = catalog.import_dump(dump, batch_size=args.batch_size)
+    rss_growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before
+
+    queries = []
+    for _ in range(args.lookups):
+        i = rng.randrange(args.products)
+        queries.append(f"{3000000000000 + i}" if rng.random() < 0.2 else f"{_KINDS[i % len(_KINDS)]} {i}")
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        catalog.lookup(query)
+        latencies.append((time.perf_counter() - start) * 1e6)
+
+    size_mb = os.path.getsize(os.path.join(workdir, "catalog.db")) / 1e6
+    print(f"Imported {summary['imported']} of {summary['read']} products in {summary['seconds']:.2f}s "
+          f"({summary['rowsPerSecond']} rows/s), peak RSS growth {rss_growth / 1024:.1f} MB, db {size_mb:.1f} MB")
+    print(f"{args.lookups} lookups ({catalog.stats()['hitRate']:.0%} hits): "
+          f"p50 {_percentile(latencies, 50):.1f}us  p95 {_percentile(latencies, 95):.1f}us  "
+          f"p99 {_percentile(latencies, 99):.1f}us")
+
+
+if __name__ == "__main__":
+    main()
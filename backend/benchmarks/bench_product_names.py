@@ -0,0 +1,87 @@
+"""
+Build time, memory and resolve latency of the fuzzy product name index.
+
+Indexes synthetic canonical product names, then resolves noisy variants of
+indexed names (sizes, noise words, typos) and names that are not indexed,
+reporting latency percentiles and how many variants found their product.
+
+Usage:
+    python -m benchmarks.bench_product_names [--names 300000] [--lookups 5000] [--threshold 0.75]
+"""
+import argparse
+import random
+import resource
+import time
+
+from utils.product_names import ProductNameIndex, canonicalize_product_name
+
+_BRANDS = ["acme", "natures best", "golden farm", "blue valley", "sunrise", "old mill", "green leaf",
+           "happy cow", "river bend", "northern star", "maple grove", "silver spoon"]
+_FLAVORS = ["vanilla", "chocolate", "strawberry", "sea salt", "honey", "cinnamon", "lemon", "mango",
+            "peanut", "almond", "coconut", "smoky bbq", "sour cream", "hazelnut", "caramel", "mint"]
+_KINDS = ["granola bar", "tomato soup", "peanut butter", "oat cookies", "corn flakes", "potato chips",
+          "greek yogurt", "iced tea", "protein shake", "rice crackers", "fruit juice", "trail mix"]
+_SIZES = ["12 fl oz", "500ml", "6 x 330ml", "1.5l", "200 g", "pack of 4", "16oz", "family size"]
+_WORDS = ["crunchy", "light", "organic", "zero", "extra", "mini", "double", "wild", "golden", "fresh",
+          "original", "classic", "premium", "whole", "natural", "spicy", "creamy", "roasted"]
+
+
+def _name(rng: random.Random) -> str:
+    words = rng.sample(_WORDS, rng.randint(0, 2))
+    return " ".join([rng.choice(_BRANDS), *words, rng.choice(_FLAVORS), rng.choice(_KINDS), str(rng.randrange(10000))])
+
+
+def _variant(name: str, rng: random.Random) -> str:
+    chars = list(name.title())
+    if rng.random() < 0.5:
+        # Typos in letters only: a different number is a different product
+        i = rng.choice([i for i, char in enumerate(chars) if char.isalpha()])
+        chars[i] = chars[i] + chars[i]
+    return f"{''.join(chars)} {rng.choice(_SIZES)}"
+
+
+def _percentile(samples, pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--names", type=int, default=300000)
+    parser.add_argument("--lookups", type=int, default=5000)
+    parser.add_argument("--threshold", type=float, default=0.75)
+    parser.add_argument("--scan-budget", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    names = [canonicalize_product_name(_name(rng)) for _ in range(args.names)]
+    index = ProductNameIndex(threshold=args.threshold, scan_budget=args.scan_budget)
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    for name in names:
+        index.add(name)
+    build_seconds = time.perf_counter() - started
+    rss_growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before
+
+    found = 0
+    latencies = []
+    for i in range(args.lookups):
+        known = i % 2 == 0
+        target = rng.choice(names)
+        query = _variant(target, rng) if known else _name(rng) + " xq"
+        start = time.perf_counter()
+        key = index.resolve(query, add=False)
+        latencies.append((time.perf_counter() - start) * 1000)
+        found += known and key == target
+
+    print(f"Indexed {len(index)} names ({index.stats()['trigrams']} trigrams) in {build_seconds:.2f}s, "
+          f"peak RSS growth {rss_growth / 1024:.1f} MB")
+    print(f"{args.lookups} resolves, {found}/{(args.lookups + 1) // 2} variants matched: "
+          f"p50 {_percentile(latencies, 50):.3f}ms  p95 {_percentile(latencies, 95):.3f}ms  "
+          f"p99 {_percentile(latencies, 99):.3f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Synthetic user and scan datasets for load tests.
+
+Builds a SQLite database in the storage engine's schema with a seeded,
+skewed distribution of scans per user (a few heavy users, a long tail),
+spread over the year before generation. Datasets are cached by
+scale and seed, so only the first run at a scale pays for generation.
+
+Usage:
+    python -m benchmarks.datasets [--scale 10k|100k|1m] [--seed 7]
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from benchmarks.stubs import INGREDIENTS, product_names
+
+# Number of scans per scale; users get SCANS_PER_USER on average
+SCALES = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+SCANS_PER_USER = 50
+BATCH_SIZE = 20_000
+
+DEFAULT_DATA_DIR = os.path.join(tempfile.gettempdir(), "safebites-bench")
+
+
+def dataset_path(scale: str, seed: int, data_dir: str = DEFAULT_DATA_DIR) -> str:
+    return os.path.join(data_dir, f"scans-{scale}-seed{seed}.db")
+
+
+def user_ids(scale: str) -> List[str]:
+    return [f"bench_user_{i}" for i in range(max(1, SCALES[scale] // SCANS_PER_USER))]
+
+
+def _scan_rows(scale: str, seed: int):
+    rng = random.Random(seed)
+    users = user_ids(scale)
+    products = product_names(500, seed=seed)
+    total = SCALES[scale]
+    now = datetime.utcnow()
+    start = now - timedelta(days=365)
+    step = (now - start - timedelta(hours=1)) / total
+    per_user: Dict[str, int] = {}
+    for i in range(total):
+        # Squaring a uniform skews scans towards the first users
+        user_id = users[int(len(users) * rng.random() ** 2)]
+        index = per_user.get(user_id, 0)
+        per_user[user_id] = index + 1
+        timestamp = (start + step * i).isoformat(timespec='microseconds')
+        score = rng.randint(1, 10)
+        scan = {
+            'productName': rng.choice(products),
+            'brand': '',
+            'image': 'data:image/jpeg;base64,/9j/4AAQSkZJRgABAQAAAQABAAD',
+            'safetyScore': score,
+            'isSafe': score >= 6,
+            'ingredients': [{'name': name, 'safety': 'HIGH'} for name in rng.sample(INGREDIENTS, 4)],
+            'id': f"scan_{user_id}_{index}",
+            'timestamp': timestamp + 'Z',
+        }
+        yield scan['id'], user_id, timestamp, json.dumps(scan, ensure_ascii=False)
+
+
+def build_dataset(scale: str, seed: int = 7, data_dir: str = DEFAULT_DATA_DIR, force: bool = False) -> str:
+    """
+    Create (or reuse) the dataset for a scale and return its path. Per-user
+    aggregates are left for the storage engine to rebuild on first open.
+    """
+    # Imported here so callers can point DATABASE_FILE at the dataset before config loads
+    from utils.sqlite_store import SCHEMA
+
+    if scale not in SCALES:
+        raise ValueError(f"Unknown scale {scale}, expected one of {', '.join(SCALES)}")
+    path = dataset_path(scale, seed, data_dir)
+    if os.path.exists(path) and not force:
+        return path
+
+    os.makedirs(data_dir, exist_ok=True)
+    partial = path + ".partial"
+    for stale in (partial, partial + "-wal", partial + "-shm"):
+        if os.path.exists(stale):
+            os.remove(stale)
+
+    started = time.perf_counter()
+    conn = sqlite3.connect(partial, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.executescript(SCHEMA)
+    users = [
+        (user_id, json.dumps({'id': user_id, 'email': f"{user_id}@example.com", 'name': user_id,
+                              'allergies': ['peanuts'] if i % 4 == 0 else [], 'dietGoals': [],
+                              'avoidIngredients': ['palm oil'] if i % 3 == 0 else []}))
+        for i, user_id in enumerate(user_ids(scale))
+    ]
+    conn.execute("BEGIN")
+    conn.executemany("INSERT INTO users (id, data) VALUES (?, ?)", users)
+    batch = []
+    for row in _scan_rows(scale, seed):
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            conn.executemany("INSERT INTO scans (id, user_id, timestamp, data) VALUES (?, ?, ?, ?)", batch)
+            batch.clear()
+    if batch:
+        conn.executemany("INSERT INTO scans (id, user_id, timestamp, data) VALUES (?, ?, ?, ?)", batch)
+    conn.execute(
+        "INSERT INTO meta (key, value) VALUES ('json_migrated', ?)", (datetime.utcnow().isoformat() + 'Z',)
+    )
+    conn.execute("COMMIT")
+    conn.close()
+    os.replace(partial, path)
+    print(f"Generated {scale} dataset ({SCALES[scale]} scans, {len(users)} users) "
+          f"in {time.perf_counter() - started:.1f}s: {path}")
+    return path
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--scale", choices=list(SCALES), default="10k")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR)
+    parser.add_argument("--force", action="store_true", help="Regenerate even if the dataset exists")
+    args = parser.parse_args()
+    print(build_dataset(args.scale, args.seed, args.data_dir, force=args.force))
+
+
+if __name__ == "__main__":
+    main()
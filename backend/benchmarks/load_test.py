@@ -0,0 +1,268 @@
+"""
+Concurrent load test of the API against stubbed Gemini and agent runs.
+
+Drives the FastAPI app in-process with a fixed number of concurrent
+clients per scenario and reports latency percentiles and throughput:
+
+    analyze  POST /api/analyze with a seeded pool of distinct images, half of
+             them for users with preferences (exercises image, product and
+             ingredient caches, personalization and preference loading)
+    scans    GET /api/users/{id}/scans, first pages and filtered pages
+    stats    GET /api/users/{id}/stats
+
+Every random choice (dataset, request mix, stub latencies) is seeded, so
+two runs with the same arguments send the same requests. Results can be
+saved as a baseline and later runs compared against it; the exit status is
+1 when any scenario regresses by more than --tolerance.
+
+Usage:
+    python -m benchmarks.load_test [--scale 10k|100k|1m] [--scenarios analyze,scans,stats]
+        [--concurrency 32] [--requests 500] [--gemini-latency lognormal:0.8,2.0]
+        [--agent-latency lognormal:1.5,4.0] [--save-baseline] [--baseline PATH]
+"""
+import argparse
+import asyncio
+import io
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from benchmarks.datasets import DEFAULT_DATA_DIR, SCALES, build_dataset, dataset_path, user_ids
+
+SCENARIOS = ("analyze", "scans", "stats")
+BASELINE_DIR = os.path.join(os.path.dirname(__file__), "baselines")
+
+# Metric -> True if higher is better
+COMPARED_METRICS = {"rps": True, "p50Ms": False, "p95Ms": False, "p99Ms": False}
+
+Request = Tuple[str, str, Dict[str, Any]]
+
+
+def _percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def _make_images(count: int, seed: int, size: Tuple[int, int]) -> List[bytes]:
+    """Distinct noise JPEGs, so each decodes, hashes and recompresses like a photo"""
+    from PIL import Image
+
+    rng = random.Random(seed)
+    images = []
+    for _ in range(count):
+        img = Image.frombytes("RGB", size, rng.randbytes(size[0] * size[1] * 3))
+        out = io.BytesIO()
+        img.save(out, format="JPEG", quality=90)
+        images.append(out.getvalue())
+    return images
+
+
+def _analyze_requests(images: List[bytes], users: List[str], seed: int) -> Callable[[int], Request]:
+    def make(i: int) -> Request:
+        rng = random.Random(seed * 1_000_003 + i)
+        # Skewed towards popular products, like real scans
+        image = images[int(len(images) * rng.random() ** 2)]
+        data = {"user_id": rng.choice(users)} if rng.random() < 0.5 else {}
+        return "POST", "/api/analyze", {"files": {"image": ("scan.jpg", image, "image/jpeg")}, "data": data}
+    return make
+
+
+def _scans_requests(users: List[str], seed: int) -> Callable[[int], Request]:
+    def make(i: int) -> Request:
+        rng = random.Random(seed * 1_000_003 + i)
+        user_id = users[int(len(users) * rng.random() ** 2)]
+        params: Dict[str, Any] = {"limit": 20}
+        roll = rng.random()
+        if roll < 0.2:
+            params["is_safe"] = "true"
+        elif roll < 0.3:
+            params["min_score"] = 7
+        return "GET", f"/api/users/{user_id}/scans", {"params": params}
+    return make
+
+
+def _stats_requests(users: List[str], seed: int) -> Callable[[int], Request]:
+    def make(i: int) -> Request:
+        rng = random.Random(seed * 1_000_003 + i)
+        return "GET", f"/api/users/{users[int(len(users) * rng.random() ** 2)]}/stats", {}
+    return make
+
+
+async def run_scenario(client, make_request: Callable[[int], Request], requests: int, concurrency: int) -> Dict[str, Any]:
+    """Closed-loop load: concurrency clients each send their next request as soon as the last one returns"""
+    latencies: List[float] = []
+    errors = 0
+    next_index = iter(range(requests))
+
+    async def worker() -> None:
+        nonlocal errors
+        for i in next_index:
+            method, url, kwargs = make_request(i)
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, url, **kwargs)
+                failed = response.status_code >= 400
+            except Exception:
+                failed = True
+            latencies.append((time.perf_counter() - started) * 1000)
+            errors += failed
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": requests,
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "rps": round(requests / elapsed, 2),
+        "p50Ms": round(_percentile(latencies, 50), 2),
+        "p95Ms": round(_percentile(latencies, 95), 2),
+        "p99Ms": round(_percentile(latencies, 99), 2),
+        "maxMs": round(max(latencies), 2),
+    }
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Regressions of results against baseline beyond tolerance (a fraction, 0.2 = 20%)"""
+    regressions = []
+    for scenario, current in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(scenario)
+        if not previous:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            before, after = previous.get(metric), current.get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            worse = -change if higher_is_better else change
+            marker = "REGRESSION" if worse > tolerance else ""
+            print(f"  {scenario:<8} {metric:<6} {before:>10.2f} -> {after:>10.2f}  {change:+7.1%}  {marker}")
+            if marker:
+                regressions.append(f"{scenario} {metric} {change:+.1%}")
+    return regressions
+
+
+async def _run(args, scenarios: List[str]) -> Dict[str, Any]:
+    import httpx
+    import main
+    from agent import agent
+    from benchmarks.stubs import LatencyDistribution, install_stubs, product_names
+    from utils import async_database
+
+    # The app logs every request at INFO, which would dominate the profile
+    logging.getLogger().setLevel(logging.WARNING)
+
+    gemini, runner = install_stubs(
+        LatencyDistribution.parse(args.gemini_latency, seed=args.seed),
+        LatencyDistribution.parse(args.agent_latency, seed=args.seed + 1),
+        product_names(args.products, seed=args.seed),
+    )
+    users = user_ids(args.scale)
+
+    # Opens the database and builds per-user aggregates once, outside the measurement
+    await async_database.get_user_stats(users[0])
+
+    makers = {
+        "analyze": lambda: _analyze_requests(
+            _make_images(args.images, args.seed, (args.image_width, args.image_height)), users, args.seed
+        ),
+        "scans": lambda: _scans_requests(users, args.seed),
+        "stats": lambda: _stats_requests(users, args.seed),
+    }
+
+    results: Dict[str, Any] = {
+        "scale": args.scale,
+        "concurrency": args.concurrency,
+        "requests": args.requests,
+        "geminiLatency": args.gemini_latency,
+        "agentLatency": args.agent_latency,
+        "seed": args.seed,
+        "scenarios": {},
+    }
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        for scenario in scenarios:
+            make_request = makers[scenario]()
+            summary = await run_scenario(client, make_request, args.requests, args.concurrency)
+            results["scenarios"][scenario] = summary
+            print(f"{scenario:<8} {summary['requests']:>6} req  {summary['errors']:>4} err  "
+                  f"{summary['rps']:>8.1f} req/s  p50 {summary['p50Ms']:>8.1f}ms  "
+                  f"p95 {summary['p95Ms']:>8.1f}ms  p99 {summary['p99Ms']:>8.1f}ms  max {summary['maxMs']:>8.1f}ms")
+
+    if "analyze" in scenarios:
+        cache = agent.cache_stats()
+        print(f"  analyze upstream calls: gemini {gemini.calls}, agents {runner.calls}, "
+              f"web search cache hit rate {cache['web_search']['hitRate']:.0%}")
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--scale", choices=list(SCALES), default="10k")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--gemini-latency", default="lognormal:0.8,2.0",
+                        help='Stub Gemini latency in seconds, "kind:p50,p95" with kind fixed, uniform or lognormal')
+    parser.add_argument("--agent-latency", default="lognormal:1.5,4.0", help="Stub agent run latency, as above")
+    parser.add_argument("--images", type=int, default=200, help="Distinct images in the analyze pool")
+    parser.add_argument("--image-width", type=int, default=1024)
+    parser.add_argument("--image-height", type=int, default=768)
+    parser.add_argument("--products", type=int, default=150, help="Distinct product names the Gemini stub returns")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR)
+    parser.add_argument("--baseline", help="Baseline JSON (default: benchmarks/baselines/<scale>.json)")
+    parser.add_argument("--save-baseline", action="store_true", help="Write this run's results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed regression before failing, 0.2 = 20%%")
+    parser.add_argument("--output", help="Also write this run's results as JSON to this path")
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    # Point storage at the dataset and keep caches fresh, before anything imports config
+    os.environ["DATABASE_BACKEND"] = "sqlite"
+    os.environ["DATABASE_FILE"] = dataset_path(args.scale, args.seed, args.data_dir)
+    os.environ["CACHE_DB_FILE"] = os.path.join(tempfile.mkdtemp(), "cache.db")
+    os.environ["CATALOG_ENABLED"] = "false"
+    os.environ["MCP_POOL_SIZE"] = "0"
+    build_dataset(args.scale, args.seed, args.data_dir)
+
+    results = asyncio.run(_run(args, scenarios))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    baseline_path = args.baseline or os.path.join(BASELINE_DIR, f"{args.scale}.json")
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(baseline_path), exist_ok=True)
+        with open(baseline_path, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved baseline to {baseline_path}")
+        return
+
+    baseline: Optional[Dict[str, Any]] = None
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+    if baseline is None:
+        print(f"No baseline at {baseline_path}, run with --save-baseline to create one")
+        return
+
+    print(f"Compared with baseline {baseline_path} (tolerance {args.tolerance:.0%}):")
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print(f"{len(regressions)} regression(s): {'; '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""
+Local stand-ins for Gemini and the OpenAI agents Runner.
+
+Each stub sleeps for a latency drawn from a seeded distribution and returns
+deterministic, schema-valid output derived from its input, so load tests
+exercise the real pipeline (caches, personalization, storage) without API
+keys or network access.
+"""
+import asyncio
+import hashlib
+import math
+import random
+import types as pytypes
+from typing import List, Tuple
+
+from agent.models.reccomender_models import ReccomenderResult
+from agent.models.scorer_models import ScorerResult
+from agent.models.search_models import WebSearchResult
+
+# Mix of knowledge-base ingredients (scored locally) and ones only the scorer agent knows
+INGREDIENTS = [
+    "sugar", "salt", "palm oil", "wheat flour", "citric acid", "soy lecithin", "whey powder",
+    "natural flavors", "rolled oats", "honey", "cocoa butter", "skim milk", "corn syrup",
+    "sunflower oil", "ascorbic acid", "xanthan gum", "sea buckthorn extract", "baobab powder",
+    "lucuma", "moringa leaf", "yacon syrup", "tiger nut flour", "sacha inchi", "camu camu",
+]
+SAFETY_LEVELS = ("HIGH", "MEDIUM", "LOW")
+
+
+def _stable_int(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class LatencyDistribution:
+    """
+    Seeded latency sampler in seconds.
+
+    "fixed": always p50. "uniform": between p50 - (p95 - p50) and p95.
+    "lognormal": median p50 with a right tail whose 95th percentile is p95,
+    the usual shape of LLM API latency.
+    """
+
+    def __init__(self, kind: str = "lognormal", p50: float = 0.5, p95: float = 1.5, seed: int = 0):
+        if kind not in ("fixed", "uniform", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {kind}")
+        self.kind = kind
+        self.p50 = p50
+        self.p95 = max(p95, p50)
+        self._rng = random.Random(seed)
+        # z of the 95th percentile of a standard normal
+        self._sigma = math.log(self.p95 / self.p50) / 1.6449 if self.p50 > 0 else 0.0
+
+    @classmethod
+    def parse(cls, spec: str, seed: int = 0) -> "LatencyDistribution":
+        """Parse "kind:p50,p95" or "p50" (fixed), in seconds, e.g. "lognormal:0.8,2.5\""""
+        kind, _, values = spec.rpartition(":")
+        numbers = [float(value) for value in values.split(",")]
+        return cls(kind or "fixed", numbers[0], numbers[-1], seed=seed)
+
+    def sample(self) -> float:
+        if self.kind == "fixed" or self.p50 <= 0:
+            return self.p50
+        if self.kind == "uniform":
+            return self._rng.uniform(max(0.0, 2 * self.p50 - self.p95), self.p95)
+        return self.p50 * math.exp(self._rng.gauss(0.0, self._sigma))
+
+    def __repr__(self) -> str:
+        return f"{self.kind}(p50={self.p50}s, p95={self.p95}s)"
+
+
+class _StubGeminiModels:
+    def __init__(self, latency: LatencyDistribution, products: List[str]):
+        self.latency = latency
+        self.products = products
+        self.calls = 0
+
+    async def generate_content(self, model, contents):
+        self.calls += 1
+        await asyncio.sleep(self.latency.sample())
+        part = contents[0]
+        data = getattr(getattr(part, "inline_data", None), "data", None) or repr(part).encode()
+        name = self.products[int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "big") % len(self.products)]
+        usage = pytypes.SimpleNamespace(prompt_token_count=260, candidates_token_count=len(name.split()) + 2)
+        return pytypes.SimpleNamespace(text=name, usage_metadata=usage)
+
+
+class StubGeminiClient:
+    """Replaces the genai.Client: the product name is a function of the uploaded bytes"""
+
+    def __init__(self, latency: LatencyDistribution, products: List[str]):
+        self.aio = pytypes.SimpleNamespace(models=_StubGeminiModels(latency, products))
+
+    @property
+    def calls(self) -> int:
+        return self.aio.models.calls
+
+
+class StubRunner:
+    """
+    Replaces Runner.run. Web search returns 6-12 ingredients picked by the
+    product name, the scorer scores whatever it is sent, and the reccomender
+    returns three alternatives.
+    """
+
+    def __init__(self, latency: LatencyDistribution):
+        self.latency = latency
+        self.calls = {}
+
+    async def run(self, agent, input_data: str, **kwargs):
+        self.calls[agent.name] = self.calls.get(agent.name, 0) + 1
+        await asyncio.sleep(self.latency.sample())
+        if agent.name == "WebSearchAgent":
+            output = self._web_search(input_data)
+        elif agent.name == "ScorerAgent":
+            output = self._score(input_data)
+        elif agent.name == "ReccomenderAgent":
+            output = self._reccomend(input_data)
+        else:
+            output = "ok"
+        usage = pytypes.SimpleNamespace(input_tokens=len(input_data) // 4 + 400, output_tokens=150)
+        return pytypes.SimpleNamespace(final_output=output, context_wrapper=pytypes.SimpleNamespace(usage=usage))
+
+    @staticmethod
+    def _web_search(product_name: str) -> WebSearchResult:
+        rng = random.Random(_stable_int(product_name))
+        names = rng.sample(INGREDIENTS, rng.randint(6, 12))
+        return WebSearchResult(List_of_ingredients=[
+            {"name": name, "description": f"{name} as listed for {product_name}."} for name in names
+        ])
+
+    @staticmethod
+    def _score(input_data: str) -> ScorerResult:
+        try:
+            names = [ingredient.name for ingredient in WebSearchResult.model_validate_json(input_data).List_of_ingredients]
+        except ValueError:
+            names = ["unknown"]
+        scores = [
+            {"ingredient_name": name, "safety_score": SAFETY_LEVELS[_stable_int(name) % 3], "reasoning": "Stub score."}
+            for name in names
+        ]
+        return ScorerResult(ingredient_scores=scores, overall_score=5.0)
+
+    @staticmethod
+    def _reccomend(input_data: str) -> ReccomenderResult:
+        product = input_data.splitlines()[0].partition(": ")[2]
+        return ReccomenderResult(recommendations=[
+            {"product_name": f"{product} alternative {i}", "health_score": str(7 + i), "reason": "Stub alternative."}
+            for i in range(3)
+        ])
+
+
+def install_stubs(
+    gemini_latency: LatencyDistribution,
+    agent_latency: LatencyDistribution,
+    products: List[str],
+) -> Tuple[StubGeminiClient, StubRunner]:
+    """Swap the Gemini client and Runner.run for stubs in this process"""
+    from agent import agent
+    from utils import gemini_client
+
+    gemini = StubGeminiClient(gemini_latency, products)
+    runner = StubRunner(agent_latency)
+    gemini_client._client = gemini
+    agent.Runner.run = runner.run
+    return gemini, runner
+
+
+def product_names(count: int, seed: int = 0) -> List[str]:
+    """
+    Deterministic product names for the Gemini stub to return. Each has a
+    made-up line name so the fuzzy product index keeps them apart.
+    """
+    rng = random.Random(seed)
+    brands = ["Acme", "Golden Farm", "Blue Valley", "Sunrise", "Old Mill", "Green Leaf", "River Bend"]
+    kinds = ["Granola Bar", "Tomato Soup", "Peanut Butter", "Oat Cookies", "Corn Flakes", "Iced Tea"]
+    names = set()
+    while len(names) < count:
+        line = "".join(rng.choice("bdfgklmnprstvz") + rng.choice("aeiou") for _ in range(3)).title()
+        names.add(f"{rng.choice(brands)} {line} {rng.choice(kinds)}")
+    return sorted(names)
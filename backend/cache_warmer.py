@@ -0,0 +1,233 @@
+"""
+Pre-analyze the most scanned products so they are served from cache
+
+Streams the scan history, ranks products by scan count weighted by recency
+(each scan counts half as much every CACHE_WARMER_HALF_LIFE_DAYS) and runs
+web search, scoring and the reccomender for the top N that are not cached
+yet, within a concurrency and rate budget. Run it after deploys or cache
+flushes, or nightly from cron inside CACHE_WARMER_WINDOW.
+
+Usage:
+    python -m cache_warmer [--top 200] [--concurrency 2] [--rate-per-minute 30]
+        [--half-life-days 14] [--window 01:00-05:00] [--force] [--dry-run]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+from utils import database
+from utils.resilience import deadline_scope
+from agent import agent
+import analysis
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class PopularProduct(NamedTuple):
+    key: str
+    name: str
+    scans: int
+    last_scanned: str
+    score: float
+
+
+def rank_products(
+    scans: Iterable[Tuple[Optional[str], str]],
+    half_life_days: float,
+    now: Optional[datetime] = None,
+) -> Tuple[List[PopularProduct], int]:
+    """
+    Rank products by recency-weighted scan count. Name variants of one product
+    are merged under its cache key and shown by their most scanned spelling.
+
+    Returns:
+        (products, best first; number of scans read)
+    """
+    now = now or datetime.utcnow()
+    keys: Dict[str, str] = {}
+    scores: Dict[str, float] = {}
+    counts: Counter = Counter()
+    last: Dict[str, str] = {}
+    spellings: Dict[str, Counter] = {}
+    read = 0
+    for name, timestamp in scans:
+        read += 1
+        if not name:
+            continue
+        key = keys.get(name)
+        if key is None:
+            key = keys[name] = agent.product_key(name)
+        try:
+            age_days = max(0.0, (now - datetime.fromisoformat(timestamp)).total_seconds() / 86400)
+        except (TypeError, ValueError):
+            age_days = 0.0
+        weight = 0.5 ** (age_days / half_life_days) if half_life_days > 0 else 1.0
+        scores[key] = scores.get(key, 0.0) + weight
+        counts[key] += 1
+        if timestamp and timestamp > last.get(key, ''):
+            last[key] = timestamp
+        spellings.setdefault(key, Counter())[name] += 1
+
+    ranked = [
+        PopularProduct(key, spellings[key].most_common(1)[0][0], counts[key], last.get(key, ''), round(score, 3))
+        for key, score in scores.items()
+    ]
+    ranked.sort(key=lambda product: product.score, reverse=True)
+    return ranked, read
+
+
+def is_warm(product: PopularProduct) -> bool:
+    """True when the analysis is cached and reccomendations are cached or served by the local index"""
+    if agent.web_search_cache.get(product.key) is None or agent.scorer_cache.get(product.key) is None:
+        return False
+    return agent.reccomendations_covered_locally(product.name) or agent.reccomender_cache.get(product.key) is not None
+
+
+def parse_window(window: str) -> Optional[Tuple[int, int]]:
+    """Parse "HH:MM-HH:MM" into (start, end) minutes after midnight, None for any time"""
+    if not window:
+        return None
+    try:
+        start, end = (datetime.strptime(part.strip(), "%H:%M") for part in window.split("-"))
+    except ValueError as exc:
+        raise ValueError(f"Invalid window {window!r}, expected HH:MM-HH:MM") from exc
+    return start.hour * 60 + start.minute, end.hour * 60 + end.minute
+
+
+def seconds_until_open(window: Optional[Tuple[int, int]], now: datetime) -> float:
+    """0 inside the window, otherwise the wait until it opens (windows may wrap past midnight)"""
+    if window is None:
+        return 0.0
+    start, end = window
+    minute = now.hour * 60 + now.minute
+    inside = start <= minute < end if start <= end else minute >= start or minute < end
+    if inside:
+        return 0.0
+    opens = now.replace(hour=start // 60, minute=start % 60, second=0, microsecond=0)
+    if opens <= now:
+        opens += timedelta(days=1)
+    return (opens - now).total_seconds()
+
+
+class RateBudget:
+    """Spaces product starts at least 60 / per_minute seconds apart"""
+
+    def __init__(self, per_minute: float):
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self) -> None:
+        async with self._lock:
+            delay = self._next - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._next = time.monotonic() + self.interval
+
+
+async def warm_product(product: PopularProduct) -> None:
+    """
+    Run web search, scoring and the reccomender for one product, filling the caches.
+
+    Raises:
+        analysis.AnalysisError: if web search or scoring fails.
+    """
+    with deadline_scope(settings.request_deadline_seconds):
+        await analysis.search_and_score(product.name)
+    task = agent.prefetch_reccomendations(product.name)
+    if task is not None:
+        await task
+
+
+async def warm(
+    products: List[PopularProduct],
+    concurrency: int,
+    rate_per_minute: float,
+    window: Optional[Tuple[int, int]] = None,
+) -> Dict[str, int]:
+    """Warm products in rank order; stops starting new ones once the window closes"""
+    budget = RateBudget(rate_per_minute)
+    pending = iter(products)
+    counts = {'warmed': 0, 'failed': 0, 'skippedOutsideWindow': 0}
+
+    async def worker() -> None:
+        for product in pending:
+            if seconds_until_open(window, datetime.now()) > 0:
+                counts['skippedOutsideWindow'] += 1
+                continue
+            await budget.wait()
+            started = time.perf_counter()
+            try:
+                await warm_product(product)
+            except Exception as exc:
+                counts['failed'] += 1
+                logger.warning(f"Failed to warm {product.name}: {exc}")
+                continue
+            counts['warmed'] += 1
+            logger.info(f"Warmed {product.name} ({product.scans} scans) in {time.perf_counter() - started:.1f}s")
+
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    return counts
+
+
+async def run(args) -> Dict:
+    window = parse_window(args.window)
+    wait = seconds_until_open(window, datetime.now())
+    if wait > 0 and not args.dry_run:
+        logger.info(f"Waiting {wait / 60:.0f} minutes for the warming window {args.window}")
+        await asyncio.sleep(wait)
+
+    started = time.perf_counter()
+    ranked, read = await asyncio.to_thread(rank_products, database.iter_scan_products(), args.half_life_days)
+    top = ranked[:args.top]
+    selected = top if args.force else [product for product in top if not is_warm(product)]
+    summary = {
+        'scansRead': read,
+        'products': len(ranked),
+        'top': len(top),
+        'alreadyWarm': len(top) - len(selected),
+        'rankSeconds': round(time.perf_counter() - started, 3),
+    }
+    if args.dry_run:
+        summary['wouldWarm'] = [
+            {'name': product.name, 'key': product.key, 'scans': product.scans,
+             'lastScanned': product.last_scanned, 'score': product.score}
+            for product in selected
+        ]
+        return summary
+
+    summary.update(await warm(selected, args.concurrency, args.rate_per_minute, window))
+    summary['seconds'] = round(time.perf_counter() - started, 3)
+    return summary
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--top", type=int, default=settings.cache_warmer_top_n, help="Products to keep warm")
+    parser.add_argument("--concurrency", type=int, default=settings.cache_warmer_concurrency,
+                        help="Products warmed at once")
+    parser.add_argument("--rate-per-minute", type=float, default=settings.cache_warmer_rate_per_minute,
+                        help="Most products started per minute, 0 for no limit")
+    parser.add_argument("--half-life-days", type=float, default=settings.cache_warmer_half_life_days,
+                        help="Age at which a scan counts half, 0 to rank by count alone")
+    parser.add_argument("--window", default=settings.cache_warmer_window,
+                        help='Local time window to warm in, e.g. "01:00-05:00"; waits for it to open')
+    parser.add_argument("--force", action="store_true", help="Re-run products that are already cached")
+    parser.add_argument("--dry-run", action="store_true", help="Only print the products that would be warmed")
+    args = parser.parse_args()
+    try:
+        parse_window(args.window)
+    except ValueError as exc:
+        parser.error(str(exc))
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    print(json.dumps(asyncio.run(run(args)), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -23,9 +23,115 @@ class Settings(BaseModel):
     # CORS Configuration
     cors_origins: List[str] = os.getenv("CORS_ORIGINS", "http://localhost:3000").split(",")
     
+    # Gemini Client Configuration
+    gemini_max_concurrency: int = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
+    gemini_timeout_seconds: float = float(os.getenv("GEMINI_TIMEOUT_SECONDS", "30"))
+
+    # OpenAI Agent Configuration
+    openai_max_concurrency: int = int(os.getenv("OPENAI_MAX_CONCURRENCY", "16"))
+    openai_timeout_seconds: float = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "60"))
+
+    # Deadline, Hedging and Circuit Breaker Configuration
+    request_deadline_seconds: float = float(os.getenv("REQUEST_DEADLINE_SECONDS", "90"))
+    hedge_enabled: bool = os.getenv("HEDGE_ENABLED", "true").lower() == "true"
+    hedge_min_delay_seconds: float = float(os.getenv("HEDGE_MIN_DELAY_SECONDS", "1"))
+    hedge_min_samples: int = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+    openai_hedge_model: str = os.getenv("OPENAI_HEDGE_MODEL", "")  # empty: hedge on the same model
+    gemini_hedge_model: str = os.getenv("GEMINI_HEDGE_MODEL", "")
+    circuit_failure_threshold: int = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+    circuit_reset_seconds: float = float(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+    stale_cache_seconds: int = int(os.getenv("STALE_CACHE_SECONDS", "604800"))
+
+    # Batch Analysis Configuration
+    batch_max_images: int = int(os.getenv("BATCH_MAX_IMAGES", "50"))
+    batch_max_upload_bytes: int = int(os.getenv("BATCH_MAX_UPLOAD_BYTES", str(100 * 1024 * 1024)))
+    batch_read_concurrency: int = int(os.getenv("BATCH_READ_CONCURRENCY", "8"))
+
+    # Job Queue Configuration
+    job_queue_enabled: bool = os.getenv("JOB_QUEUE_ENABLED", "true").lower() == "true"
+    job_queue_db_file: str = os.getenv("JOB_QUEUE_DB_FILE", "data/jobs.db")
+    job_workers: int = int(os.getenv("JOB_WORKERS", "4"))
+    job_queue_max_depth: int = int(os.getenv("JOB_QUEUE_MAX_DEPTH", "1000"))
+    job_max_attempts: int = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+    job_retry_backoff_seconds: float = float(os.getenv("JOB_RETRY_BACKOFF_SECONDS", "2"))
+    job_retry_backoff_max_seconds: float = float(os.getenv("JOB_RETRY_BACKOFF_MAX_SECONDS", "60"))
+    job_result_ttl_seconds: int = int(os.getenv("JOB_RESULT_TTL_SECONDS", "86400"))
+    job_callback_timeout_seconds: float = float(os.getenv("JOB_CALLBACK_TIMEOUT_SECONDS", "10"))
+    job_callback_allowed_hosts: List[str] = [
+        host.strip() for host in os.getenv("JOB_CALLBACK_ALLOWED_HOSTS", "").split(",") if host.strip()
+    ]  # empty: any host resolving to a public address
+
+    # MCP Server Pool Configuration
+    mcp_pool_size: int = int(os.getenv("MCP_POOL_SIZE", "2"))
+    mcp_checkout_timeout_seconds: float = float(os.getenv("MCP_CHECKOUT_TIMEOUT_SECONDS", "10"))
+    mcp_health_check_interval_seconds: float = float(os.getenv("MCP_HEALTH_CHECK_INTERVAL_SECONDS", "30"))
+
     # Data Storage
     data_dir: str = "data"
     analyses_file: str = "data/analyses.json"
+    database_backend: str = os.getenv("DATABASE_BACKEND", "sqlite")  # "sqlite" or "json"
+    database_file: str = os.getenv("DATABASE_FILE", "data/safebites.db")
+    storage_max_workers: int = int(os.getenv("STORAGE_MAX_WORKERS", "4"))
+    cache_db_file: str = os.getenv("CACHE_DB_FILE", "data/cache.db")
+
+    # Analysis Cache Configuration
+    analysis_cache_ttl_seconds: int = int(os.getenv("ANALYSIS_CACHE_TTL_SECONDS", "604800"))
+    analysis_cache_max_entries: int = int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", "5000"))
+    ingredient_cache_ttl_seconds: int = int(os.getenv("INGREDIENT_CACHE_TTL_SECONDS", "2592000"))
+    ingredient_cache_max_entries: int = int(os.getenv("INGREDIENT_CACHE_MAX_ENTRIES", "20000"))
+
+    # Ingredient Knowledge Base Configuration
+    ingredient_kb_enabled: bool = os.getenv("INGREDIENT_KB_ENABLED", "true").lower() == "true"
+    ingredient_kb_file: str = os.getenv("INGREDIENT_KB_FILE", "agent/data/ingredient_kb.tsv")
+
+    # Offline Product Catalog Configuration
+    catalog_enabled: bool = os.getenv("CATALOG_ENABLED", "true").lower() == "true"
+    catalog_db_file: str = os.getenv("CATALOG_DB_FILE", "data/catalog.db")
+
+    # Product Name Matching Configuration
+    product_match_threshold: float = float(os.getenv("PRODUCT_MATCH_THRESHOLD", "0.75"))
+    product_match_scan_budget: int = int(os.getenv("PRODUCT_MATCH_SCAN_BUDGET", "2000"))
+
+    # Reccomendation Prefetch Configuration
+    reccomendation_prefetch_enabled: bool = os.getenv("RECCOMENDATION_PREFETCH_ENABLED", "true").lower() == "true"
+    reccomendation_prefetch_ttl_seconds: int = int(os.getenv("RECCOMENDATION_PREFETCH_TTL_SECONDS", "300"))
+    reccomendation_cache_ttl_seconds: int = int(os.getenv("RECCOMENDATION_CACHE_TTL_SECONDS", "604800"))
+
+    # Local Reccomendation Index Configuration
+    reccomendation_index_enabled: bool = os.getenv("RECCOMENDATION_INDEX_ENABLED", "true").lower() == "true"
+    reccomendation_index_min_results: int = int(os.getenv("RECCOMENDATION_INDEX_MIN_RESULTS", "3"))
+    reccomendation_index_min_gain: float = float(os.getenv("RECCOMENDATION_INDEX_MIN_GAIN", "0.5"))
+    reccomendation_index_top_k: int = int(os.getenv("RECCOMENDATION_INDEX_TOP_K", "5"))
+    reccomendation_index_dense_size: int = int(os.getenv("RECCOMENDATION_INDEX_DENSE_SIZE", "30"))
+
+    # Cache Warmer Configuration
+    cache_warmer_top_n: int = int(os.getenv("CACHE_WARMER_TOP_N", "200"))
+    cache_warmer_concurrency: int = int(os.getenv("CACHE_WARMER_CONCURRENCY", "2"))
+    cache_warmer_rate_per_minute: float = float(os.getenv("CACHE_WARMER_RATE_PER_MINUTE", "30"))
+    cache_warmer_half_life_days: float = float(os.getenv("CACHE_WARMER_HALF_LIFE_DAYS", "14"))
+    cache_warmer_window: str = os.getenv("CACHE_WARMER_WINDOW", "")  # "HH:MM-HH:MM" local time, empty: any time
+
+    # Image Dedup Cache Configuration
+    image_cache_ttl_seconds: int = int(os.getenv("IMAGE_CACHE_TTL_SECONDS", "2592000"))
+    image_cache_max_entries: int = int(os.getenv("IMAGE_CACHE_MAX_ENTRIES", "2000"))
+    image_cache_max_distance: int = int(os.getenv("IMAGE_CACHE_MAX_DISTANCE", "2"))
+
+    # Image Preprocessing Configuration
+    image_max_upload_bytes: int = int(os.getenv("IMAGE_MAX_UPLOAD_BYTES", str(15 * 1024 * 1024)))
+    image_preprocess_enabled: bool = os.getenv("IMAGE_PREPROCESS_ENABLED", "true").lower() == "true"
+    image_max_edge: int = int(os.getenv("IMAGE_MAX_EDGE", "1536"))
+    image_quality: int = int(os.getenv("IMAGE_QUALITY", "85"))
+    image_output_format: str = os.getenv("IMAGE_OUTPUT_FORMAT", "jpeg")  # "jpeg" or "webp"
+
+    # Metrics Configuration
+    metrics_enabled: bool = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+    metrics_timing_headers: bool = os.getenv("METRICS_TIMING_HEADERS", "false").lower() == "true"
+
+    # Response Compression Configuration
+    compression_enabled: bool = os.getenv("COMPRESSION_ENABLED", "true").lower() == "true"
+    compression_min_bytes: int = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+    compression_gzip_level: int = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+    compression_brotli_quality: int = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
     
     class Config:
         env_file = ".env"
@@ -1,15 +1,26 @@
 """
 SafeBites AI Backend - FastAPI Application
 """
+import asyncio
+import json
 import logging
-from fastapi import FastAPI, File, UploadFile, Form
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, File, UploadFile, Form, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, StreamingResponse
 from fastapi import HTTPException, status
 from pydantic import BaseModel
 from typing import Optional, List
+from utils import async_database
+from utils.image_cache import image_cache
+from utils.image_preprocess import UploadSizeLimitMiddleware, UploadTooLarge, image_preprocessor, read_upload
+from utils import metrics
+from utils.responses import CompressionMiddleware, FastJSONResponse, dumps, etag_json
 from utils import gemini_client
-from utils import database
+from utils.resilience import CircuitOpenError, deadline_scope
+from utils.job_queue import CallbackRejected, QueueFull, job_queue
 from agent import agent
+import analysis
 from config import settings
 
 # Configure logging
@@ -19,11 +30,24 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start and stop long-lived resources with the server"""
+    if settings.mcp_pool_size > 0:
+        await agent.preferences_mcp_pool.start()
+    if settings.job_queue_enabled:
+        await job_queue.start()
+    yield
+    await job_queue.stop()
+    await agent.preferences_mcp_pool.stop()
+
 # Initialize FastAPI app
 app = FastAPI(
     title="SafeBites AI Backend",
     description="AI-powered product health analysis API",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse,
 )
 
 # Add CORS middleware
@@ -35,6 +59,55 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Multipart framing and form fields on top of the image bytes
+UPLOAD_OVERHEAD_BYTES = 64 * 1024
+
+app.add_middleware(
+    UploadSizeLimitMiddleware,
+    limits={
+        "/api/analyze": settings.image_max_upload_bytes + UPLOAD_OVERHEAD_BYTES,
+        "/api/analyze/stream": settings.image_max_upload_bytes + UPLOAD_OVERHEAD_BYTES,
+        "/api/jobs/analyze": settings.image_max_upload_bytes + UPLOAD_OVERHEAD_BYTES,
+        "/api/analyze/batch": settings.batch_max_upload_bytes,
+    },
+)
+
+if settings.compression_enabled:
+    app.add_middleware(
+        CompressionMiddleware,
+        minimum_size=settings.compression_min_bytes,
+        gzip_level=settings.compression_gzip_level,
+        brotli_quality=settings.compression_brotli_quality,
+    )
+
+if settings.metrics_enabled:
+    app.add_middleware(metrics.MetricsMiddleware, timing_headers=settings.metrics_timing_headers)
+
+def _collect_runtime_metrics():
+    """Cache counters and executor queue depth, read on every scrape"""
+    yield from metrics.cache_families({**agent.cache_stats(), "image": image_cache.stats()})
+    storage = async_database.storage_executor.stats()
+    yield ("safebites_storage_queue_depth", "gauge", "Storage calls waiting for a worker", [({}, storage["queueDepth"])])
+    yield ("safebites_storage_in_flight", "gauge", "Storage calls running", [({}, storage["inFlight"])])
+    if settings.job_queue_enabled:
+        jobs = job_queue.depth()
+        yield ("safebites_job_queue_depth", "gauge", "Jobs waiting for a worker", [({}, jobs["queued"])])
+        yield ("safebites_jobs_in_flight", "gauge", "Jobs being run", [({}, jobs["running"])])
+    circuits = [({"upstream": breaker.name}, int(breaker.state != "closed"))
+                for breaker in (gemini_client.gemini_breaker, agent.openai_breaker)]
+    yield ("safebites_circuit_open", "gauge", "1 while the upstream's circuit breaker is open or half open", circuits)
+
+metrics.registry.add_collector(_collect_runtime_metrics)
+
+job_queue.register("analyze", analysis.run_analysis_job)
+
+async def _read_image(image: UploadFile) -> bytes:
+    """Read an uploaded image, rejecting it with 413 past IMAGE_MAX_UPLOAD_BYTES"""
+    try:
+        return await read_upload(image, settings.image_max_upload_bytes)
+    except UploadTooLarge as exc:
+        raise HTTPException(status_code=status.HTTP_413_CONTENT_TOO_LARGE, detail=str(exc)) from exc
+
 @app.get("/")
 async def root():
     """Health check endpoint"""
@@ -56,7 +129,48 @@ async def analyze_product(
     """
     logger.info(f"API REQUEST - /api/analyze - Starting product analysis (user_id: {user_id})")
     
-    image_bytes = await image.read()
+    image_bytes = await _read_image(image)
+
+    if not image_bytes:
+        logger.error("No image bytes provided")
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Image bytes payload is required.",
+        )
+
+    try:
+        with deadline_scope(settings.request_deadline_seconds):
+            # Fetch user preferences if user_id is provided
+            user_preferences = await analysis.load_user_preferences(user_id)
+            result = await analysis.analyze_image(image_bytes, user_preferences)
+    except analysis.AnalysisError as exc:
+        raise HTTPException(status_code=exc.status_code, detail=exc.detail) from exc
+
+    logger.info("API REQUEST - /api/analyze - Analysis completed successfully")
+
+    return FastJSONResponse({
+        "status": "success",
+        "product_name": result["product_name"],
+        "scoring_data": result["scoring_result"].model_dump(),
+    })
+
+def _sse_event(event: str, payload) -> str:
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+@app.post("/api/analyze/stream")
+async def analyze_product_stream(
+    image: UploadFile = File(...),
+    user_id: Optional[str] = Form(None)
+):
+    """Analyze product image, streaming each stage as a Server-Sent Event.
+
+    Emits product_name, ingredients, ingredient_scores (possibly several times),
+    scores and finally done, or a single error event if a stage fails.
+    """
+    logger.info(f"API REQUEST - /api/analyze/stream - Starting product analysis (user_id: {user_id})")
+
+    image_bytes = await _read_image(image)
 
     if not image_bytes:
         logger.error("No image bytes provided")
@@ -65,70 +179,135 @@ async def analyze_product(
             detail="Image bytes payload is required.",
         )
 
-    # Fetch user preferences if user_id is provided
-    user_preferences = None
-    if user_id:
+    user_preferences = await analysis.load_user_preferences(user_id)
+    events: asyncio.Queue = asyncio.Queue()
+
+    async def on_event(event: str, payload) -> None:
+        await events.put(_sse_event(event, payload))
+
+    async def run_pipeline() -> None:
         try:
-            user = database.get_user(user_id)
-            if user:
-                user_preferences = {
-                    "allergies": user.get("allergies", []),
-                    "dietGoals": user.get("dietGoals", []),
-                    "avoidIngredients": user.get("avoidIngredients", []),
-                }
-                logger.info(f"User preferences loaded for user {user_id}: {user_preferences}")
+            with deadline_scope(settings.request_deadline_seconds):
+                await analysis.analyze_image(image_bytes, user_preferences, on_event=on_event)
+            await events.put(_sse_event("done", {"status": "success"}))
+            logger.info("API REQUEST - /api/analyze/stream - Analysis completed successfully")
+        except analysis.AnalysisError as exc:
+            await events.put(_sse_event("error", {"status_code": exc.status_code, "detail": exc.detail}))
         except Exception as exc:
-            logger.warning(f"Failed to fetch user preferences: {exc}")
-            # Continue without preferences if fetch fails
+            logger.error(f"Streaming analysis failed: {type(exc).__name__}: {exc}")
+            await events.put(_sse_event("error", {"status_code": 500, "detail": "Analysis failed."}))
+        finally:
+            await events.put(None)
 
-    try:
-        product_name =  await gemini_client.extract_product_name(image_bytes)
-    except Exception as exc:
-        logger.error(f"Failed to extract product name: {type(exc).__name__} at line {exc.__traceback__.tb_lineno} of {__file__}: {exc}")
-        raise HTTPException(
-            status_code=status.HTTP_502_BAD_GATEWAY,
-            detail="Failed to extract product information from image.",
-        ) from exc
+    async def stream():
+        task = asyncio.create_task(run_pipeline())
+        try:
+            while (message := await events.get()) is not None:
+                yield message
+        finally:
+            # Client went away, stop paying for the remaining stages
+            task.cancel()
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.post("/api/analyze/batch")
+async def analyze_product_batch(
+    images: List[UploadFile] = File(...),
+    user_id: Optional[str] = Form(None)
+):
+    """Analyze several product images concurrently.
 
-    if not product_name:
-        logger.warning("No recognizable product found in the provided image.")
+    Streams one NDJSON line per image, in completion order, each tagged with the
+    image's index and filename. Images are read as their analysis starts, so an
+    oversized image fails with its own 413 line.
+    """
+    logger.info(f"API REQUEST - /api/analyze/batch - Starting analysis of {len(images)} images (user_id: {user_id})")
+
+    if len(images) > settings.batch_max_images:
         raise HTTPException(
-            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
-            detail="No recognizable product found in the provided image.",
+            status_code=status.HTTP_413_CONTENT_TOO_LARGE,
+            detail=f"At most {settings.batch_max_images} images per batch.",
         )
 
+    filenames = [image.filename for image in images]
+    user_preferences = await analysis.load_user_preferences(user_id)
+
+    def reader(image: UploadFile):
+        async def read() -> bytes:
+            try:
+                return await read_upload(image, settings.image_max_upload_bytes)
+            except UploadTooLarge as exc:
+                raise analysis.AnalysisError(status.HTTP_413_CONTENT_TOO_LARGE, str(exc)) from exc
+        return read
+
+    async def stream():
+        async for item in analysis.analyze_batch([reader(image) for image in images], user_preferences):
+            item["filename"] = filenames[item["index"]]
+            yield dumps(item) + b"\n"
+        logger.info("API REQUEST - /api/analyze/batch - Batch analysis completed")
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+async def _validate_callback_url(callback_url: str) -> None:
     try:
-        web_search_result = await agent.run_web_search_agent(product_name)
-    except Exception as exc:
-        logger.error(f"Web search agent failed: {type(exc).__name__} at line {exc.__traceback__.tb_lineno} of {__file__}: {exc}")
+        await job_queue.check_callback_url(callback_url)
+    except CallbackRejected as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+
+@app.post("/api/jobs/analyze", status_code=status.HTTP_202_ACCEPTED)
+async def submit_analysis_job(
+    image: UploadFile = File(...),
+    user_id: Optional[str] = Form(None),
+    priority: int = Form(0, ge=0, le=9),
+    callback_url: Optional[str] = Form(None),
+):
+    """Queue a product image for analysis and return the job id at once.
+
+    Higher priority jobs run first. Poll GET /api/jobs/{job_id} for the result,
+    or pass callback_url to have the finished job POSTed to it.
+    """
+    if not settings.job_queue_enabled:
+        raise HTTPException(status_code=404, detail="Job queue is disabled")
+
+    image_bytes = await _read_image(image)
+    if not image_bytes:
         raise HTTPException(
-            status_code=status.HTTP_502_BAD_GATEWAY,
-            detail="Failed to retrieve external product data.",
-        ) from exc
-    
-    # web search agent calls scorer agent internally now
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Image bytes payload is required.",
+        )
+    if callback_url:
+        await _validate_callback_url(callback_url)
+
     try:
-        scoring_result = await agent.run_scorer_agent(
-            web_search_result.model_dump_json(),
-            user_preferences=user_preferences
+        job_id = await job_queue.submit(
+            "analyze", {"user_id": user_id}, image_bytes, priority=priority, callback_url=callback_url
         )
-    except Exception as exc:
-        logger.error(f"Scorer agent failed: {type(exc).__name__} at line {exc.__traceback__.tb_lineno} of {__file__}: {exc}")
+    except QueueFull as exc:
         raise HTTPException(
-            status_code=status.HTTP_502_BAD_GATEWAY,
-            detail="Failed to retrieve scoring data.",
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many queued analyses, please try again shortly.",
+            headers={"Retry-After": "30"},
         ) from exc
-    
-    # add extracted data to response
-    scoring_result = scoring_result.model_dump_json()
 
-    logger.info("API REQUEST - /api/analyze - Analysis completed successfully")
+    logger.info(f"API REQUEST - /api/jobs/analyze - Queued job {job_id} (user_id: {user_id}, priority: {priority})")
+    return {"status": "queued", "job_id": job_id, "status_url": f"/api/jobs/{job_id}"}
 
-    return {
-        "status": "success",
-        "product_name": product_name,
-        "scoring_data": scoring_result,
-    }
+@app.get("/api/jobs/stats")
+async def get_job_stats():
+    """Get queue depth, outcomes and queue wait of the analysis job queue"""
+    return {"jobs": await asyncio.to_thread(job_queue.stats)}
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Get a job's status, and its result or error once finished"""
+    job = await asyncio.to_thread(job_queue.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {"job": job}
 
 @app.get("/api/reccomendations/{product_name}/{overall_score}")
 async def reccomended_alternatives(product_name: str, overall_score: float):
@@ -136,7 +315,18 @@ async def reccomended_alternatives(product_name: str, overall_score: float):
     logger.info(f"API REQUEST - /api/reccomended_alternatives - Getting alternatives for {product_name} with score {overall_score}")
     
     try:
-        reccomender_result = await agent.run_reccomender_agent(product_name, overall_score)
+        with deadline_scope(settings.request_deadline_seconds):
+            reccomender_result = await agent.get_reccomendations(product_name, overall_score)
+    except TimeoutError as exc:
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail="Timed out retrieving reccomender data.",
+        ) from exc
+    except CircuitOpenError as exc:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Reccomendations are temporarily unavailable.",
+        ) from exc
     except Exception as exc:
         logger.error(f"Reccomender agent failed: {type(exc).__name__} at line {exc.__traceback__.tb_lineno} of {__file__}: {exc}")
         raise HTTPException(
@@ -146,10 +336,66 @@ async def reccomended_alternatives(product_name: str, overall_score: float):
 
     logger.info("API REQUEST - /api/reccomended_alternatives - Alternatives retrieved successfully")
 
-    return {
+    return FastJSONResponse({
         "status": "success",
-        "reccomender_data": reccomender_result.model_dump_json(),
+        "reccomender_data": reccomender_result.model_dump(),
+    })
+
+@app.get("/api/cache/stats")
+async def get_cache_stats():
+    """Get hit/miss counters for the analysis caches"""
+    # Catalog stats read SQLite, keep them off the event loop
+    cache = await async_database.storage_executor.run(agent.cache_stats)
+    return {"cache": {**cache, "image": image_cache.stats()}}
+
+
+@app.delete("/api/cache/products/{product_name}")
+async def invalidate_product_cache(product_name: str):
+    """Drop cached analysis results for a product"""
+    removed = agent.invalidate_product(product_name)
+    logger.info(f"Analysis cache invalidated for {product_name} (removed: {removed})")
+    return {"status": "success", "removed": removed}
+
+
+@app.get("/api/storage/stats")
+async def get_storage_stats():
+    """Get queue depth and latency of the storage executor"""
+    return {"storage": async_database.storage_executor.stats()}
+
+
+@app.get("/api/images/stats")
+async def get_image_stats():
+    """Get bytes saved and average time per stage of image preprocessing"""
+    return {"preprocessing": image_preprocessor.stats()}
+
+
+@app.get("/api/upstreams/stats")
+async def get_upstream_stats():
+    """Get circuit breaker state and hedge rate/win rate per upstream stage"""
+    stages = {
+        gemini_client.gemini_upstream.name: gemini_client.gemini_upstream.stats(),
+        **{name: upstream.stats() for name, upstream in agent.agent_upstreams.items()},
     }
+    circuits = {
+        breaker.name: breaker.stats() for breaker in (gemini_client.gemini_breaker, agent.openai_breaker)
+    }
+    return {"circuits": circuits, "stages": stages}
+
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Stage latency, token, cost, cache and error metrics in Prometheus text format"""
+    if not settings.metrics_enabled:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    # Collectors query SQLite (job queue depth, catalog size), keep them off the event loop
+    return Response(await async_database.storage_executor.run(metrics.render), media_type=metrics.CONTENT_TYPE)
+
+
+@app.get("/api/mcp/stats")
+async def get_mcp_stats():
+    """Get status of the user preferences MCP server pool"""
+    return {"mcp_pool": agent.preferences_mcp_pool.stats()}
+
 
 @app.post("/api/preferences")
 async def update_preferences(preference_input: str):
@@ -182,7 +428,7 @@ class UserCreate(BaseModel):
 @app.get("/api/users/{user_id}")
 async def get_user(user_id: str):
     """Get user by ID"""
-    user = database.get_user(user_id)
+    user = await async_database.get_user(user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return {"user": user}
@@ -191,7 +437,7 @@ async def get_user(user_id: str):
 @app.post("/api/users")
 async def create_or_update_user(user_data: UserCreate):
     """Create or update user"""
-    user = database.create_or_update_user(user_data.dict())
+    user = await async_database.create_or_update_user(user_data.dict())
     return {"user": user}
 
 
@@ -205,7 +451,7 @@ async def update_user_preferences(user_id: str, preferences: UserPreferences):
     """Update user preferences"""
     # Convert Pydantic model to dict
     preferences_dict = preferences.dict(exclude_none=True)
-    user = database.update_user_preferences(user_id, preferences_dict)
+    user = await async_database.update_user_preferences(user_id, preferences_dict)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     logger.info(f"User preferences updated for {user_id}: {preferences_dict}")
@@ -225,27 +471,54 @@ class ScanCreate(BaseModel):
 
 
 @app.get("/api/users/{user_id}/scans")
-async def get_user_scans(user_id: str, limit: Optional[int] = None):
-    """Get scans for a user"""
-    scans = database.get_user_scans(user_id, limit)
-    return {"scans": scans}
+async def get_user_scans(
+    request: Request,
+    user_id: str,
+    limit: Optional[int] = Query(None, ge=1),
+    cursor: Optional[str] = None,
+    before: Optional[str] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    is_safe: Optional[bool] = None,
+    min_score: Optional[float] = None,
+    max_score: Optional[float] = None,
+):
+    """Get scans for a user, most recent first, with cursor pagination and filters.
+
+    Returns 304 when If-None-Match carries the ETag of an unchanged page.
+    """
+    try:
+        page = await async_database.get_user_scans_page(
+            user_id,
+            limit=limit,
+            cursor=cursor,
+            before=before,
+            start_date=start_date,
+            end_date=end_date,
+            is_safe=is_safe,
+            min_score=min_score,
+            max_score=max_score,
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+    return etag_json(request, {"scans": page["scans"], "nextCursor": page["nextCursor"]})
 
 
 @app.post("/api/users/{user_id}/scans")
 async def add_user_scan(user_id: str, scan_data: ScanCreate):
     """Add a scan for a user"""
-    scan = database.add_user_scan(user_id, scan_data.dict())
+    scan = await async_database.add_user_scan(user_id, scan_data.dict())
     return {"scan": scan, "status": "success"}
 
 
 # Stats endpoint
 @app.get("/api/users/{user_id}/stats")
-async def get_user_stats(user_id: str):
-    """Get statistics for a user"""
-    stats = database.get_user_stats(user_id)
+async def get_user_stats(request: Request, user_id: str):
+    """Get statistics for a user, or 304 when If-None-Match matches their ETag"""
+    stats = await async_database.get_user_stats(user_id)
     if stats is None:
         raise HTTPException(status_code=404, detail="User not found")
-    return {"stats": stats}
+    return etag_json(request, {"stats": stats})
 
 if __name__ == "__main__":
     import uvicorn
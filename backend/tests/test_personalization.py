@@ -0,0 +1,46 @@
+from agent.ingredient_kb import IngredientKnowledgeBase
+from agent.models.scorer_models import IngredientScoreSchema, ScorerResult
+from agent.personalization import PersonalizationOverlay
+
+overlay = PersonalizationOverlay(IngredientKnowledgeBase.load())
+
+
+def _result(*names):
+    return ScorerResult(
+        ingredient_scores=[
+            IngredientScoreSchema(ingredient_name=name, safety_score="HIGH", reasoning="Generic.")
+            for name in names
+        ],
+        overall_score=9.0,
+    )
+
+
+def test_allergen_only_in_description_is_flagged():
+    result = overlay.apply(
+        _result("Natural Flavor", "Sugar"),
+        {"allergies": ["milk"]},
+        {"natural flavor": "Contains milk.", "sugar": "Sweetener."},
+    )
+    assert [(flag.ingredient_name, flag.kind, flag.matched) for flag in result.flags] == [
+        ("Natural Flavor", "allergy", "milk"),
+    ]
+    assert result.ingredient_scores[0].safety_score == "LOW"
+    assert result.overall_score < result.generic_overall_score
+
+
+def test_sub_ingredient_in_description_is_flagged():
+    result = overlay.apply(
+        _result("milk chocolate"),
+        {"allergies": ["soy"]},
+        {"milk chocolate": "Contains sugar, cocoa butter, milk, soy lecithin, vanilla."},
+    )
+    assert [flag.matched for flag in result.flags] == ["soy"]
+
+
+def test_negated_mention_in_description_is_not_flagged():
+    result = overlay.apply(
+        _result("Oat Drink"),
+        {"allergies": ["milk"]},
+        {"oat drink": "A dairy-free drink made without milk."},
+    )
+    assert result.flags == []
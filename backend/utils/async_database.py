@@ -0,0 +1,124 @@
+"""
+Async wrappers for utils.database that run disk I/O on a dedicated, bounded
+thread pool so request handlers never block the event loop.
+"""
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, List, Optional
+from config import settings
+from utils import database
+from utils.metrics import track_stage
+
+
+class StorageExecutor:
+    """Bounded executor for blocking storage calls with queue and latency metrics"""
+
+    def __init__(self, max_workers: int, sample_size: int = 1000):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="storage")
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self.completed = 0
+        self.errors = 0
+        self._wait_ms: Deque[float] = deque(maxlen=sample_size)
+        self._run_ms: Deque[float] = deque(maxlen=sample_size)
+
+    def _call(self, fn: Callable, submitted: float, args: tuple, kwargs: dict) -> Any:
+        started = time.perf_counter()
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+            self._wait_ms.append((started - submitted) * 1000)
+        try:
+            return fn(*args, **kwargs)
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            raise
+        finally:
+            with self._lock:
+                self._running -= 1
+                self.completed += 1
+                self._run_ms.append((time.perf_counter() - started) * 1000)
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """Run a blocking storage function on the pool and await its result"""
+        with self._lock:
+            self._queued += 1
+        loop = asyncio.get_running_loop()
+        with track_stage(f"db.{fn.__name__}"):
+            return await loop.run_in_executor(
+                self._executor, self._call, fn, time.perf_counter(), args, kwargs
+            )
+
+    @staticmethod
+    def _percentile(samples: List[float], pct: float) -> float:
+        if not samples:
+            return 0.0
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+        return round(ordered[index], 3)
+
+    def stats(self) -> Dict[str, Any]:
+        """Current queue depth and recent wait/run latencies in milliseconds"""
+        with self._lock:
+            wait_ms = list(self._wait_ms)
+            run_ms = list(self._run_ms)
+            queued, running = self._queued, self._running
+        return {
+            'backend': settings.database_backend,
+            'maxWorkers': self.max_workers,
+            'queueDepth': queued,
+            'inFlight': running,
+            'completed': self.completed,
+            'errors': self.errors,
+            'waitMsP50': self._percentile(wait_ms, 50),
+            'waitMsP95': self._percentile(wait_ms, 95),
+            'runMsP50': self._percentile(run_ms, 50),
+            'runMsP95': self._percentile(run_ms, 95),
+            'runMsMax': round(max(run_ms), 3) if run_ms else 0.0,
+        }
+
+
+storage_executor = StorageExecutor(max_workers=settings.storage_max_workers)
+
+
+# User operations
+async def get_user(user_id: str) -> Optional[Dict]:
+    """Get user by ID"""
+    return await storage_executor.run(database.get_user, user_id)
+
+
+async def create_or_update_user(user_data: Dict) -> Dict:
+    """Create or update user"""
+    return await storage_executor.run(database.create_or_update_user, user_data)
+
+
+async def update_user_preferences(user_id: str, preferences: Dict) -> Optional[Dict]:
+    """Update user preferences"""
+    return await storage_executor.run(database.update_user_preferences, user_id, preferences)
+
+
+# Scan operations
+async def get_user_scans(user_id: str, limit: Optional[int] = None) -> List[Dict]:
+    """Get scans for a user"""
+    return await storage_executor.run(database.get_user_scans, user_id, limit)
+
+
+async def get_user_scans_page(user_id: str, **filters) -> Dict:
+    """Get a page of scans for a user, see database.get_user_scans_page"""
+    return await storage_executor.run(database.get_user_scans_page, user_id, **filters)
+
+
+async def add_user_scan(user_id: str, scan_data: Dict) -> Dict:
+    """Add a scan for a user"""
+    return await storage_executor.run(database.add_user_scan, user_id, scan_data)
+
+
+async def get_user_stats(user_id: str) -> Optional[Dict]:
+    """Get statistics for a user"""
+    return await storage_executor.run(database.get_user_stats, user_id)
@@ -0,0 +1,252 @@
+"""
+Persistent TTL/LRU cache backed by SQLite
+"""
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+_NON_WORD_RE = re.compile(r"[^\w\s]")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_key(value: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace so equivalent names share a key"""
+    value = _NON_WORD_RE.sub(" ", value.lower())
+    return _WHITESPACE_RE.sub(" ", value).strip()
+
+
+class PersistentCache:
+    """
+    Size-bounded LRU cache with optional TTL, persisted to a SQLite table.
+
+    Entries live in memory for fast lookups and are written through to disk so
+    they survive restarts. Misses are read through from disk, so entries written
+    by other processes (the cache warmer, other workers) are picked up. Values
+    must be JSON serializable. With stale_seconds,
+    expired entries are kept that much longer for get_stale(), so callers can
+    fall back to them while an upstream is unavailable.
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        max_entries: int = 1000,
+        ttl_seconds: Optional[float] = None,
+        db_path: Optional[str] = None,
+        stale_seconds: float = 0,
+    ):
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.db_path = Path(db_path or settings.cache_db_file)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[Any, Optional[float]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stale_hits = 0
+
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                expires_at REAL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            )
+            """
+        )
+        self._conn.commit()
+        self._load()
+
+    def _load(self) -> None:
+        """Load the most recently written, unexpired entries from disk"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM cache_entries WHERE namespace = ? AND expires_at IS NOT NULL AND expires_at <= ?",
+                (self.namespace, now - self.stale_seconds),
+            )
+            rows = self._conn.execute(
+                "SELECT key, value, expires_at FROM cache_entries WHERE namespace = ? "
+                "ORDER BY updated_at DESC LIMIT ?",
+                (self.namespace, self.max_entries),
+            ).fetchall()
+            for key, value, expires_at in reversed(rows):
+                try:
+                    self._entries[key] = (json.loads(value), expires_at)
+                except json.JSONDecodeError:
+                    continue
+            self._conn.commit()
+        logger.info(f"Cache '{self.namespace}' loaded {len(self._entries)} entries from {self.db_path}")
+
+    def _expired(self, expires_at: Optional[float], now: float) -> bool:
+        return expires_at is not None and expires_at <= now
+
+    def _delete_rows(self, keys: Iterable[str]) -> None:
+        self._conn.executemany(
+            "DELETE FROM cache_entries WHERE namespace = ? AND key = ?",
+            [(self.namespace, key) for key in keys],
+        )
+
+    def _read_through_locked(self, key: str) -> Optional[Tuple[Any, Optional[float]]]:
+        row = self._conn.execute(
+            "SELECT value, expires_at FROM cache_entries WHERE namespace = ? AND key = ?",
+            (self.namespace, key),
+        ).fetchone()
+        if row is None:
+            return None
+        try:
+            entry = (json.loads(row[0]), row[1])
+        except json.JSONDecodeError:
+            return None
+        self._entries[key] = entry
+        self._evict_locked()
+        return entry
+
+    def _get_locked(self, key: str, now: float) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._read_through_locked(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        value, expires_at = entry
+        if self._expired(expires_at, now):
+            # Kept for get_stale() until the stale window passes too
+            if not self._expired(expires_at, now - self.stale_seconds):
+                self.misses += 1
+                return None
+            del self._entries[key]
+            self._delete_rows([key])
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def _set_locked(self, key: str, value: Any, now: float) -> Tuple[str, str, str, Optional[float], float]:
+        expires_at = now + self.ttl_seconds if self.ttl_seconds else None
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        return (self.namespace, key, json.dumps(value, ensure_ascii=False), expires_at, now)
+
+    def _evict_locked(self) -> None:
+        evicted = []
+        while len(self._entries) > self.max_entries:
+            key, _ = self._entries.popitem(last=False)
+            evicted.append(key)
+        if evicted:
+            self._delete_rows(evicted)
+            self.evictions += len(evicted)
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value for key, or None on a miss"""
+        now = time.time()
+        with self._lock:
+            value = self._get_locked(key, now)
+            self._conn.commit()
+            return value
+
+    def get_stale(self, key: str) -> Optional[Any]:
+        """Return the value for key even if expired within stale_seconds, or None"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._read_through_locked(key)
+            if entry is None or self._expired(entry[1], now - self.stale_seconds):
+                return None
+            self.stale_hits += 1
+            return entry[0]
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        """Return a mapping of the keys that were found in the cache"""
+        now = time.time()
+        found = {}
+        with self._lock:
+            for key in keys:
+                value = self._get_locked(key, now)
+                if value is not None:
+                    found[key] = value
+            self._conn.commit()
+        return found
+
+    def set(self, key: str, value: Any) -> None:
+        """Store value under key, evicting least recently used entries if needed"""
+        self.set_many({key: value})
+
+    def set_many(self, items: Dict[str, Any]) -> None:
+        """Store several values in a single transaction"""
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            rows = [self._set_locked(key, value, now) for key, value in items.items()]
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO cache_entries (namespace, key, value, expires_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._evict_locked()
+            self._conn.commit()
+
+    def invalidate(self, key: str) -> bool:
+        """Remove a single entry, returning True if it was present"""
+        with self._lock:
+            existed = self._entries.pop(key, None) is not None
+            self._delete_rows([key])
+            self._conn.commit()
+        return existed
+
+    def clear(self) -> None:
+        """Remove every entry in this namespace"""
+        with self._lock:
+            self._entries.clear()
+            self._conn.execute("DELETE FROM cache_entries WHERE namespace = ?", (self.namespace,))
+            self._conn.commit()
+
+    def items(self) -> Iterator[Tuple[str, Any]]:
+        """Snapshot of unexpired (key, value) pairs, least recently used first"""
+        now = time.time()
+        with self._lock:
+            snapshot = [
+                (key, value)
+                for key, (value, expires_at) in self._entries.items()
+                if not self._expired(expires_at, now)
+            ]
+        return iter(snapshot)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current size"""
+        lookups = self.hits + self.misses
+        return {
+            'namespace': self.namespace,
+            'size': len(self._entries),
+            'maxEntries': self.max_entries,
+            'ttlSeconds': self.ttl_seconds,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'staleHits': self.stale_hits,
+            'hitRate': round(self.hits / lookups, 4) if lookups else 0.0,
+        }
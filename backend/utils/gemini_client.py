@@ -1,8 +1,16 @@
 import os
+import asyncio
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
 from google import genai
 from google.genai import types
 from dotenv import load_dotenv
+from utils.image_cache import ImageFingerprint, image_cache, fingerprint
+from utils.image_preprocess import image_preprocessor
+from utils.metrics import record_usage, track_stage
+from utils.resilience import CircuitBreaker, ResilientUpstream
+from config import settings
 
 # Configure logging
 logging.basicConfig(
@@ -15,27 +23,125 @@ load_dotenv(override=True)
 
 api_key = os.getenv("GOOGLE_API_KEY")
 
+MODEL_NAME = 'gemini-2.0-flash-exp'
+PROMPT = "Return the product name shown in the image. Return only the cleaned product name nothing else."
+
+# Shared client and concurrency limits, created on first use
+_client: Optional[genai.Client] = None
+_executor: Optional[ThreadPoolExecutor] = None
+_semaphore: Optional[asyncio.Semaphore] = None
+_semaphore_loop: Optional[asyncio.AbstractEventLoop] = None
+
+# Fails fast while Gemini is down
+gemini_breaker = CircuitBreaker(
+    "gemini",
+    failure_threshold=settings.circuit_failure_threshold,
+    reset_seconds=settings.circuit_reset_seconds,
+)
+
+
+def _get_client() -> genai.Client:
+    """Return the process-wide Gemini client, reusing its HTTP connection pool"""
+    global _client
+    if _client is None:
+        _client = genai.Client(
+            api_key=api_key,
+            http_options=types.HttpOptions(timeout=int(settings.gemini_timeout_seconds * 1000)),
+        )
+    return _client
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    """Semaphore bounding in-flight Gemini requests on the running event loop"""
+    global _semaphore, _semaphore_loop
+    loop = asyncio.get_running_loop()
+    if _semaphore is None or _semaphore_loop is not loop:
+        _semaphore = asyncio.Semaphore(settings.gemini_max_concurrency)
+        _semaphore_loop = loop
+    return _semaphore
+
+
+# Hedges calls slower than the recent p95; attempts get a concurrency slot before their timeout starts
+gemini_upstream = ResilientUpstream(
+    "gemini.generate_content",
+    gemini_breaker,
+    timeout=settings.gemini_timeout_seconds,
+    hedge=settings.hedge_enabled,
+    min_hedge_delay=settings.hedge_min_delay_seconds,
+    min_samples=settings.hedge_min_samples,
+    slots=_get_semaphore,
+)
+
+
+async def _generate_content(contents: list, model: str = MODEL_NAME):
+    """Call Gemini without blocking the event loop"""
+    client = _get_client()
+    if hasattr(client, "aio"):
+        return await client.aio.models.generate_content(model=model, contents=contents)
+
+    # Older SDKs have no async surface, run the blocking call on a bounded pool
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.gemini_max_concurrency, thread_name_prefix="gemini"
+        )
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _executor,
+        lambda: client.models.generate_content(model=model, contents=contents),
+    )
+
+
 async def extract_product_name(img_bytes: bytes) -> str:
     """
     Functions take input the input image and calls the gemini API to prompt and return the product name as shown in the image
     """
+    with track_stage("gemini.extract_product_name"):
+        return await _extract_product_name(img_bytes)
+
+
+def _cached_product_name(img_bytes: bytes) -> Tuple[ImageFingerprint, Optional[str]]:
+    fp = fingerprint(img_bytes)
+    return fp, image_cache.get(fp)
+
+
+async def _extract_product_name(img_bytes: bytes) -> str:
+    # Hashing decodes the image and the lookup reads SQLite, keep both off the event loop
+    fp, cached_name = await asyncio.to_thread(_cached_product_name, img_bytes)
+    if cached_name is not None:
+        logger.info(f"Image cache hit, skipping Gemini extraction: {cached_name}")
+        return cached_name
+
+    # Downscale and recompress before upload, sent with the image's real MIME type
+    prepared = await asyncio.to_thread(image_preprocessor.prepare, img_bytes)
+
     logger.info("Extracting product name from image using Gemini")
     
-    client = genai.Client(api_key=api_key)
-    
-    response = client.models.generate_content(
-        model='gemini-2.0-flash-exp',
-        contents=[
-            types.Part.from_bytes(
-                data=img_bytes,
-                mime_type='image/heic'
-            ),
-            "Return the product name shown in the image. Return only the cleaned product name nothing else."
-        ]
-    )
+    contents = [
+        types.Part.from_bytes(
+            data=prepared.data,
+            mime_type=prepared.mime_type
+        ),
+        PROMPT,
+    ]
+
+    async def attempt(hedged: bool):
+        model = settings.gemini_hedge_model if hedged and settings.gemini_hedge_model else MODEL_NAME
+        with track_stage("gemini.generate_content"):
+            response = await _generate_content(contents, model)
+        usage = getattr(response, "usage_metadata", None)
+        if usage is not None:
+            record_usage(model, usage.prompt_token_count, usage.candidates_token_count)
+        return response
+
+    # Holds a concurrency slot, timed out against GEMINI_TIMEOUT_SECONDS and the request deadline
+    response = await gemini_upstream.call(attempt)
     
     product_name = response.text.strip()
     logger.info(f"Product name extracted successfully")
+
+    if product_name:
+        await asyncio.to_thread(image_cache.put, fp, product_name)
     
     return product_name
 
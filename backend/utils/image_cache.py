@@ -0,0 +1,155 @@
+"""
+Image dedup cache mapping scanned images to extracted product names
+"""
+import hashlib
+import io
+import logging
+import threading
+from typing import Any, Dict, NamedTuple, Optional
+from config import settings
+from utils.cache import PersistentCache
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional, fall back to exact content matching
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+HASH_SIZE = 8
+
+
+class ImageFingerprint(NamedTuple):
+    content_hash: str
+    perceptual_hash: Optional[int]
+
+
+def content_hash(img_bytes: bytes) -> str:
+    """SHA-256 of the raw image bytes"""
+    return hashlib.sha256(img_bytes).hexdigest()
+
+
+def dhash(img_bytes: bytes, hash_size: int = HASH_SIZE) -> Optional[int]:
+    """
+    Difference hash of the image: compares neighbouring pixels of a tiny
+    grayscale thumbnail. Returns None if the image can't be decoded.
+    """
+    if Image is None:
+        return None
+    try:
+        with Image.open(io.BytesIO(img_bytes)) as img:
+            # Let the JPEG decoder skip most of the full-resolution work
+            img.draft("L", (hash_size * 8, hash_size * 8))
+            pixels = list(
+                img.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS).getdata()
+            )
+    except Exception as exc:
+        logger.debug(f"Could not compute perceptual hash: {exc}")
+        return None
+
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def fingerprint(img_bytes: bytes) -> ImageFingerprint:
+    """Compute both the exact and perceptual hash of an image"""
+    return ImageFingerprint(content_hash(img_bytes), dhash(img_bytes))
+
+
+class ImageHashCache:
+    """
+    Maps images to product names by exact content hash, falling back to the
+    closest perceptual hash within max_distance bits. The 64-bit dHash of two
+    flavors in the same packaging can be only a few bits apart, so the
+    distance is kept small. get and put read and write SQLite, run them off
+    the event loop.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 2000,
+        max_distance: int = 2,
+        ttl_seconds: Optional[float] = None,
+        db_path: Optional[str] = None,
+    ):
+        self.max_distance = max_distance
+        self._store = PersistentCache(
+            "image_hash", max_entries=max_entries, ttl_seconds=ttl_seconds, db_path=db_path
+        )
+        self._lock = threading.Lock()
+        self._perceptual: Dict[str, int] = {
+            key: value["dhash"]
+            for key, value in self._store.items()
+            if value.get("dhash") is not None
+        }
+        self.exact_hits = 0
+        self.perceptual_hits = 0
+        self.misses = 0
+
+    def _closest(self, perceptual_hash: int) -> Optional[str]:
+        best_key, best_distance = None, self.max_distance + 1
+        with self._lock:
+            candidates = list(self._perceptual.items())
+        for key, other in candidates:
+            distance = (perceptual_hash ^ other).bit_count()
+            if distance < best_distance:
+                best_key, best_distance = key, distance
+                if distance == 0:
+                    break
+        return best_key
+
+    def get(self, fp: ImageFingerprint) -> Optional[str]:
+        """Return the cached product name for an image fingerprint, or None"""
+        entry = self._store.get(fp.content_hash)
+        if entry is not None:
+            self.exact_hits += 1
+            return entry["product_name"]
+
+        if fp.perceptual_hash is not None:
+            key = self._closest(fp.perceptual_hash)
+            if key is not None:
+                entry = self._store.get(key)
+                if entry is not None:
+                    self.perceptual_hits += 1
+                    return entry["product_name"]
+                # Entry was evicted or expired from the backing store
+                with self._lock:
+                    self._perceptual.pop(key, None)
+
+        self.misses += 1
+        return None
+
+    def put(self, fp: ImageFingerprint, product_name: str) -> None:
+        """Remember the product name extracted for an image"""
+        self._store.set(fp.content_hash, {"product_name": product_name, "dhash": fp.perceptual_hash})
+        with self._lock:
+            if fp.perceptual_hash is not None:
+                self._perceptual[fp.content_hash] = fp.perceptual_hash
+            if len(self._perceptual) > 2 * self._store.max_entries:
+                live = {key for key, _ in self._store.items()}
+                self._perceptual = {k: v for k, v in self._perceptual.items() if k in live}
+
+    def stats(self) -> Dict[str, Any]:
+        """Exact/perceptual hit counters and current size"""
+        hits = self.exact_hits + self.perceptual_hits
+        lookups = hits + self.misses
+        return {
+            'size': len(self._store),
+            'maxEntries': self._store.max_entries,
+            'maxDistance': self.max_distance,
+            'exactHits': self.exact_hits,
+            'perceptualHits': self.perceptual_hits,
+            'misses': self.misses,
+            'hitRate': round(hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+image_cache = ImageHashCache(
+    max_entries=settings.image_cache_max_entries,
+    max_distance=settings.image_cache_max_distance,
+    ttl_seconds=settings.image_cache_ttl_seconds,
+)
@@ -0,0 +1,266 @@
+"""
+Image preprocessing before Gemini extraction: format sniffing, bounded
+upload reads, downscaling and recompression
+"""
+import io
+import logging
+import threading
+import time
+from typing import Any, Dict, NamedTuple, Optional
+from fastapi import HTTPException, UploadFile, status
+from fastapi.responses import JSONResponse
+from config import settings
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional, images are then sent as uploaded
+    Image = None
+    ImageOps = None
+
+try:
+    from pillow_heif import register_heif_opener
+    register_heif_opener()
+    HEIF_SUPPORTED = True
+except ImportError:  # HEIC decoding is optional, HEIC uploads are then sent as uploaded
+    HEIF_SUPPORTED = False
+
+logger = logging.getLogger(__name__)
+
+READ_CHUNK_SIZE = 64 * 1024
+
+OUTPUT_FORMATS = {
+    "jpeg": ("JPEG", "image/jpeg"),
+    "webp": ("WEBP", "image/webp"),
+}
+
+# ISO base media "ftyp" brands for HEIF-family images
+_HEIC_BRANDS = {b"heic", b"heix", b"hevc", b"hevx", b"heim", b"heis"}
+_HEIF_BRANDS = {b"mif1", b"msf1"}
+_AVIF_BRANDS = {b"avif", b"avis"}
+_HEIF_MIME_TYPES = {"image/heic", "image/heif", "image/avif"}
+
+
+class UploadTooLarge(ValueError):
+    """The upload exceeds the configured maximum size"""
+
+    def __init__(self, max_bytes: int):
+        super().__init__(f"Image exceeds the {max_bytes // (1024 * 1024)} MB upload limit.")
+        self.max_bytes = max_bytes
+
+
+class PreparedImage(NamedTuple):
+    data: bytes
+    mime_type: str
+    source_mime_type: str
+    source_bytes: int
+    width: Optional[int]
+    height: Optional[int]
+    stage_ms: Dict[str, float]
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.source_bytes - len(self.data)
+
+
+def sniff_mime_type(data: bytes) -> Optional[str]:
+    """Detect the image format from its magic bytes, or None if unrecognized"""
+    if data.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if data[:2] == b"BM":
+        return "image/bmp"
+    if data[:4] in (b"II*\x00", b"MM\x00*"):
+        return "image/tiff"
+    if data[4:8] == b"ftyp":
+        brands = {data[8:12]}
+        box_size = int.from_bytes(data[:4], "big")
+        # Compatible brands follow the major brand and minor version
+        for offset in range(16, min(box_size, len(data)) - 3, 4):
+            brands.add(data[offset:offset + 4])
+        if brands & _AVIF_BRANDS:
+            return "image/avif"
+        if brands & _HEIC_BRANDS:
+            return "image/heic"
+        if brands & _HEIF_BRANDS:
+            return "image/heif"
+    return None
+
+
+async def read_upload(upload: UploadFile, max_bytes: int) -> bytes:
+    """
+    Read an uploaded file in chunks, raising UploadTooLarge as soon as it
+    grows past max_bytes instead of buffering the whole body first.
+    """
+    if upload.size is not None and upload.size > max_bytes:
+        raise UploadTooLarge(max_bytes)
+    chunks = []
+    total = 0
+    while chunk := await upload.read(READ_CHUNK_SIZE):
+        total += len(chunk)
+        if total > max_bytes:
+            raise UploadTooLarge(max_bytes)
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+class UploadSizeLimitMiddleware:
+    """
+    ASGI middleware capping request bodies on upload routes. Requests that
+    declare a larger Content-Length are rejected with 413 before any of the
+    body is read; chunked bodies are counted as they stream in and cut off
+    once they pass the limit.
+    """
+
+    def __init__(self, app, limits: Dict[str, int]):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope["path"]) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        detail = f"Request body exceeds {limit} bytes."
+        headers = dict(scope["headers"])
+        content_length = headers.get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > limit:
+            response = JSONResponse({"detail": detail}, status_code=status.HTTP_413_CONTENT_TOO_LARGE)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise HTTPException(status_code=status.HTTP_413_CONTENT_TOO_LARGE, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+class ImagePreprocessor:
+    """
+    Downscales images to max_edge and recompresses them for upload, keeping
+    running totals of bytes saved and time spent per stage.
+    """
+
+    def __init__(self, max_edge: int, quality: int, output_format: str = "jpeg", enabled: bool = True):
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unsupported image output format: {output_format}")
+        self.max_edge = max_edge
+        self.quality = quality
+        self.output_format = output_format
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.images = 0
+        self.recompressed = 0
+        self.passthrough = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._stage_ms: Dict[str, float] = {}
+
+    def prepare(self, data: bytes) -> PreparedImage:
+        """
+        Sniff, decode, downscale and re-encode an image. Falls back to the
+        original bytes (with the sniffed MIME type) when Pillow can't decode
+        the format or recompression wouldn't make the upload smaller.
+        """
+        stage_ms: Dict[str, float] = {}
+        started = time.perf_counter()
+        source_mime = sniff_mime_type(data) or "application/octet-stream"
+        stage_ms["sniff"] = (time.perf_counter() - started) * 1000
+
+        prepared = PreparedImage(data, source_mime, source_mime, len(data), None, None, stage_ms)
+        decodable = Image is not None and (HEIF_SUPPORTED or source_mime not in _HEIF_MIME_TYPES)
+        if self.enabled and decodable:
+            try:
+                prepared = self._recompress(data, source_mime, stage_ms)
+            except Exception as exc:
+                logger.warning(f"Image preprocessing failed, sending original ({source_mime}): {exc}")
+
+        self._record(prepared, recompressed=prepared.data is not data)
+        logger.info(
+            f"Image preprocessed: {source_mime} {prepared.source_bytes} B -> {prepared.mime_type} "
+            f"{len(prepared.data)} B (saved {prepared.bytes_saved} B), "
+            + ", ".join(f"{stage} {ms:.1f} ms" for stage, ms in stage_ms.items())
+        )
+        return prepared
+
+    def _recompress(self, data: bytes, source_mime: str, stage_ms: Dict[str, float]) -> PreparedImage:
+        pil_format, mime_type = OUTPUT_FORMATS[self.output_format]
+
+        started = time.perf_counter()
+        with Image.open(io.BytesIO(data)) as img:
+            # JPEG can decode straight to a reduced scale, far cheaper than a full decode
+            img.draft("RGB", (self.max_edge, self.max_edge))
+            img = ImageOps.exif_transpose(img)
+            img.load()
+            stage_ms["decode"] = (time.perf_counter() - started) * 1000
+
+            started = time.perf_counter()
+            resized = max(img.size) > self.max_edge
+            if resized:
+                img.thumbnail((self.max_edge, self.max_edge), Image.BICUBIC)
+            if img.mode != "RGB":
+                img = img.convert("RGB")
+            stage_ms["resize"] = (time.perf_counter() - started) * 1000
+
+            started = time.perf_counter()
+            out = io.BytesIO()
+            img.save(out, format=pil_format, quality=self.quality, optimize=True)
+            encoded = out.getvalue()
+            stage_ms["encode"] = (time.perf_counter() - started) * 1000
+            width, height = img.size
+
+        if not resized and len(encoded) >= len(data) and source_mime in ("image/jpeg", "image/png", "image/webp"):
+            return PreparedImage(data, source_mime, source_mime, len(data), width, height, stage_ms)
+        return PreparedImage(encoded, mime_type, source_mime, len(data), width, height, stage_ms)
+
+    def _record(self, prepared: PreparedImage, recompressed: bool) -> None:
+        with self._lock:
+            self.images += 1
+            if recompressed:
+                self.recompressed += 1
+            else:
+                self.passthrough += 1
+            self.bytes_in += prepared.source_bytes
+            self.bytes_out += len(prepared.data)
+            for stage, ms in prepared.stage_ms.items():
+                self._stage_ms[stage] = self._stage_ms.get(stage, 0.0) + ms
+
+    def stats(self) -> Dict[str, Any]:
+        """Images processed, bytes saved and average milliseconds per stage"""
+        with self._lock:
+            return {
+                'enabled': self.enabled and Image is not None,
+                'maxEdge': self.max_edge,
+                'quality': self.quality,
+                'outputFormat': self.output_format,
+                'images': self.images,
+                'recompressed': self.recompressed,
+                'passthrough': self.passthrough,
+                'bytesIn': self.bytes_in,
+                'bytesOut': self.bytes_out,
+                'bytesSaved': self.bytes_in - self.bytes_out,
+                'avgStageMs': {
+                    stage: round(total / self.images, 3) for stage, total in self._stage_ms.items()
+                } if self.images else {},
+            }
+
+
+image_preprocessor = ImagePreprocessor(
+    max_edge=settings.image_max_edge,
+    quality=settings.image_quality,
+    output_format=settings.image_output_format,
+    enabled=settings.image_preprocess_enabled,
+)
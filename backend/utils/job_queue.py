@@ -0,0 +1,536 @@
+"""
+Persistent priority queue of background jobs with a bounded worker pool
+
+Jobs are stored in SQLite, so queued work survives restarts. Workers claim
+the highest-priority job that is due, run its handler and then store the
+result, schedule a retry with exponential backoff, or record the failure.
+Finished jobs can be polled by id and are optionally POSTed to a callback URL.
+"""
+import asyncio
+import ipaddress
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from urllib.parse import urlparse
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterable, List, Optional, Set
+import httpx
+from config import settings
+from utils.metrics import registry, track_stage
+
+logger = logging.getLogger(__name__)
+
+job_wait = registry.histogram(
+    "safebites_job_wait_seconds", "Time jobs spent queued before a worker picked them up", ("kind",)
+)
+jobs_total = registry.counter(
+    "safebites_jobs_total", "Job attempts by outcome (succeeded, failed, retried)", ("kind", "outcome")
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    params TEXT NOT NULL,
+    payload BLOB,
+    callback_url TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    available_at REAL NOT NULL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_ready ON jobs (status, priority DESC, created_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_finished ON jobs (finished_at);
+"""
+
+# Receives the job's params and payload, returns its JSON-serializable result
+JobHandler = Callable[[Dict[str, Any], Optional[bytes]], Awaitable[Dict[str, Any]]]
+
+
+class JobFailed(Exception):
+    """A job attempt failed; carries the status and detail reported to the client"""
+
+    def __init__(self, status_code: int, detail: str, retryable: bool = True):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retryable = retryable
+
+
+class QueueFull(Exception):
+    """The queue already holds max_depth waiting jobs"""
+
+
+class CallbackRejected(ValueError):
+    """The callback URL may not be called"""
+
+
+def _is_public_address(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if ip.version == 6 and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+def _isoformat(value: Optional[float]) -> Optional[str]:
+    if value is None:
+        return None
+    return datetime.fromtimestamp(value, timezone.utc).replace(tzinfo=None).isoformat() + 'Z'
+
+
+class JobQueue:
+    """
+    SQLite-backed job queue drained by `workers` asyncio tasks. Higher
+    priority jobs run first, then oldest first. Failed attempts are retried
+    up to max_attempts times, waiting backoff_seconds * 2^(attempt - 1)
+    (capped at backoff_max_seconds, with jitter) in between. Jobs left
+    running by a crash are queued again on start.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        workers: int = 4,
+        max_depth: int = 1000,
+        max_attempts: int = 3,
+        backoff_seconds: float = 2.0,
+        backoff_max_seconds: float = 60.0,
+        result_ttl_seconds: float = 86400.0,
+        callback_timeout: float = 10.0,
+        callback_allowed_hosts: Iterable[str] = (),
+        poll_interval: float = 1.0,
+        sample_size: int = 1000,
+    ):
+        self.db_path = Path(db_path)
+        self.workers = workers
+        self.max_depth = max_depth
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self.result_ttl_seconds = result_ttl_seconds
+        self.callback_timeout = callback_timeout
+        self.callback_allowed_hosts = frozenset(callback_allowed_hosts)
+        self.poll_interval = poll_interval
+
+        self._handlers: Dict[str, JobHandler] = {}
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._tasks: List[asyncio.Task] = []
+        self._callbacks: Set[asyncio.Task] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._wait_ms: Deque[float] = deque(maxlen=sample_size)
+
+        self.succeeded = 0
+        self.failed = 0
+        self.retried = 0
+        self.rejected = 0
+        self.callbacks_failed = 0
+
+    def register(self, kind: str, handler: JobHandler) -> None:
+        """Run jobs of this kind with handler"""
+        self._handlers[kind] = handler
+
+    @property
+    def started(self) -> bool:
+        return any(not task.done() for task in self._tasks)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            with self._lock:
+                if self._conn is None:
+                    self.db_path.parent.mkdir(parents=True, exist_ok=True)
+                    conn = sqlite3.connect(str(self.db_path), check_same_thread=False, isolation_level=None)
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.execute("PRAGMA synchronous=NORMAL")
+                    conn.execute("PRAGMA busy_timeout=5000")
+                    conn.executescript(SCHEMA)
+                    self._conn = conn
+        return self._conn
+
+    def _execute(self, sql: str, params: tuple = ()) -> List[tuple]:
+        conn = self._connect()
+        with self._lock:
+            return conn.execute(sql, params).fetchall()
+
+    async def start(self) -> None:
+        """Requeue jobs interrupted by a restart and start the workers"""
+        if self.started:
+            return
+        recovered = await asyncio.to_thread(
+            self._execute, "UPDATE jobs SET status = 'queued' WHERE status = 'running' RETURNING id"
+        )
+        if recovered:
+            logger.info(f"Requeued {len(recovered)} jobs interrupted by a restart")
+        await asyncio.to_thread(self._purge)
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._work(), name=f"job-worker-{i}") for i in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._purge_periodically(), name="job-purge"))
+        for task in self._tasks:
+            task.add_done_callback(self._task_exited)
+        logger.info(f"Job queue started with {self.workers} workers")
+
+    @staticmethod
+    def _task_exited(task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            exc = task.exception()
+            logger.error(f"Job queue task {task.get_name()} stopped: {type(exc).__name__}: {exc}", exc_info=exc)
+
+    async def stop(self) -> None:
+        """Stop the workers; jobs they were running are queued again"""
+        tasks = self._tasks + list(self._callbacks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+        logger.info("Job queue stopped")
+
+    async def submit(
+        self,
+        kind: str,
+        params: Dict[str, Any],
+        payload: Optional[bytes] = None,
+        priority: int = 0,
+        callback_url: Optional[str] = None,
+    ) -> str:
+        """
+        Queue a job and return its id.
+
+        Raises:
+            QueueFull: if max_depth jobs are already waiting.
+        """
+        if kind not in self._handlers:
+            raise ValueError(f"No handler registered for job kind {kind}")
+        job_id = uuid.uuid4().hex
+        await asyncio.to_thread(self._insert, job_id, kind, params, payload, priority, callback_url)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job_id
+
+    def _insert(
+        self,
+        job_id: str,
+        kind: str,
+        params: Dict[str, Any],
+        payload: Optional[bytes],
+        priority: int,
+        callback_url: Optional[str],
+    ) -> None:
+        now = time.time()
+        conn = self._connect()
+        with self._lock:
+            depth = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+            if depth >= self.max_depth:
+                self.rejected += 1
+                raise QueueFull(f"{depth} jobs are already queued")
+            conn.execute(
+                "INSERT INTO jobs (id, kind, status, priority, params, payload, callback_url, max_attempts, "
+                "available_at, created_at) VALUES (?, ?, 'queued', ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, priority, json.dumps(params), payload, callback_url, self.max_attempts, now, now),
+            )
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """A job's status, and its result or error once it has one"""
+        rows = self._execute(
+            "SELECT id, kind, status, priority, attempts, max_attempts, available_at, created_at, started_at, "
+            "finished_at, result, error FROM jobs WHERE id = ?",
+            (job_id,),
+        )
+        return self._view(rows[0]) if rows else None
+
+    def _view(self, row: tuple) -> Dict[str, Any]:
+        (job_id, kind, status, priority, attempts, max_attempts, available_at,
+         created_at, started_at, finished_at, result, error) = row
+        job = {
+            'id': job_id,
+            'kind': kind,
+            'status': status,
+            'priority': priority,
+            'attempts': attempts,
+            'maxAttempts': max_attempts,
+            'createdAt': _isoformat(created_at),
+            'startedAt': _isoformat(started_at),
+            'finishedAt': _isoformat(finished_at),
+        }
+        if status == 'queued' and attempts:
+            job['retryAt'] = _isoformat(available_at)
+        if result is not None:
+            job['result'] = json.loads(result)
+        if error is not None:
+            job['error'] = json.loads(error)
+        return job
+
+    def _claim(self) -> Optional[Dict[str, Any]]:
+        """Mark the next due job running and return it"""
+        now = time.time()
+        rows = self._execute(
+            "UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ? "
+            "WHERE id = (SELECT id FROM jobs WHERE status = 'queued' AND available_at <= ? "
+            "ORDER BY priority DESC, created_at LIMIT 1) "
+            "RETURNING id, kind, params, payload, callback_url, attempts, max_attempts, available_at",
+            (now, now),
+        )
+        if not rows:
+            return None
+        job_id, kind, params, payload, callback_url, attempts, max_attempts, available_at = rows[0]
+        return {
+            'id': job_id,
+            'kind': kind,
+            'params': json.loads(params),
+            'payload': payload,
+            'callbackUrl': callback_url,
+            'attempts': attempts,
+            'maxAttempts': max_attempts,
+            'waited': max(0.0, now - available_at),
+        }
+
+    def _next_due_in(self) -> Optional[float]:
+        rows = self._execute("SELECT MIN(available_at) FROM jobs WHERE status = 'queued'")
+        if not rows or rows[0][0] is None:
+            return None
+        return max(0.0, rows[0][0] - time.time())
+
+    def _finish(self, job_id: str, status: str, result: Optional[Dict] = None, error: Optional[Dict] = None) -> None:
+        self._execute(
+            "UPDATE jobs SET status = ?, finished_at = ?, result = ?, error = ?, payload = NULL WHERE id = ?",
+            (status, time.time(), json.dumps(result) if result is not None else None,
+             json.dumps(error) if error is not None else None, job_id),
+        )
+
+    def _retry(self, job_id: str, delay: float, error: Dict) -> None:
+        self._execute(
+            "UPDATE jobs SET status = 'queued', available_at = ?, error = ? WHERE id = ?",
+            (time.time() + delay, json.dumps(error), job_id),
+        )
+
+    def _requeue(self, job_id: str) -> None:
+        """Put back a job interrupted by shutdown without counting the attempt"""
+        self._execute(
+            "UPDATE jobs SET status = 'queued', attempts = attempts - 1 WHERE id = ? AND status = 'running'",
+            (job_id,),
+        )
+
+    def _purge(self) -> int:
+        """Delete finished jobs older than result_ttl_seconds"""
+        rows = self._execute(
+            "DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ? RETURNING id",
+            (time.time() - self.result_ttl_seconds,),
+        )
+        if rows:
+            logger.info(f"Purged {len(rows)} finished jobs")
+        return len(rows)
+
+    def _backoff(self, attempts: int) -> float:
+        delay = min(self.backoff_max_seconds, self.backoff_seconds * 2 ** (attempts - 1))
+        # Jitter keeps jobs that failed together from retrying together
+        return delay * random.uniform(0.5, 1.0)
+
+    async def _work(self) -> None:
+        while True:
+            self._wakeup.clear()
+            try:
+                job = await asyncio.to_thread(self._claim)
+            except sqlite3.Error as exc:
+                logger.error(f"Failed to claim a job: {exc}")
+                job = None
+            if job is None:
+                try:
+                    due_in = await asyncio.to_thread(self._next_due_in)
+                except sqlite3.Error as exc:
+                    logger.error(f"Failed to read the next due job: {exc}")
+                    due_in = None
+                timeout = self.poll_interval if due_in is None else min(self.poll_interval, due_in)
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self._run(job)
+            except sqlite3.Error as exc:
+                logger.error(f"Failed to record the outcome of job {job['id']} ({job['kind']}): {exc}")
+                await self._release(job)
+
+    async def _run(self, job: Dict[str, Any]) -> None:
+        kind = job['kind']
+        job_wait.observe(job['waited'], kind=kind)
+        self._wait_ms.append(job['waited'] * 1000)
+        handler = self._handlers.get(kind)
+        try:
+            if handler is None:
+                raise JobFailed(500, f"Unknown job kind {kind}", retryable=False)
+            with track_stage(f"job.{kind}"):
+                result = await handler(job['params'], job['payload'])
+        except asyncio.CancelledError:
+            try:
+                # Shielded so the requeue still lands if the worker is cancelled again meanwhile
+                await asyncio.shield(asyncio.to_thread(self._requeue, job['id']))
+            except sqlite3.Error as exc:
+                logger.error(f"Failed to requeue job {job['id']}: {exc}")
+            raise
+        except JobFailed as exc:
+            await self._failed(job, {'status_code': exc.status_code, 'detail': exc.detail}, exc.retryable)
+            return
+        except Exception as exc:
+            logger.error(f"Job {job['id']} ({kind}) failed: {type(exc).__name__}: {exc}")
+            await self._failed(job, {'status_code': 500, 'detail': "Job failed."}, True)
+            return
+
+        await asyncio.to_thread(self._finish, job['id'], 'succeeded', result=result)
+        self.succeeded += 1
+        jobs_total.inc(kind=kind, outcome="succeeded")
+        self._notify(job)
+
+    async def _release(self, job: Dict[str, Any]) -> None:
+        """Queue a job again after its outcome could not be stored, so it does not stay running"""
+        error = {'status_code': 500, 'detail': "Failed to store the job outcome."}
+        try:
+            await asyncio.to_thread(self._retry, job['id'], self._backoff(job['attempts']), error)
+        except sqlite3.Error as exc:
+            # Left running in storage; start() queues it again after a restart
+            logger.error(f"Failed to requeue job {job['id']}: {exc}")
+
+    async def _failed(self, job: Dict[str, Any], error: Dict[str, Any], retryable: bool) -> None:
+        kind = job['kind']
+        if retryable and job['attempts'] < job['maxAttempts']:
+            delay = self._backoff(job['attempts'])
+            await asyncio.to_thread(self._retry, job['id'], delay, error)
+            self.retried += 1
+            jobs_total.inc(kind=kind, outcome="retried")
+            logger.warning(f"Job {job['id']} attempt {job['attempts']} failed ({error['detail']}), retrying in {delay:.1f}s")
+            return
+        await asyncio.to_thread(self._finish, job['id'], 'failed', error=error)
+        self.failed += 1
+        jobs_total.inc(kind=kind, outcome="failed")
+        self._notify(job)
+
+    async def check_callback_url(self, url: str) -> Optional[str]:
+        """
+        Accept http(s) URLs on an allowed host. Without an allowlist the host
+        must resolve to public addresses only, so callbacks cannot reach
+        loopback, link-local (cloud metadata) or private network services.
+
+        Returns:
+            The vetted address to connect to, or None for an allowlisted host.
+
+        Raises:
+            CallbackRejected: if the URL may not be called.
+        """
+        parsed = urlparse(url)
+        if parsed.scheme not in ("http", "https") or not parsed.hostname:
+            raise CallbackRejected("callback_url must be an http(s) URL.")
+        if self.callback_allowed_hosts:
+            if parsed.hostname not in self.callback_allowed_hosts:
+                raise CallbackRejected("callback_url host is not allowed.")
+            return None
+        try:
+            port = parsed.port or (443 if parsed.scheme == "https" else 80)
+            infos = await asyncio.get_running_loop().getaddrinfo(parsed.hostname, port)
+        except (OSError, ValueError) as exc:
+            raise CallbackRejected("callback_url host could not be resolved.") from exc
+        if not infos or not all(_is_public_address(info[4][0]) for info in infos):
+            raise CallbackRejected("callback_url must point at a public address.")
+        return infos[0][4][0].split("%", 1)[0]
+
+    def _notify(self, job: Dict[str, Any]) -> None:
+        if not job['callbackUrl']:
+            return
+        task = asyncio.create_task(self._post_callback(job['id'], job['callbackUrl']))
+        self._callbacks.add(task)
+        task.add_done_callback(self._callbacks.discard)
+
+    async def _post_callback(self, job_id: str, url: str, attempts: int = 3) -> None:
+        """POST the finished job to its callback URL, retrying connection errors and 5xx responses"""
+        try:
+            # Checked again in case the host now resolves somewhere else
+            address = await self.check_callback_url(url)
+        except CallbackRejected as exc:
+            self.callbacks_failed += 1
+            logger.warning(f"Callback for job {job_id} to {url} rejected: {exc}")
+            return
+        target, headers, extensions = httpx.URL(url), {}, {}
+        if address is not None:
+            # Connect to the vetted address, so a host re-resolving elsewhere
+            # (DNS rebinding) cannot redirect the POST to an internal service
+            headers["Host"] = target.netloc.decode("ascii")
+            if target.scheme == "https":
+                extensions["sni_hostname"] = target.host
+            target = target.copy_with(host=address)
+        body = {"job": await asyncio.to_thread(self.get, job_id)}
+        async with httpx.AsyncClient(timeout=self.callback_timeout) as client:
+            for attempt in range(1, attempts + 1):
+                try:
+                    response = await client.post(target, json=body, headers=headers, extensions=extensions)
+                    if response.status_code < 500:
+                        return
+                    reason = f"HTTP {response.status_code}"
+                except httpx.HTTPError as exc:
+                    reason = f"{type(exc).__name__}: {exc}"
+                if attempt < attempts:
+                    await asyncio.sleep(self._backoff(attempt))
+        self.callbacks_failed += 1
+        logger.warning(f"Callback for job {job_id} to {url} failed: {reason}")
+
+    async def _purge_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(min(self.result_ttl_seconds, 3600))
+            try:
+                await asyncio.to_thread(self._purge)
+            except sqlite3.Error as exc:
+                logger.error(f"Failed to purge finished jobs: {exc}")
+
+    def depth(self) -> Dict[str, int]:
+        """Jobs per status"""
+        counts = {'queued': 0, 'running': 0, 'succeeded': 0, 'failed': 0}
+        for status, count in self._execute("SELECT status, COUNT(*) FROM jobs GROUP BY status"):
+            counts[status] = count
+        return counts
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth, outcome counters and recent queue wait in milliseconds"""
+        counts = self.depth()
+        wait_ms = sorted(self._wait_ms)
+
+        def percentile(pct: float) -> float:
+            if not wait_ms:
+                return 0.0
+            return round(wait_ms[min(len(wait_ms) - 1, int(round(pct / 100 * (len(wait_ms) - 1))))], 3)
+
+        return {
+            'workers': self.workers,
+            'started': self.started,
+            'queueDepth': counts['queued'],
+            'inFlight': counts['running'],
+            'maxDepth': self.max_depth,
+            'succeeded': self.succeeded,
+            'failed': self.failed,
+            'retried': self.retried,
+            'rejected': self.rejected,
+            'callbacksFailed': self.callbacks_failed,
+            'waitMsP50': percentile(50),
+            'waitMsP95': percentile(95),
+        }
+
+
+job_queue = JobQueue(
+    db_path=settings.job_queue_db_file,
+    workers=settings.job_workers,
+    max_depth=settings.job_queue_max_depth,
+    max_attempts=settings.job_max_attempts,
+    backoff_seconds=settings.job_retry_backoff_seconds,
+    backoff_max_seconds=settings.job_retry_backoff_max_seconds,
+    result_ttl_seconds=settings.job_result_ttl_seconds,
+    callback_timeout=settings.job_callback_timeout_seconds,
+    callback_allowed_hosts=settings.job_callback_allowed_hosts,
+)
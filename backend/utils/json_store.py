@@ -0,0 +1,271 @@
+"""
+JSON file storage engine for users and scans
+
+Writes go to a temporary file that replaces the store in one step, so readers
+never see a half-written file, and read-modify-write updates hold a lock so
+concurrent storage workers don't lose each other's changes.
+"""
+import json
+import os
+import tempfile
+import threading
+from typing import Dict, Iterator, List, Optional, Any, Tuple
+from pathlib import Path
+from config import settings
+from utils.pagination import encode_cursor, decode_cursor
+from utils.timestamps import date_range_bounds, parse_timestamp, sortable_timestamp
+
+# Ensure data directory exists
+DATA_DIR = Path(settings.data_dir)
+DATA_DIR.mkdir(exist_ok=True)
+
+USERS_FILE = DATA_DIR / "users.json"
+SCANS_FILE = DATA_DIR / "scans.json"
+
+# Serializes read-modify-write updates of the JSON files
+_write_lock = threading.Lock()
+
+
+def read_json_file(file_path: Path, default: Any = None) -> Any:
+    """Read JSON file, return default if file doesn't exist"""
+    if not file_path.exists():
+        return default if default is not None else {}
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (json.JSONDecodeError, IOError) as e:
+        print(f"Error reading {file_path}: {e}")
+        return default if default is not None else {}
+
+
+def write_json_file(file_path: Path, data: Any) -> bool:
+    """Write data to JSON file through a temporary file, replacing it atomically"""
+    fd, tmp_path = tempfile.mkstemp(dir=file_path.parent, prefix=f".{file_path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
+        return True
+    except IOError as e:
+        print(f"Error writing {file_path}: {e}")
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        return False
+
+
+# User operations
+def get_user(user_id: str) -> Optional[Dict]:
+    """Get user by ID"""
+    users = read_json_file(USERS_FILE, {})
+    return users.get(user_id)
+
+
+def create_or_update_user(user_data: Dict) -> Dict:
+    """Create or update user"""
+    with _write_lock:
+        users = read_json_file(USERS_FILE, {})
+        user_id = user_data.get('id')
+        if not user_id:
+            raise ValueError("User ID is required")
+
+        existing_user = users.get(user_id, {})
+
+        # Preserve existing preferences if not provided in update
+        user = {
+            **existing_user,
+            **user_data,
+            'id': user_id,
+            'createdAt': existing_user.get('createdAt') or user_data.get('createdAt'),
+            'scans': existing_user.get('scans', []),
+            # Preserve existing preferences if new ones aren't provided
+            'allergies': user_data.get('allergies') if 'allergies' in user_data else existing_user.get('allergies'),
+            'dietGoals': user_data.get('dietGoals') if 'dietGoals' in user_data else existing_user.get('dietGoals'),
+            'avoidIngredients': user_data.get('avoidIngredients') if 'avoidIngredients' in user_data else existing_user.get('avoidIngredients'),
+        }
+        users[user_id] = user
+        write_json_file(USERS_FILE, users)
+        return user
+
+
+def update_user_preferences(user_id: str, preferences: Dict) -> Optional[Dict]:
+    """Update user preferences"""
+    with _write_lock:
+        users = read_json_file(USERS_FILE, {})
+        user = users.get(user_id)
+        if not user:
+            return None
+
+        # Update preferences - handle both None and empty list cases
+        if 'allergies' in preferences:
+            user['allergies'] = preferences['allergies'] if preferences['allergies'] else []
+        if 'dietGoals' in preferences:
+            user['dietGoals'] = preferences['dietGoals'] if preferences['dietGoals'] else []
+        if 'avoidIngredients' in preferences:
+            user['avoidIngredients'] = preferences['avoidIngredients'] if preferences['avoidIngredients'] else []
+
+        users[user_id] = user
+        write_json_file(USERS_FILE, users)
+        return user
+
+
+# Scan operations
+def get_user_scans(user_id: str, limit: Optional[int] = None) -> List[Dict]:
+    """Get scans for a user"""
+    scans = read_json_file(SCANS_FILE, {})
+    user_scans = scans.get(user_id, [])
+    if limit:
+        return user_scans[:limit]
+    return user_scans
+
+
+def get_user_scans_page(
+    user_id: str,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    before: Optional[str] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    is_safe: Optional[bool] = None,
+    min_score: Optional[float] = None,
+    max_score: Optional[float] = None,
+) -> Dict:
+    """
+    Get one page of a user's scans, filtering the stored list in memory. The
+    cursor holds the (timestamp, id) of the last scan returned, so scans added
+    between page fetches don't shift the next page.
+    """
+    user_scans = get_user_scans(user_id)
+
+    position = 0
+    if cursor:
+        values = decode_cursor(cursor)
+        if len(values) != 2 or not all(isinstance(value, str) for value in values):
+            raise ValueError("Invalid cursor")
+        bound, scan_id = values
+        ids = [scan.get('id') for scan in user_scans]
+        if scan_id in ids:
+            position = ids.index(scan_id) + 1
+        else:
+            position = next(
+                (i for i, scan in enumerate(user_scans) if sortable_timestamp(scan.get('timestamp')) < bound),
+                len(user_scans),
+            )
+    elif before:
+        if parse_timestamp(before):
+            bound = sortable_timestamp(before)
+            position = next(
+                (i for i, scan in enumerate(user_scans) if sortable_timestamp(scan.get('timestamp')) < bound),
+                len(user_scans),
+            )
+        else:
+            ids = [scan.get('id') for scan in user_scans]
+            if before not in ids:
+                raise ValueError(f"Unknown scan id: {before}")
+            position = ids.index(before) + 1
+
+    start, end = date_range_bounds(start_date, end_date)
+    page = []
+    next_cursor = None
+    for index in range(position, len(user_scans)):
+        scan = user_scans[index]
+        timestamp = sortable_timestamp(scan.get('timestamp'))
+        if start and timestamp < start:
+            continue
+        if end and (not timestamp or timestamp >= end):
+            continue
+        if is_safe is not None and bool(scan.get('isSafe', False)) != is_safe:
+            continue
+        score = scan.get('safetyScore')
+        if min_score is not None and (score is None or score < min_score):
+            continue
+        if max_score is not None and (score is None or score > max_score):
+            continue
+        if limit and len(page) == limit:
+            last = page[-1]
+            next_cursor = encode_cursor([sortable_timestamp(last.get('timestamp')), last.get('id') or ''])
+            break
+        page.append(scan)
+
+    return {
+        'scans': page,
+        'nextCursor': next_cursor,
+    }
+
+
+def add_user_scan(user_id: str, scan_data: Dict) -> Dict:
+    """Add a scan for a user"""
+    from datetime import datetime
+    
+    with _write_lock:
+        scans = read_json_file(SCANS_FILE, {})
+        if user_id not in scans:
+            scans[user_id] = []
+
+        # Add scan to beginning (most recent first)
+        scan = {
+            **scan_data,
+            'id': scan_data.get('id') or f"scan_{user_id}_{len(scans[user_id])}",
+            'timestamp': scan_data.get('timestamp') or datetime.utcnow().isoformat() + 'Z',
+        }
+        scans[user_id].insert(0, scan)
+
+        write_json_file(SCANS_FILE, scans)
+        return scan
+
+
+def iter_scan_products() -> Iterator[Tuple[str, str]]:
+    """Yield (productName, timestamp) of every scan"""
+    scans = read_json_file(SCANS_FILE, {})
+    for user_scans in scans.values():
+        for scan in user_scans:
+            yield scan.get('productName'), sortable_timestamp(scan.get('timestamp'))
+
+
+def get_user_stats(user_id: str) -> Optional[Dict]:
+    """Get statistics for a user"""
+    user_scans = get_user_scans(user_id)
+    if not user_scans:
+        return {
+            'totalScans': 0,
+            'todayScans': 0,
+            'safeToday': 0,
+            'riskyToday': 0,
+            'averageScore': 0,
+        }
+    
+    from datetime import datetime
+    
+    now = datetime.utcnow()
+    today_start = datetime(now.year, now.month, now.day)
+    
+    today_scans = []
+    for scan in user_scans:
+        try:
+            # Handle both ISO format with and without Z
+            timestamp_str = scan['timestamp'].replace('Z', '')
+            if '+' in timestamp_str:
+                timestamp_str = timestamp_str.split('+')[0]
+            scan_date = datetime.fromisoformat(timestamp_str)
+            if scan_date >= today_start:
+                today_scans.append(scan)
+        except (ValueError, KeyError):
+            continue
+    
+    safe_today = sum(1 for scan in today_scans if scan.get('isSafe', False))
+    risky_today = len(today_scans) - safe_today
+    
+    total_score = sum(scan.get('safetyScore', 0) for scan in user_scans)
+    avg_score = int(total_score / len(user_scans)) if user_scans else 0
+    
+    return {
+        'totalScans': len(user_scans),
+        'todayScans': len(today_scans),
+        'safeToday': safe_today,
+        'riskyToday': risky_today,
+        'averageScore': avg_score,
+    }
+
@@ -0,0 +1,308 @@
+"""
+Per-stage latency, token usage and cost instrumentation with Prometheus
+text exposition
+
+Stages (Gemini extraction, each agent run, each storage call) are timed
+with track_stage(), which feeds a latency histogram, an error counter and,
+while a request is being served, the request's Server-Timing header.
+"""
+import asyncio
+import bisect
+import logging
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds, from a storage read to a slow agent run with web search
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80)
+
+# Estimated USD per million (input, output) tokens, used for the cost counter
+MODEL_PRICES: Dict[str, Tuple[float, float]] = {
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-5-mini": (0.25, 2.00),
+    "gemini-2.0-flash-exp": (0.10, 0.40),
+}
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter per label combination"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label combination"""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # label values -> [per-bucket counts (+Inf last), sum, count]
+        self._series: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(labels[name] for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, (list(series[0]), series[1], series[2])) for key, series in self._series.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(float(bound)) if bound != float("inf") else "+Inf"}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+# A collector returns (name, type, help, [(labels, value)]) families read at scrape time
+Collector = Callable[[], Iterable[Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]]]
+
+
+class MetricsRegistry:
+    """Owns the process-wide metrics and renders them in Prometheus text format"""
+
+    def __init__(self):
+        self._metrics: List[Any] = []
+        self._collectors: List[Collector] = []
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Collector) -> None:
+        """Register a callback exporting values owned elsewhere (cache counters, queue depth)"""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            try:
+                families = list(collector())
+            except Exception as exc:
+                logger.warning(f"Metrics collector {getattr(collector, '__name__', collector)} failed: {exc}")
+                continue
+            for name, metric_type, documentation, samples in families:
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(list(labels), list(labels.values()))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+stage_duration = registry.histogram(
+    "safebites_stage_duration_seconds", "Latency of pipeline stages", ("stage",)
+)
+stage_errors = registry.counter(
+    "safebites_stage_errors_total", "Pipeline stage failures by exception type", ("stage", "error")
+)
+llm_tokens = registry.counter(
+    "safebites_llm_tokens_total", "Tokens used by model calls", ("model", "direction")
+)
+llm_cost = registry.counter(
+    "safebites_llm_cost_usd_total", "Estimated model spend in USD", ("model",)
+)
+http_duration = registry.histogram(
+    "safebites_http_request_duration_seconds", "Latency of HTTP requests", ("method", "route", "status")
+)
+
+# Stage milliseconds of the request being served, shared with the tasks it spawns
+_request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+
+
+class track_stage:
+    """
+    Context manager timing one pipeline stage, e.g.
+
+        with track_stage("gemini.extract_product_name"):
+            ...
+
+    Records the latency histogram, counts exceptions by type and adds the
+    stage to the current request's Server-Timing header.
+    """
+
+    __slots__ = ("stage", "_started")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self) -> "track_stage":
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        elapsed = time.perf_counter() - self._started
+        stage_duration.observe(elapsed, stage=self.stage)
+        # Cancellation (a hedge loser, a client gone away) is not a stage failure
+        if exc_type is not None and not issubclass(exc_type, asyncio.CancelledError):
+            stage_errors.inc(stage=self.stage, error=exc_type.__name__)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings[self.stage] = timings.get(self.stage, 0.0) + elapsed * 1000
+
+
+def record_usage(model: str, input_tokens: Optional[int], output_tokens: Optional[int]) -> None:
+    """Count tokens for a model call and add its estimated cost"""
+    input_tokens = input_tokens or 0
+    output_tokens = output_tokens or 0
+    if input_tokens:
+        llm_tokens.inc(input_tokens, model=model, direction="input")
+    if output_tokens:
+        llm_tokens.inc(output_tokens, model=model, direction="output")
+    prices = MODEL_PRICES.get(model)
+    if prices and (input_tokens or output_tokens):
+        llm_cost.inc((input_tokens * prices[0] + output_tokens * prices[1]) / 1_000_000, model=model)
+
+
+def cache_families(caches: Dict[str, Optional[Dict[str, Any]]]):
+    """
+    Hit, miss and hit-rate families from stats() dicts keyed by cache name.
+    Exact and perceptual hits of the image cache are summed.
+    """
+    hits, misses, ratios = [], [], []
+    for name, stats in caches.items():
+        if not stats or "misses" not in stats:
+            continue
+        cache_hits = stats.get("hits", stats.get("exactHits", 0) + stats.get("perceptualHits", 0))
+        hits.append(({"cache": name}, cache_hits))
+        misses.append(({"cache": name}, stats["misses"]))
+        ratios.append(({"cache": name}, stats.get("hitRate", 0.0)))
+    return [
+        ("safebites_cache_hits_total", "counter", "Cache hits", hits),
+        ("safebites_cache_misses_total", "counter", "Cache misses", misses),
+        ("safebites_cache_hit_ratio", "gauge", "Cache hit rate since start", ratios),
+    ]
+
+
+def _server_timing(timings: Dict[str, float], total_ms: float) -> bytes:
+    parts = [f"{stage};dur={ms:.1f}" for stage, ms in timings.items()]
+    parts.append(f"total;dur={total_ms:.1f}")
+    return ", ".join(parts).encode("latin-1")
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware timing every HTTP request by route template. With
+    timing_headers it also returns the stages timed so far as a
+    Server-Timing header (streamed responses only include the stages
+    finished before the first byte).
+    """
+
+    def __init__(self, app, timing_headers: bool = False):
+        self.app = app
+        self.timing_headers = timing_headers
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        timings: Dict[str, float] = {}
+        token = _request_timings.set(timings)
+        status_code = 500
+
+        async def timed_send(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if self.timing_headers:
+                    total_ms = (time.perf_counter() - started) * 1000
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", _server_timing(timings, total_ms)))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            _request_timings.reset(token)
+            route = scope.get("route")
+            http_duration.observe(
+                time.perf_counter() - started,
+                method=scope["method"],
+                route=getattr(route, "path", "unmatched"),
+                status=str(status_code),
+            )
+
+
+def render() -> str:
+    """All metrics in Prometheus text exposition format"""
+    return registry.render()
@@ -0,0 +1,339 @@
+"""
+Offline product catalog imported from OpenFoodFacts-style dumps
+
+Maps barcodes and normalized product names ("name" and "brand name", plus
+their canonical forms without sizes or noise words) to ingredient lists, so mainstream products can skip the web search agent.
+A name key shared by different products is ambiguous and never resolves.
+
+Usage:
+    python -m utils.product_catalog import <dump.jsonl|dump.csv>[.gz] [--batch-size 5000]
+    python -m utils.product_catalog lookup <product name or barcode>
+    python -m utils.product_catalog stats
+"""
+import csv
+import gzip
+import io
+import json
+import logging
+import re
+import sqlite3
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from config import settings
+from utils.cache import normalize_key
+from utils.product_names import canonicalize_product_name
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    barcode TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    brand TEXT NOT NULL,
+    ingredients TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS name_keys (
+    key TEXT NOT NULL,
+    barcode TEXT NOT NULL,
+    PRIMARY KEY (key, barcode)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS name_keys_barcode ON name_keys (barcode);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+_BARCODE_RE = re.compile(r"^\d{8,14}$")
+# Splits "a, b (c, d), e" on top-level commas and semicolons only
+_TOP_LEVEL_SPLIT_RE = re.compile(r"[,;](?![^()\[\]]*[)\]])")
+_SUB_INGREDIENTS_RE = re.compile(r"^(.*?)\s*[(\[](.*)[)\]]\s*$")
+_PERCENT_RE = re.compile(r"\s*\d+(?:[.,]\d+)?\s*%")
+_CONTAINS_RE = re.compile(r"^contains\b[:\s]*", re.IGNORECASE)
+
+# stats() re-reads the product count at most this often
+STATS_TTL_SECONDS = 30.0
+
+LABEL_DESCRIPTION = "Listed on the product label."
+
+
+def parse_ingredients_text(text: str) -> List[Dict[str, str]]:
+    """
+    Split a label's ingredient text into IngredientSchema-shaped dicts.
+    Sub-ingredients in parentheses become the description.
+    """
+    ingredients = []
+    seen = set()
+    # OpenFoodFacts marks allergens as _milk_ and ends lists with "."
+    text = _PERCENT_RE.sub("", (text or "").replace("_", ""))
+    for part in _TOP_LEVEL_SPLIT_RE.split(text):
+        part = part.strip(" \t\r\n*.")
+        if not part:
+            continue
+        name, description = part, LABEL_DESCRIPTION
+        if "(" in part or "[" in part:
+            match = _SUB_INGREDIENTS_RE.match(part)
+            if match and match.group(1):
+                name = match.group(1).strip()
+                # "flavoring (contains milk)" -> "Contains milk."
+                description = f"Contains {_CONTAINS_RE.sub('', match.group(2).strip())}."
+        # "emulsifier: lecithins" -> "lecithins", used as an emulsifier
+        role, sep, rest = name.partition(":")
+        if sep and rest.strip():
+            name = rest.strip()
+            if description == LABEL_DESCRIPTION:
+                description = f"Used as {role.strip().lower()}."
+        key = name.lower()
+        if key not in seen:
+            seen.add(key)
+            ingredients.append({"name": name, "description": description})
+    return ingredients
+
+
+def _first_brand(brands: str) -> str:
+    return (brands or "").split(",")[0].strip()
+
+
+def _normalize_record(record: Dict[str, Any]) -> Optional[Tuple[str, str, str, List[Dict[str, str]]]]:
+    """(barcode, name, brand, ingredients) for a dump record, or None if unusable"""
+    barcode = str(record.get("code") or "").strip()
+    name = (record.get("product_name") or record.get("product_name_en") or "").strip()
+    text = record.get("ingredients_text") or record.get("ingredients_text_en") or ""
+    if not barcode or not name or not text:
+        return None
+    ingredients = parse_ingredients_text(text)
+    if not ingredients:
+        return None
+    return barcode, name, _first_brand(record.get("brands") or ""), ingredients
+
+
+def _open_text(path: Path) -> io.TextIOBase:
+    if path.suffix == ".gz":
+        return gzip.open(path, "rt", encoding="utf-8", errors="replace", newline="")
+    return open(path, "r", encoding="utf-8", errors="replace", newline="")
+
+
+def iter_dump(path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Stream records from an OpenFoodFacts JSONL or CSV/TSV dump (optionally
+    gzipped) one at a time, so memory stays flat regardless of dump size.
+    """
+    path = Path(path)
+    suffixes = [s for s in path.suffixes if s != ".gz"]
+    is_jsonl = bool(suffixes) and suffixes[-1] in (".jsonl", ".json", ".ndjson")
+    with _open_text(path) as f:
+        if is_jsonl:
+            for line_no, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f"{path}:{line_no}: skipping malformed JSON line")
+            return
+
+        # The official CSV export is tab-separated
+        header = f.readline()
+        delimiter = "\t" if header.count("\t") > header.count(",") else ","
+        csv.field_size_limit(sys.maxsize)
+        reader = csv.DictReader(f, fieldnames=next(csv.reader([header], delimiter=delimiter)), delimiter=delimiter)
+        yield from reader
+
+
+class ProductCatalog:
+    """
+    Read-mostly SQLite index of products. Lookups try the barcode, then the
+    normalized "brand name" and "name" keys, then their canonical forms,
+    skipping keys that more than one product is known by.
+    """
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = Path(db_path or settings.catalog_db_file)
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self.hits = 0
+        self.misses = 0
+        self._products: Optional[Tuple[float, int]] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            with self._lock:
+                if self._conn is None:
+                    self.db_path.parent.mkdir(parents=True, exist_ok=True)
+                    conn = sqlite3.connect(str(self.db_path), check_same_thread=False, isolation_level=None)
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.execute("PRAGMA synchronous=NORMAL")
+                    conn.execute("PRAGMA busy_timeout=5000")
+                    conn.executescript(SCHEMA)
+                    self._migrate_keys(conn)
+                    self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def _migrate_keys(conn: sqlite3.Connection) -> None:
+        """Carry over the one-product-per-key table of catalogs imported before name_keys"""
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'product_keys'").fetchone():
+            conn.executescript(
+                "BEGIN IMMEDIATE;"
+                "INSERT OR IGNORE INTO name_keys (key, barcode) SELECT key, barcode FROM product_keys;"
+                "DROP TABLE product_keys;"
+                "COMMIT;"
+            )
+
+    @staticmethod
+    def _keys(name: str, brand: str) -> List[str]:
+        keys = []
+        brand_key = normalize_key(brand) if brand else ""
+        for name_key in dict.fromkeys((normalize_key(name), canonicalize_product_name(name))):
+            keys.append(name_key)
+            if brand_key and not name_key.startswith(brand_key):
+                keys.append(f"{brand_key} {name_key}")
+        return [key for key in keys if key]
+
+    def lookup(self, product: str) -> Optional[Dict[str, Any]]:
+        """
+        Find a product by barcode or name.
+
+        Returns:
+            {"barcode", "name", "brand", "ingredients": [{"name", "description"}]} or None.
+        """
+        conn = self._connect()
+        query = product.strip()
+        with self._lock:
+            if _BARCODE_RE.match(query):
+                row = conn.execute(
+                    "SELECT barcode, name, brand, ingredients FROM products WHERE barcode = ?", (query,)
+                ).fetchone()
+            else:
+                row = None
+                for key in dict.fromkeys((normalize_key(query), canonicalize_product_name(query))):
+                    rows = conn.execute(
+                        "SELECT p.barcode, p.name, p.brand, p.ingredients FROM name_keys k "
+                        "JOIN products p ON p.barcode = k.barcode WHERE k.key = ? LIMIT 2",
+                        (key,),
+                    ).fetchall()
+                    # Two products under one key ("original", "classic") is a guess, not a match
+                    if len(rows) == 1:
+                        row = rows[0]
+                        break
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        barcode, name, brand, ingredients = row
+        return {"barcode": barcode, "name": name, "brand": brand, "ingredients": json.loads(ingredients)}
+
+    def import_dump(self, path: str, batch_size: int = 5000) -> Dict[str, Any]:
+        """
+        Stream a dump into the catalog in batches of batch_size rows, one
+        transaction per batch. Re-importing a barcode replaces it and its name
+        keys, so keys of a product's previous name stop resolving to it.
+
+        Returns:
+            {"read", "imported", "skipped", "seconds", "rowsPerSecond"}
+        """
+        conn = self._connect()
+        started = time.perf_counter()
+        read = imported = 0
+        # Keyed by barcode, so a barcode repeated within a batch keeps only its last record
+        products: Dict[str, tuple] = {}
+        keys: Dict[str, List[str]] = {}
+
+        def flush() -> None:
+            with self._lock:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO products (barcode, name, brand, ingredients) VALUES (?, ?, ?, ?)",
+                        products.values(),
+                    )
+                    conn.executemany("DELETE FROM name_keys WHERE barcode = ?", ((barcode,) for barcode in keys))
+                    conn.executemany(
+                        "INSERT OR IGNORE INTO name_keys (key, barcode) VALUES (?, ?)",
+                        ((key, barcode) for barcode, barcode_keys in keys.items() for key in barcode_keys),
+                    )
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+                conn.execute("COMMIT")
+            products.clear()
+            keys.clear()
+
+        for record in iter_dump(path):
+            read += 1
+            normalized = _normalize_record(record)
+            if normalized is None:
+                continue
+            barcode, name, brand, ingredients = normalized
+            products[barcode] = (barcode, name, brand, json.dumps(ingredients, ensure_ascii=False, separators=(",", ":")))
+            keys[barcode] = self._keys(name, brand)
+            imported += 1
+            if len(products) >= batch_size:
+                flush()
+                if imported % (batch_size * 20) == 0:
+                    logger.info(f"Imported {imported} products ({read} records read)")
+        if products:
+            flush()
+        with self._lock:
+            self._products = (time.monotonic(), self._store_product_count_locked(conn))
+
+        seconds = time.perf_counter() - started
+        summary = {
+            "read": read,
+            "imported": imported,
+            "skipped": read - imported,
+            "seconds": round(seconds, 3),
+            "rowsPerSecond": round(read / seconds) if seconds else 0,
+        }
+        logger.info(f"Catalog import of {path} finished: {summary}")
+        return summary
+
+    @staticmethod
+    def _store_product_count_locked(conn: sqlite3.Connection) -> int:
+        """Count the products once and keep the count in meta, so stats() never scans the table"""
+        products = conn.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('products', ?)", (str(products),))
+        return products
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Catalog size (as of the last import, re-read every STATS_TTL_SECONDS
+        so imports by other processes show up) and lookup counters
+        """
+        conn = self._connect()
+        with self._lock:
+            now = time.monotonic()
+            if self._products is None or now - self._products[0] > STATS_TTL_SECONDS:
+                row = conn.execute("SELECT value FROM meta WHERE key = 'products'").fetchone()
+                # Catalogs imported before the count was kept are counted once
+                count = int(row[0]) if row is not None else self._store_product_count_locked(conn)
+                self._products = (now, count)
+            products = self._products[1]
+            total = self.hits + self.misses
+            return {
+                'products': products,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hitRate': round(self.hits / total, 3) if total else 0.0,
+            }
+
+
+product_catalog = ProductCatalog()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    if command == "import" and len(sys.argv) > 2:
+        batch_size = int(sys.argv[sys.argv.index("--batch-size") + 1]) if "--batch-size" in sys.argv else 5000
+        print(json.dumps(product_catalog.import_dump(sys.argv[2], batch_size=batch_size), indent=2))
+    elif command == "lookup" and len(sys.argv) > 2:
+        print(json.dumps(product_catalog.lookup(" ".join(sys.argv[2:])), indent=2, ensure_ascii=False))
+    elif command == "stats":
+        print(json.dumps(product_catalog.stats(), indent=2))
+    else:
+        print(__doc__)
+        sys.exit(1)
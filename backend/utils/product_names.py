@@ -0,0 +1,347 @@
+"""
+Product name canonicalization and fuzzy matching
+
+Gemini returns free-form names ("Coca-Cola Classic 12 fl oz", "coca-cola
+original taste"). canonicalize_product_name strips sizes, units and noise
+words, and ProductNameIndex resolves a new name to a previously seen
+canonical product by trigram Jaccard similarity, as long as the two names
+differ only by typos or word splits. A word or number only one of them has
+("Cherry", "Some Pulp" vs "No Pulp", "0%" vs "2%") makes them different
+products.
+"""
+import math
+import re
+import threading
+import time
+from array import array
+from collections import Counter
+from typing import Dict, FrozenSet, List, Optional, Sequence, Tuple
+from utils.cache import normalize_key
+
+_UNITS = (
+    r"fl\.?\s*oz|floz|oz|ounces?|ml|cl|dl|l|lt|ltr|lit(?:re|er)s?|g|gr|grams?|kg|mg|lbs?|pounds?"
+    r"|ct|count|pk|packs?|pcs|pieces?|servings?|cans?|bottles?|bars?|sticks?|bags?"
+)
+# "12 fl oz", "1.5l", "6 x 330ml", "2x250 g", "pack of 6", "12-pack"
+_SIZE_RE = re.compile(
+    r"\b(?:pack|case|box) of \d+\b"
+    rf"|(?:\b\d+(?:[.,]\d+)?\s*[x×]\s*|\b)\d+(?:[.,]\d+)?\s*-?\s*(?:{_UNITS})\b(?!\s+of\s+\d)"
+    r"|\b\d+\s*[x×]\b|\b[x×]\s*\d+\b"
+)
+_PERCENT_RE = re.compile(r"(\d)\s*%")
+
+# Words that describe packaging or marketing rather than which product it is
+NOISE_TOKENS = frozenset({
+    "the", "new", "original", "classic", "taste", "regular", "brand", "product", "edition",
+    "bottle", "bottles", "can", "cans", "jar", "box", "bag", "pack", "packet", "tub", "pouch",
+    "multipack", "family", "size", "value", "net", "wt", "weight", "tm", "r", "flavour", "flavor",
+    "flavored", "flavoured", "drink", "beverage",
+})
+
+
+def canonicalize_product_name(name: str) -> str:
+    """
+    Lowercased product name with sizes, units, punctuation and noise words
+    removed. Percentages are kept as "<n> percent", since "0%" and "2%"
+    yogurt are different products. Falls back to the plain normalized name
+    if nothing would be left.
+    """
+    lowered = name.lower()
+    stripped = _PERCENT_RE.sub(r"\1 percent ", _SIZE_RE.sub(" ", lowered))
+    tokens = [token for token in normalize_key(stripped).split() if token not in NOISE_TOKENS]
+    return " ".join(tokens) or normalize_key(lowered)
+
+
+def trigrams(canonical: str) -> FrozenSet[str]:
+    """Character trigrams of each word, padded so word order doesn't matter"""
+    grams = set()
+    for token in canonical.split():
+        padded = f"  {token} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return frozenset(grams)
+
+
+def jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    if not a or not b:
+        return 0.0
+    shared = len(a & b)
+    return shared / (len(a) + len(b) - shared)
+
+
+_DIGIT_RE = re.compile(r"\d")
+
+
+def _has_digit(token: str) -> bool:
+    return _DIGIT_RE.search(token) is not None
+
+
+def _is_typo(a: str, b: str) -> bool:
+    """True when a and b are within a typo of each other: exact below 4 letters, 1 edit below 8, else 2"""
+    shorter = min(len(a), len(b))
+    limit = 0 if shorter < 4 else 1 if shorter < 8 else 2
+    if abs(len(a) - len(b)) > limit:
+        return False
+    if limit == 0 or a == b:
+        return a == b
+    # Each edit adds or removes at most two distinct letters, a cheap bound before the full distance
+    if len(set(a) ^ set(b)) > 2 * limit:
+        return False
+    # Levenshtein distance, stopping once every cell of a row is past the limit
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, start=1):
+        current = [i]
+        for j, char_b in enumerate(b, start=1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > limit:
+            return False
+        previous = current
+    return previous[-1] <= limit
+
+
+def same_product_tokens(a: Sequence[str], b: Sequence[str]) -> bool:
+    """
+    True when two canonical names differ only by typos or split words: every
+    word only one name has pairs with a near-identical word of the other.
+    Numbers and percentages must match exactly.
+    """
+    a_set, b_set = set(a), set(b)
+    a_only = [token for token in a if token not in b_set]
+    b_only = [token for token in b if token not in a_set]
+    if not a_only and not b_only:
+        return True
+    if not a_only or not b_only:
+        return False
+    if any(map(_has_digit, a_only)) or any(map(_has_digit, b_only)):
+        return False
+    # "cocacola" vs "coca cola"
+    if _is_typo("".join(a_only), "".join(b_only)):
+        return True
+    if len(a_only) != len(b_only):
+        return False
+    remaining = list(b_only)
+    for token in a_only:
+        paired = next((other for other in remaining if _is_typo(token, other)), None)
+        if paired is None:
+            return False
+        remaining.remove(paired)
+    return True
+
+
+class ProductNameIndex:
+    """
+    In-memory token and trigram index over canonical product names.
+
+    A match must have trigram Jaccard similarity >= threshold and pass
+    same_product_tokens. When the query has a number, or a word fewer than
+    token_candidates names share, only the names holding the rarest of them
+    are verified. Numbers must match exactly, so a number nobody has means
+    there is no match at all. Otherwise the trigram postings are searched: a
+    name matching with Jaccard similarity >= threshold must share at least
+    ceil(threshold * |Q|) of the query's |Q| trigrams, so only the postings of
+    the query's |Q| - ceil(threshold * |Q|) + 1 rarest trigrams need scanning
+    (prefix filtering). Further postings are counted while they fit in
+    scan_budget entries; when every posting fits, overlaps are exact and no
+    candidate needs re-verifying; otherwise only the max_verify candidates
+    sharing the most trigrams are verified. Queries made only of very common trigrams
+    would exceed the budget inside the prefix; those scan just the newest
+    entries of each posting, trading recall for bounded latency. Postings
+    are compact integer arrays, so hundreds of thousands of names fit in
+    tens of megabytes.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.75,
+        scan_budget: int = 2000,
+        max_verify: int = 32,
+        token_candidates: int = 256,
+    ):
+        if not 0 < threshold <= 1:
+            raise ValueError("threshold must be in (0, 1]")
+        self.threshold = threshold
+        self.scan_budget = scan_budget
+        self.max_verify = max_verify
+        self.token_candidates = token_candidates
+        self._lock = threading.Lock()
+        self._names: List[str] = []
+        self._sizes = array("H")
+        self._ids: Dict[str, int] = {}
+        self._postings: Dict[str, array] = {}
+        self._token_postings: Dict[str, array] = {}
+        self.exact = 0
+        self.fuzzy = 0
+        self.added = 0
+        self._resolve_ms_total = 0.0
+        self._resolves = 0
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def add(self, canonical: str) -> None:
+        """Index a canonical name (no-op if it is already known)"""
+        with self._lock:
+            self._add_locked(canonical)
+
+    def _add_locked(self, canonical: str) -> None:
+        if not canonical or canonical in self._ids:
+            return
+        entry_id = len(self._names)
+        grams = trigrams(canonical)
+        self._names.append(canonical)
+        self._sizes.append(min(len(grams), 0xFFFF))
+        self._ids[canonical] = entry_id
+        for gram in grams:
+            postings = self._postings.get(gram)
+            if postings is None:
+                postings = self._postings[gram] = array("I")
+            postings.append(entry_id)
+        for token in set(canonical.split()):
+            postings = self._token_postings.get(token)
+            if postings is None:
+                postings = self._token_postings[token] = array("I")
+            postings.append(entry_id)
+
+    def _token_candidates(self, tokens: Sequence[str]) -> Optional[Sequence[int]]:
+        """
+        Ids of the names holding the query's rarest number, or else its rarest
+        word, or None when every word is too common to narrow the search.
+        """
+        numbers = {token for token in tokens if _has_digit(token)}
+        if numbers:
+            postings = [self._token_postings.get(token) for token in numbers]
+            if any(entries is None for entries in postings):
+                return ()
+            rarest = min(postings, key=len)
+            return rarest if len(rarest) <= self.token_candidates else None
+        # A word nobody has is a typo or new; the match must then hold the other words
+        known = [self._token_postings[token] for token in set(tokens) if token in self._token_postings]
+        if not known:
+            return None
+        rarest = min(known, key=len)
+        return rarest if len(rarest) <= self.token_candidates else None
+
+    def _best_match_locked(self, canonical: str) -> Optional[Tuple[str, float]]:
+        query = trigrams(canonical)
+        if not query:
+            return None
+        tokens = canonical.split()
+        candidate_ids = self._token_candidates(tokens)
+        if candidate_ids is not None:
+            return self._verify_locked(query, tokens, candidate_ids)
+        size = len(query)
+        required = math.ceil(self.threshold * size - 1e-9)
+        # Trigrams nobody has count as the rarest ones and are free to probe
+        known = sorted(
+            (gram for gram in query if gram in self._postings),
+            key=lambda gram: len(self._postings[gram]),
+        )
+        prefix = len(known) - required + 1
+        if prefix <= 0:
+            return None
+
+        # Scan postings rarest first within scan_budget entries. Past the
+        # prefix, extra postings only tighten the overlap a candidate needs.
+        counts: Counter = Counter()
+        budget = self.scan_budget
+        probe = 0
+        truncated = False
+        for gram in known:
+            postings = self._postings[gram]
+            if len(postings) > budget:
+                if probe >= prefix:
+                    break
+                # A very common trigram: only the most recently added names are scanned
+                postings = postings[-budget:]
+                truncated = True
+            counts.update(postings)
+            budget -= len(postings)
+            probe += 1
+            if budget <= 0:
+                break
+
+        exact_counts = probe == len(known) and not truncated
+        if probe >= prefix and not truncated:
+            needed = required - (len(known) - probe)
+        else:
+            # Budget ran out inside the prefix, so the match is approximate
+            needed = max(1, math.ceil(self.threshold * probe))
+
+        min_size, max_size = self.threshold * size, size / self.threshold
+        candidates = counts.items() if exact_counts else counts.most_common(self.max_verify)
+        best: Optional[Tuple[str, float]] = None
+        for entry_id, count in candidates:
+            if count < needed:
+                continue
+            entry_size = self._sizes[entry_id]
+            if not min_size <= entry_size <= max_size:
+                continue
+            if exact_counts:
+                score = count / (size + entry_size - count)
+            else:
+                score = jaccard(query, trigrams(self._names[entry_id]))
+            name = self._names[entry_id]
+            if (
+                score >= self.threshold
+                and (best is None or score > best[1])
+                and same_product_tokens(tokens, name.split())
+            ):
+                best = (name, score)
+        return best
+
+    def _verify_locked(
+        self, query: FrozenSet[str], tokens: Sequence[str], candidate_ids: Sequence[int]
+    ) -> Optional[Tuple[str, float]]:
+        """Best of the given names passing the size bound, the token check and the threshold"""
+        size = len(query)
+        min_size, max_size = self.threshold * size, size / self.threshold
+        best: Optional[Tuple[str, float]] = None
+        for entry_id in candidate_ids:
+            if not min_size <= self._sizes[entry_id] <= max_size:
+                continue
+            name = self._names[entry_id]
+            if not same_product_tokens(tokens, name.split()):
+                continue
+            score = jaccard(query, trigrams(name))
+            if score >= self.threshold and (best is None or score > best[1]):
+                best = (name, score)
+        return best
+
+    def resolve(self, name: str, add: bool = True) -> str:
+        """
+        Canonical key for a product name: an already indexed name if one is
+        similar enough, otherwise the name's own canonical form (indexed for
+        future lookups when add is True).
+        """
+        started = time.perf_counter()
+        canonical = canonicalize_product_name(name)
+        with self._lock:
+            if canonical in self._ids:
+                self.exact += 1
+                key = canonical
+            else:
+                match = self._best_match_locked(canonical)
+                if match is not None:
+                    self.fuzzy += 1
+                    key = match[0]
+                else:
+                    key = canonical
+                    if add:
+                        self.added += 1
+                        self._add_locked(canonical)
+            self._resolves += 1
+            self._resolve_ms_total += (time.perf_counter() - started) * 1000
+        return key
+
+    def stats(self) -> Dict[str, object]:
+        """Index size and how names were resolved"""
+        with self._lock:
+            return {
+                'names': len(self._names),
+                'trigrams': len(self._postings),
+                'tokens': len(self._token_postings),
+                'threshold': self.threshold,
+                'exact': self.exact,
+                'fuzzy': self.fuzzy,
+                'added': self.added,
+                'avgResolveMs': round(self._resolve_ms_total / self._resolves, 4) if self._resolves else 0.0,
+            }
@@ -0,0 +1,320 @@
+"""
+Deadlines, hedged calls and circuit breakers for the Gemini and OpenAI upstreams
+
+A request sets a deadline with deadline_scope(); every upstream call made
+while serving it gets at most the time that is left. ResilientUpstream runs
+one pipeline stage: when an attempt runs past the stage's recent p95 it
+sends a hedged duplicate (optionally on a faster fallback model) and keeps
+the first answer. A CircuitBreaker per provider fails calls fast after
+repeated failures so callers can serve stale cached results instead.
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterator, Optional, Set
+from utils.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+hedged_calls = registry.counter(
+    "safebites_hedged_calls_total", "Upstream calls that sent a hedged duplicate", ("stage",)
+)
+hedge_wins = registry.counter(
+    "safebites_hedge_wins_total", "Hedged calls answered by the duplicate first", ("stage",)
+)
+circuit_rejections = registry.counter(
+    "safebites_circuit_rejections_total", "Calls failed fast by an open circuit breaker", ("upstream",)
+)
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request's deadline passed before the stage could finish"""
+
+
+class CircuitOpenError(RuntimeError):
+    """The upstream's circuit breaker is open, the call was not attempted"""
+
+    def __init__(self, upstream: str, retry_after: float):
+        super().__init__(f"{upstream} is unavailable, retry in {retry_after:.0f}s")
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+
+# Monotonic time by which the current request must finish
+_deadline: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+
+
+@contextmanager
+def deadline_scope(seconds: Optional[float], inherit: bool = True) -> Iterator[None]:
+    """
+    Give the enclosed work (and tasks it starts) seconds to finish. Nested
+    scopes can only shorten an inherited deadline; inherit=False replaces it,
+    for background work that outlives the request.
+    """
+    deadline = time.monotonic() + seconds if seconds else None
+    current = _deadline.get() if inherit else None
+    if current is not None and (deadline is None or current < deadline):
+        deadline = current
+    token = _deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left before the current deadline, or None without one"""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def stage_timeout(timeout: Optional[float] = None) -> Optional[float]:
+    """
+    Timeout for the next stage: its own timeout capped by the time left.
+
+    Raises:
+        DeadlineExceeded: if the deadline has already passed.
+    """
+    left = remaining()
+    if left is None:
+        return timeout
+    if left <= 0:
+        raise DeadlineExceeded("Request deadline exceeded")
+    return left if timeout is None else min(timeout, left)
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive failures and rejects calls for
+    reset_seconds. Then one probe call is let through (half open): success
+    closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_seconds: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+        self.opens = 0
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_seconds:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> None:
+        """
+        Raises:
+            CircuitOpenError: if the circuit is open, or half open with a probe in flight.
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return
+            waited = time.monotonic() - self._opened_at
+            if waited >= self.reset_seconds and not self._probing:
+                self._probing = True
+                return
+            self.rejected += 1
+        circuit_rejections.inc(upstream=self.name)
+        raise CircuitOpenError(self.name, max(0.0, self.reset_seconds - waited))
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info(f"Circuit for {self.name} closed")
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def release(self) -> None:
+        """End a half-open probe that neither succeeded nor failed (deadline, cancellation)"""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            reopen = self._probing
+            if reopen or (self._opened_at is None and self._failures >= self.failure_threshold):
+                self._opened_at = time.monotonic()
+                self._probing = False
+                self.opens += 1
+                logger.warning(f"Circuit for {self.name} opened after {self._failures} consecutive failures")
+
+    def stats(self) -> Dict[str, Any]:
+        """Circuit state, consecutive failures and rejected calls"""
+        return {
+            'state': self.state,
+            'consecutiveFailures': self._failures,
+            'opens': self.opens,
+            'rejected': self.rejected,
+        }
+
+
+# Attempt factory: receives True for the hedged duplicate
+Attempt = Callable[[bool], Awaitable[Any]]
+# Returns the semaphore bounding in-flight calls to the provider
+Slots = Callable[[], asyncio.Semaphore]
+
+
+class ResilientUpstream:
+    """
+    One pipeline stage against an upstream provider: per-attempt timeouts
+    capped by the request deadline, the provider's circuit breaker, and
+    hedging once the stage has min_samples successful latencies to take a
+    p95 from. Hedges are never sent sooner than min_hedge_delay.
+
+    With slots, each attempt first waits for a concurrency slot, bounded only
+    by the request deadline; the attempt timeout, the latency samples and the
+    hedge delay all start once the slot is held, so local queueing is never
+    mistaken for a slow provider.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        breaker: CircuitBreaker,
+        timeout: Optional[float] = None,
+        hedge: bool = True,
+        min_hedge_delay: float = 1.0,
+        min_samples: int = 20,
+        sample_size: int = 200,
+        slots: Optional[Slots] = None,
+    ):
+        self.name = name
+        self.slots = slots
+        self.breaker = breaker
+        self.timeout = timeout
+        self.hedge = hedge
+        self.min_hedge_delay = min_hedge_delay
+        self.min_samples = min_samples
+        self._latencies: Deque[float] = deque(maxlen=sample_size)
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.failures = 0
+
+    def hedge_delay(self) -> Optional[float]:
+        """Seconds to wait before hedging: the recent p95, or None until enough samples"""
+        if not self.hedge or len(self._latencies) < self.min_samples:
+            return None
+        ordered = sorted(self._latencies)
+        p95 = ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+        return max(self.min_hedge_delay, p95)
+
+    async def _attempt(self, attempt: Attempt, hedged: bool, acquired: Optional[asyncio.Event] = None) -> Any:
+        slots = self.slots() if self.slots is not None else None
+        if slots is not None:
+            try:
+                await asyncio.wait_for(slots.acquire(), remaining())
+            except asyncio.TimeoutError as exc:
+                raise DeadlineExceeded(f"{self.name}: request deadline exceeded waiting for a slot") from exc
+        try:
+            if acquired is not None:
+                acquired.set()
+            timeout = stage_timeout(self.timeout)
+            started = time.monotonic()
+            try:
+                result = await asyncio.wait_for(attempt(hedged), timeout)
+            except asyncio.TimeoutError as exc:
+                left = remaining()
+                if left is not None and left <= 0.001:
+                    raise DeadlineExceeded(f"{self.name}: request deadline exceeded") from exc
+                raise TimeoutError(f"{self.name} timed out after {timeout:.1f}s") from exc
+            self._latencies.append(time.monotonic() - started)
+            return result
+        finally:
+            if slots is not None:
+                slots.release()
+
+    async def call(self, attempt: Attempt) -> Any:
+        """
+        Run attempt(False), hedging with attempt(True) past the stage p95.
+
+        Raises:
+            CircuitOpenError: if the provider's circuit is open.
+            DeadlineExceeded: if the request deadline passed.
+            Exception: the error of the last failed attempt.
+        """
+        stage_timeout()
+        self.breaker.allow()
+        self.calls += 1
+        tasks: Set[asyncio.Task] = set()
+        outcome_recorded = False
+        try:
+            acquired = asyncio.Event()
+            primary = asyncio.create_task(self._attempt(attempt, False, acquired))
+            tasks.add(primary)
+            delay = self.hedge_delay()
+            if delay is not None:
+                # The hedge delay counts from when the primary got its slot
+                holding = asyncio.create_task(acquired.wait())
+                try:
+                    await asyncio.wait({primary, holding}, return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    holding.cancel()
+                done, _ = await asyncio.wait({primary}, timeout=delay)
+                left = remaining()
+                if not done and (left is None or left > 0):
+                    self.hedged += 1
+                    hedged_calls.inc(stage=self.name)
+                    logger.info(f"Hedging {self.name} after {delay:.2f}s")
+                    tasks.add(asyncio.create_task(self._attempt(attempt, True)))
+
+            winner = await self._first_success(tasks)
+        except DeadlineExceeded:
+            # The request ran out of time, not necessarily the provider's fault
+            raise
+        except Exception:
+            self.failures += 1
+            self.breaker.record_failure()
+            outcome_recorded = True
+            raise
+        finally:
+            for task in tasks:
+                task.cancel()
+            if not outcome_recorded:
+                self.breaker.release()
+
+        if winner is not primary:
+            self.hedge_wins += 1
+            hedge_wins.inc(stage=self.name)
+        self.breaker.record_success()
+        return winner.result()
+
+    @staticmethod
+    async def _first_success(tasks: Set[asyncio.Task]) -> asyncio.Task:
+        pending = set(tasks)
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task
+                error = task.exception()
+        raise error
+
+    def stats(self) -> Dict[str, Any]:
+        """Hedge rate, hedge win rate and the current hedge delay"""
+        delay = self.hedge_delay()
+        return {
+            'calls': self.calls,
+            'failures': self.failures,
+            'hedged': self.hedged,
+            'hedgeWins': self.hedge_wins,
+            'hedgeRate': round(self.hedged / self.calls, 4) if self.calls else 0.0,
+            'hedgeWinRate': round(self.hedge_wins / self.hedged, 4) if self.hedged else 0.0,
+            'hedgeDelaySeconds': round(delay, 3) if delay is not None else None,
+            'circuit': self.breaker.name,
+        }
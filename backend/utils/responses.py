@@ -0,0 +1,159 @@
+"""
+Response encoding: fast JSON, ETags and gzip/brotli compression
+
+FastJSONResponse encodes bodies with orjson when it is installed. etag_json()
+tags a body with a hash of its bytes and answers a matching If-None-Match
+with 304, so unchanged dashboard polls move no payload. CompressionMiddleware
+compresses responses past a size threshold with brotli (optional package)
+or gzip, whichever the client accepts.
+"""
+import hashlib
+import json
+from typing import Any, Optional
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, bodies are then encoded with the json module
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, clients are then served gzip
+    brotli = None
+
+# Already compressed, or streamed event by event (the types GZipMiddleware skips)
+UNCOMPRESSED_CONTENT_TYPES = (
+    "text/event-stream", "image/", "audio/", "video/", "font/woff",
+    "application/gzip", "application/x-gzip", "application/zip", "application/grpc",
+)
+
+
+def dumps(content: Any) -> bytes:
+    """Encode content as compact UTF-8 JSON"""
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse encoded with orjson when available"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against etag"""
+    if not if_none_match:
+        return False
+    opaque = etag.removeprefix("W/")
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == opaque:
+            return True
+    return False
+
+
+def etag_json(request: Request, content: Any) -> Response:
+    """
+    JSON response with an ETag of its body, or an empty 304 when the request's
+    If-None-Match already names that ETag. The tag is weak because compression
+    changes the bytes on the wire, not the representation.
+    """
+    body = dumps(content)
+    etag = f'W/"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+
+class _BrotliResponder:
+    """Brotli-encodes one response, buffering nothing past the first body chunk"""
+
+    def __init__(self, app, minimum_size: int, quality: int):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.quality = quality
+        self.send = None
+        self.start_message = None
+        self.passthrough = False
+        self.compressor = None
+
+    async def __call__(self, scope, receive, send):
+        self.send = send
+        await self.app(scope, receive, self.send_compressed)
+
+    async def send_compressed(self, message):
+        message_type = message["type"]
+        if message_type == "http.response.start":
+            headers = Headers(raw=message.get("headers", []))
+            content_type = headers.get("content-type", "")
+            self.passthrough = "content-encoding" in headers or any(
+                content_type.startswith(excluded) for excluded in UNCOMPRESSED_CONTENT_TYPES
+            )
+            if self.passthrough:
+                await self.send(message)
+            else:
+                self.start_message = message
+            return
+        if message_type != "http.response.body" or self.passthrough:
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.start_message is not None:
+            start, self.start_message = self.start_message, None
+            if not more_body and len(body) < self.minimum_size:
+                self.passthrough = True
+                await self.send(start)
+                await self.send(message)
+                return
+            headers = MutableHeaders(raw=list(start.get("headers", [])))
+            headers["Content-Encoding"] = "br"
+            headers.add_vary_header("Accept-Encoding")
+            if more_body:
+                self.compressor = brotli.Compressor(quality=self.quality)
+                del headers["Content-Length"]
+            else:
+                body = brotli.compress(body, quality=self.quality)
+                headers["Content-Length"] = str(len(body))
+            await self.send({**start, "headers": headers.raw})
+            if self.compressor is None:
+                await self.send({"type": "http.response.body", "body": body})
+                return
+
+        chunk = self.compressor.process(body)
+        chunk += self.compressor.finish() if not more_body else self.compressor.flush()
+        await self.send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+
+class CompressionMiddleware:
+    """
+    Compresses responses of at least minimum_size bytes: brotli when the
+    package is installed, brotli_quality is 0-11 (None or -1 turns it off)
+    and the client accepts "br", gzip otherwise. Server-Sent Events and
+    images are never compressed.
+    """
+
+    def __init__(self, app, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: Optional[int] = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        usable = brotli is not None and brotli_quality is not None and 0 <= brotli_quality <= 11
+        self.brotli_quality = brotli_quality if usable else None
+        self.gzip = GZipMiddleware(app, minimum_size=minimum_size, compresslevel=gzip_level)
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] == "http"
+            and self.brotli_quality is not None
+            and "br" in Headers(scope=scope).get("accept-encoding", "")
+        ):
+            await _BrotliResponder(self.app, self.minimum_size, self.brotli_quality)(scope, receive, send)
+            return
+        await self.gzip(scope, receive, send)
@@ -0,0 +1,404 @@
+"""
+SQLite (WAL) storage engine for users and scans
+
+Usage:
+    python -m utils.sqlite_store migrate [--force]
+    python -m utils.sqlite_store rebuild-stats
+"""
+import json
+import logging
+import sqlite3
+import sys
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+from config import settings
+from utils.pagination import encode_cursor, decode_cursor
+from utils.timestamps import date_range_bounds, parse_timestamp, sortable_timestamp
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = Path(settings.data_dir)
+USERS_FILE = DATA_DIR / "users.json"
+SCANS_FILE = DATA_DIR / "scans.json"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS scans (
+    pk INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_scans_user_timestamp ON scans (user_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_scans_user_scan_id ON scans (user_id, id);
+CREATE TABLE IF NOT EXISTS user_stats (
+    user_id TEXT PRIMARY KEY,
+    total_scans INTEGER NOT NULL,
+    score_sum REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS user_daily_stats (
+    user_id TEXT NOT NULL,
+    day TEXT NOT NULL,
+    scans INTEGER NOT NULL,
+    safe INTEGER NOT NULL,
+    PRIMARY KEY (user_id, day)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+_lock = threading.RLock()
+_conn: Optional[sqlite3.Connection] = None
+
+
+def _connect() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        with _lock:
+            if _conn is None:
+                db_path = Path(settings.database_file)
+                db_path.parent.mkdir(parents=True, exist_ok=True)
+                conn = sqlite3.connect(str(db_path), check_same_thread=False, isolation_level=None)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                conn.execute("PRAGMA busy_timeout=5000")
+                conn.executescript(SCHEMA)
+                _conn = conn
+                migrate_from_json()
+                if not conn.execute("SELECT 1 FROM meta WHERE key = 'stats_built'").fetchone():
+                    rebuild_stats()
+    return _conn
+
+
+@contextmanager
+def _transaction() -> Iterator[sqlite3.Connection]:
+    """Serialize writers within the process and take the write lock up front"""
+    conn = _connect()
+    with _lock:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+
+def _query(sql: str, params: tuple = ()) -> List[tuple]:
+    conn = _connect()
+    with _lock:
+        return conn.execute(sql, params).fetchall()
+
+
+def _load_user(conn: sqlite3.Connection, user_id: str) -> Optional[Dict]:
+    row = conn.execute("SELECT data FROM users WHERE id = ?", (user_id,)).fetchone()
+    return json.loads(row[0]) if row else None
+
+
+def _save_user(conn: sqlite3.Connection, user: Dict) -> None:
+    conn.execute(
+        "INSERT OR REPLACE INTO users (id, data) VALUES (?, ?)",
+        (user['id'], json.dumps(user, ensure_ascii=False)),
+    )
+
+
+def _insert_scan(conn: sqlite3.Connection, user_id: str, scan: Dict) -> None:
+    conn.execute(
+        "INSERT INTO scans (id, user_id, timestamp, data) VALUES (?, ?, ?, ?)",
+        (scan['id'], user_id, sortable_timestamp(scan.get('timestamp')), json.dumps(scan, ensure_ascii=False)),
+    )
+
+
+def _update_stats(conn: sqlite3.Connection, user_id: str, scan: Dict) -> None:
+    """Fold one new scan into the user's running aggregates"""
+    conn.execute(
+        "INSERT INTO user_stats (user_id, total_scans, score_sum) VALUES (?, 1, ?) "
+        "ON CONFLICT (user_id) DO UPDATE SET total_scans = total_scans + 1, score_sum = score_sum + excluded.score_sum",
+        (user_id, scan.get('safetyScore') or 0),
+    )
+    day = sortable_timestamp(scan.get('timestamp'))[:10]
+    if day:
+        conn.execute(
+            "INSERT INTO user_daily_stats (user_id, day, scans, safe) VALUES (?, ?, 1, ?) "
+            "ON CONFLICT (user_id, day) DO UPDATE SET scans = scans + 1, safe = safe + excluded.safe",
+            (user_id, day, 1 if scan.get('isSafe', False) else 0),
+        )
+
+
+# User operations
+def get_user(user_id: str) -> Optional[Dict]:
+    """Get user by ID"""
+    rows = _query("SELECT data FROM users WHERE id = ?", (user_id,))
+    return json.loads(rows[0][0]) if rows else None
+
+
+def create_or_update_user(user_data: Dict) -> Dict:
+    """Create or update user"""
+    user_id = user_data.get('id')
+    if not user_id:
+        raise ValueError("User ID is required")
+
+    with _transaction() as conn:
+        existing_user = _load_user(conn, user_id) or {}
+
+        # Preserve existing preferences if not provided in update
+        user = {
+            **existing_user,
+            **user_data,
+            'id': user_id,
+            'createdAt': existing_user.get('createdAt') or user_data.get('createdAt'),
+            'scans': existing_user.get('scans', []),
+            'allergies': user_data.get('allergies') if 'allergies' in user_data else existing_user.get('allergies'),
+            'dietGoals': user_data.get('dietGoals') if 'dietGoals' in user_data else existing_user.get('dietGoals'),
+            'avoidIngredients': user_data.get('avoidIngredients') if 'avoidIngredients' in user_data else existing_user.get('avoidIngredients'),
+        }
+        _save_user(conn, user)
+    return user
+
+
+def update_user_preferences(user_id: str, preferences: Dict) -> Optional[Dict]:
+    """Update user preferences"""
+    with _transaction() as conn:
+        user = _load_user(conn, user_id)
+        if not user:
+            return None
+
+        for key in ('allergies', 'dietGoals', 'avoidIngredients'):
+            if key in preferences:
+                user[key] = preferences[key] if preferences[key] else []
+
+        _save_user(conn, user)
+    return user
+
+
+# Scan operations
+def get_user_scans(user_id: str, limit: Optional[int] = None) -> List[Dict]:
+    """Get scans for a user, most recent first"""
+    sql = "SELECT data FROM scans WHERE user_id = ? ORDER BY timestamp DESC, pk DESC"
+    params: tuple = (user_id,)
+    if limit:
+        sql += " LIMIT ?"
+        params += (limit,)
+    return [json.loads(row[0]) for row in _query(sql, params)]
+
+
+def get_user_scans_page(
+    user_id: str,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    before: Optional[str] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    is_safe: Optional[bool] = None,
+    min_score: Optional[float] = None,
+    max_score: Optional[float] = None,
+) -> Dict:
+    """
+    Get one page of a user's scans, most recent first. Seeks straight to the
+    cursor position on the (user_id, timestamp) index.
+    """
+    clauses = ["user_id = ?"]
+    params: list = [user_id]
+
+    if cursor:
+        values = decode_cursor(cursor)
+        if (
+            len(values) != 2
+            or not isinstance(values[0], str)
+            or not isinstance(values[1], int)
+            or isinstance(values[1], bool)
+        ):
+            raise ValueError("Invalid cursor")
+        clauses.append("(timestamp, pk) < (?, ?)")
+        params += values
+    elif before:
+        if parse_timestamp(before):
+            clauses.append("timestamp < ?")
+            params.append(sortable_timestamp(before))
+        else:
+            anchor = _query("SELECT timestamp, pk FROM scans WHERE user_id = ? AND id = ?", (user_id, before))
+            if not anchor:
+                raise ValueError(f"Unknown scan id: {before}")
+            clauses.append("(timestamp, pk) < (?, ?)")
+            params += list(anchor[0])
+
+    start, end = date_range_bounds(start_date, end_date)
+    if start:
+        clauses.append("timestamp >= ?")
+        params.append(start)
+    if end:
+        clauses.append("timestamp < ? AND timestamp != ''")
+        params.append(end)
+    if is_safe is not None:
+        clauses.append("COALESCE(json_extract(data, '$.isSafe'), 0) = ?")
+        params.append(1 if is_safe else 0)
+    if min_score is not None:
+        clauses.append("json_extract(data, '$.safetyScore') >= ?")
+        params.append(min_score)
+    if max_score is not None:
+        clauses.append("json_extract(data, '$.safetyScore') <= ?")
+        params.append(max_score)
+
+    sql = f"SELECT timestamp, pk, data FROM scans WHERE {' AND '.join(clauses)} ORDER BY timestamp DESC, pk DESC"
+    if limit:
+        sql += " LIMIT ?"
+        params.append(limit + 1)
+    rows = _query(sql, tuple(params))
+
+    next_cursor = None
+    if limit and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([rows[-1][0], rows[-1][1]])
+    return {
+        'scans': [json.loads(row[2]) for row in rows],
+        'nextCursor': next_cursor,
+    }
+
+
+def add_user_scan(user_id: str, scan_data: Dict) -> Dict:
+    """Add a scan for a user"""
+    with _transaction() as conn:
+        row = conn.execute("SELECT total_scans FROM user_stats WHERE user_id = ?", (user_id,)).fetchone()
+        count = row[0] if row else 0
+        scan = {
+            **scan_data,
+            'id': scan_data.get('id') or f"scan_{user_id}_{count}",
+            'timestamp': scan_data.get('timestamp') or datetime.utcnow().isoformat() + 'Z',
+        }
+        _insert_scan(conn, user_id, scan)
+        _update_stats(conn, user_id, scan)
+    return scan
+
+
+def get_user_stats(user_id: str) -> Optional[Dict]:
+    """Get statistics for a user from the incrementally maintained aggregates"""
+    totals = _query("SELECT total_scans, score_sum FROM user_stats WHERE user_id = ?", (user_id,))
+    total, score_sum = totals[0] if totals else (0, 0)
+    today = _query(
+        "SELECT scans, safe FROM user_daily_stats WHERE user_id = ? AND day = ?",
+        (user_id, datetime.utcnow().date().isoformat()),
+    )
+    today_scans, safe_today = today[0] if today else (0, 0)
+    return {
+        'totalScans': total,
+        'todayScans': today_scans,
+        'safeToday': safe_today,
+        'riskyToday': today_scans - safe_today,
+        'averageScore': int(score_sum / total) if total else 0,
+    }
+
+
+def iter_scan_products(batch_size: int = 5000) -> Iterator[Tuple[str, str]]:
+    """
+    Stream (productName, timestamp) of every scan in batches, on a read-only
+    connection of its own so a long scan doesn't hold the writer lock
+    """
+    _connect()
+    conn = sqlite3.connect(f"{Path(settings.database_file).resolve().as_uri()}?mode=ro", uri=True)
+    try:
+        cursor = conn.execute("SELECT json_extract(data, '$.productName'), timestamp FROM scans")
+        while rows := cursor.fetchmany(batch_size):
+            yield from rows
+    finally:
+        conn.close()
+
+
+def rebuild_stats() -> None:
+    """Recompute every user's aggregates from the scan history"""
+    with _transaction() as conn:
+        conn.execute("DELETE FROM user_stats")
+        conn.execute("DELETE FROM user_daily_stats")
+        conn.execute(
+            "INSERT INTO user_stats (user_id, total_scans, score_sum) "
+            "SELECT user_id, COUNT(*), COALESCE(SUM(json_extract(data, '$.safetyScore')), 0) "
+            "FROM scans GROUP BY user_id"
+        )
+        conn.execute(
+            "INSERT INTO user_daily_stats (user_id, day, scans, safe) "
+            "SELECT user_id, substr(timestamp, 1, 10), COUNT(*), "
+            "SUM(COALESCE(json_extract(data, '$.isSafe'), 0) = 1) "
+            "FROM scans WHERE timestamp != '' GROUP BY user_id, substr(timestamp, 1, 10)"
+        )
+        conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('stats_built', ?)",
+            (datetime.utcnow().isoformat() + 'Z',),
+        )
+    logger.info("Rebuilt user stats aggregates from scan history")
+
+
+# Migration
+def migrate_from_json(force: bool = False) -> bool:
+    """
+    Import users.json and scans.json into SQLite once. Returns True if a
+    migration ran. Pass force=True to re-import into empty tables.
+    """
+    conn = _conn
+    with _lock:
+        done = conn.execute("SELECT value FROM meta WHERE key = 'json_migrated'").fetchone()
+        if done and not force:
+            return False
+
+        users = _read_json(USERS_FILE)
+        scans = _read_json(SCANS_FILE)
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for user in users.values():
+                if user.get('id'):
+                    _save_user(conn, user)
+            scan_count = 0
+            for user_id, user_scans in scans.items():
+                # JSON stores most recent first, insert oldest first
+                for scan in reversed(user_scans):
+                    _insert_scan(conn, user_id, scan)
+                    _update_stats(conn, user_id, scan)
+                    scan_count += 1
+            conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('json_migrated', ?)",
+                (datetime.utcnow().isoformat() + 'Z',),
+            )
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    logger.info(f"Migrated {len(users)} users and {scan_count} scans from JSON to {settings.database_file}")
+    return True
+
+
+def _read_json(file_path: Path) -> Dict:
+    if not file_path.exists():
+        return {}
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (json.JSONDecodeError, IOError) as e:
+        logger.error(f"Error reading {file_path}: {e}")
+        return {}
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    if command not in ("migrate", "rebuild-stats"):
+        print(__doc__)
+        sys.exit(1)
+    _connect()
+    if command == "rebuild-stats":
+        rebuild_stats()
+    elif "--force" in sys.argv:
+        with _transaction() as conn:
+            conn.execute("DELETE FROM scans")
+            conn.execute("DELETE FROM users")
+            conn.execute("DELETE FROM user_stats")
+            conn.execute("DELETE FROM user_daily_stats")
+        migrate_from_json(force=True)
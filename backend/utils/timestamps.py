@@ -0,0 +1,43 @@
+"""
+Helpers for the ISO timestamps stored on scans
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Tuple
+
+
+def parse_timestamp(value: Optional[str]) -> Optional[datetime]:
+    """Parse an ISO timestamp (with or without Z/offset) into a naive UTC datetime"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except (ValueError, TypeError, AttributeError):
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def sortable_timestamp(value: Optional[str]) -> str:
+    """Canonical UTC timestamp string that sorts chronologically"""
+    parsed = parse_timestamp(value)
+    return parsed.isoformat(timespec='microseconds') if parsed else ''
+
+
+def date_range_bounds(start_date: Optional[str], end_date: Optional[str]) -> Tuple[str, str]:
+    """
+    Convert a user supplied date range into sortable [start, end) bounds.
+    A date-only end_date includes that whole day. Empty strings mean unbounded.
+    """
+    start = sortable_timestamp(start_date) if start_date else ''
+    end = ''
+    if end_date:
+        parsed = parse_timestamp(end_date)
+        if parsed is None:
+            raise ValueError(f"Invalid end_date: {end_date}")
+        if len(end_date) == 10:
+            parsed += timedelta(days=1)
+        end = parsed.isoformat(timespec='microseconds')
+    if start_date and not start:
+        raise ValueError(f"Invalid start_date: {start_date}")
+    return start, end
@@ -33,8 +33,8 @@ export default function ScanResult({ imageData, onBack }: ScanResultProps) {
     if (!analysisResponse) return null;
 
     try {
-      const scoringData = JSON.parse(analysisResponse.scoring_data);
-      console.log('Parsed scoring data:', scoringData);
+      const scoringData = analysisResponse.scoring_data;
+      console.log('Scoring data:', scoringData);
       
       const overallScore = Math.round(scoringData.overall_score * 10); // Convert 0-10 to 0-100
       
@@ -162,9 +162,19 @@ export default function ScanResult({ imageData, onBack }: ScanResultProps) {
         const recs = recommendations.recommendations;
         console.log('Recommendations from object.recommendations:', recs);
         return recs.map((r: any, index: number) => {
-          const healthScoreStr = String(r.health_score || "70");
-          const match = healthScoreStr.match(/\d+/);
-          const score = match ? parseInt(match[0], 10) : 70;
+          // Parse health_score to number (try to extract number from string)
+          // health_score is likely on 0-10 scale, convert to 0-100
+          const healthScoreStr = String(r.health_score || "7");
+          const match = healthScoreStr.match(/\d+(\.\d+)?/);
+          let score = match ? parseFloat(match[0]) : 7;
+
+          // If score is <= 10, assume it's on 0-10 scale and convert to 0-100
+          // Otherwise, assume it's already on 0-100 scale
+          if (score <= 10) {
+            score = Math.round(score * 10);
+          } else {
+            score = Math.round(score);
+          }
 
           return {
             id: `rec-${index}-${r.product_name || `rec-${index}`}`,
@@ -257,8 +267,7 @@ export default function ScanResult({ imageData, onBack }: ScanResultProps) {
         // After successful analysis, fetch recommendations
         if (data.product_name && data.scoring_data) {
           try {
-            const scoringData = JSON.parse(data.scoring_data);
-            const overallScore = scoringData.overall_score;
+            const overallScore = data.scoring_data.overall_score;
             
             setIsLoadingRecommendations(true);
             setRecommendationsError(null);
@@ -266,9 +275,8 @@ export default function ScanResult({ imageData, onBack }: ScanResultProps) {
             const recData = await getRecommendations(data.product_name, overallScore);
             console.log('✅ Recommendations Response:', JSON.stringify(recData, null, 2));
             
-            // Handle the response structure - reccomender_data is a JSON string
+            // Handle the response structure - reccomender_data is an object with a recommendations array
             if (recData.reccomender_data) {
-              // reccomender_data is a JSON string that needs to be parsed
               console.log('Setting recommendations from reccomender_data:', recData.reccomender_data);
               setRecommendations(recData.reccomender_data);
             } else if (recData.recommendations) {